@@ -12,6 +12,7 @@ import { LambdaDestination } from 'aws-cdk-lib/aws-s3-notifications';
 import * as sqs from 'aws-cdk-lib/aws-sqs';
 import * as lambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources';
 import * as opensearchserverless from 'aws-cdk-lib/aws-opensearchserverless';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import { CommonUtils } from './utils';
 
 import {
@@ -50,10 +51,48 @@ new aws_ssm.StringParameter(backend.stack, 'IndexConfigTableParam', {
   stringValue: backend.data.resources.tables["IndexConfig"].tableName
 });
 
+// content-addressed embedding cache shared by ingestItems and findRelatedItems, entries expire via TTL
+const embeddingCacheTable = new dynamodb.Table(backend.stack, 'EmbeddingCacheTable', {
+  partitionKey: { name: 'cacheKey', type: dynamodb.AttributeType.STRING },
+  billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+  timeToLiveAttribute: 'expiresAt',
+  removalPolicy: cdk.RemovalPolicy.DESTROY,
+});
+
+new aws_ssm.StringParameter(backend.stack, 'EmbeddingCacheTableParam', {
+  parameterName: `/${process.env.AWS_BRANCH}/EMBEDDING_CACHE_TABLE`,
+  stringValue: embeddingCacheTable.tableName
+});
+
+// checkpoints of file ingestion jobs, so large files are ingested across several invocations
+const ingestJobTable = new dynamodb.Table(backend.stack, 'IngestJobTable', {
+  partitionKey: { name: 'fileKey', type: dynamodb.AttributeType.STRING },
+  billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+  removalPolicy: cdk.RemovalPolicy.DESTROY,
+});
+
+new aws_ssm.StringParameter(backend.stack, 'IngestJobTableParam', {
+  parameterName: `/${process.env.AWS_BRANCH}/INGEST_JOB_TABLE`,
+  stringValue: ingestJobTable.tableName
+});
+
+// state of the title grouping job of each index, so grouping a large index continues across invocations
+const groupJobTable = new dynamodb.Table(backend.stack, 'GroupJobTable', {
+  partitionKey: { name: 'indexName', type: dynamodb.AttributeType.STRING },
+  billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+  removalPolicy: cdk.RemovalPolicy.DESTROY,
+});
+
+new aws_ssm.StringParameter(backend.stack, 'GroupJobTableParam', {
+  parameterName: `/${process.env.AWS_BRANCH}/GROUP_JOB_TABLE`,
+  stringValue: groupJobTable.tableName
+});
+
 const cfnIngestItemsFunction = customFunctionsStack.node.findChild('ingestItemsFunction') as lambda.Function;
 const cfnFindRelatedItemsFunction = customFunctionsStack.node.findChild('findRelatedItemsFunction') as lambda.Function;
 const cfnCreateIndexFunction = customFunctionsStack.node.findChild('createIndexFunction') as lambda.Function;
 const cfnGetAllIndexesFunction = customFunctionsStack.node.findChild('getAllIndexesFunction') as lambda.Function;
+const cfnGroupItemsFunction = customFunctionsStack.node.findChild('groupItemsFunction') as lambda.Function;
 
 const appPrefix = vars.APP_PREFIX;
 
@@ -98,7 +137,7 @@ const dataAccessPolicy = new opensearchserverless.CfnAccessPolicy(backend.stack,
       "Permission": ["aoss:CreateIndex", "aoss:DeleteIndex", "aoss:UpdateIndex", "aoss:DescribeIndex", "aoss:ReadDocument", "aoss:WriteDocument", "aoss:*"],
       "ResourceType": "index"
     }],
-    "Principal": [cfnIngestItemsFunction.role!.roleArn, cfnFindRelatedItemsFunction.role!.roleArn, cfnCreateIndexFunction.role!.roleArn, cfnGetAllIndexesFunction.role!.roleArn],
+    "Principal": [cfnIngestItemsFunction.role!.roleArn, cfnFindRelatedItemsFunction.role!.roleArn, cfnCreateIndexFunction.role!.roleArn, cfnGetAllIndexesFunction.role!.roleArn, cfnGroupItemsFunction.role!.roleArn],
     "Description": "Rule 1"
   }])
 });
@@ -136,6 +175,8 @@ const restAPI = new RestApi(apiStack, "RestApi", {
   deployOptions: {
     stageName: process.env.AWS_BRANCH,
   },
+  // responses of 1 KB and more are gzip-compressed for clients sending Accept-Encoding, e.g. related item results
+  minCompressionSize: cdk.Size.kibibytes(1),
   defaultCorsPreflightOptions: {
     allowOrigins: ["*"], //['*.amplifyapp.com', 'http://localhost:3000'], // Restrict this to domains you trust
     allowMethods: Cors.ALL_METHODS, // Specify only the methods you need to allow
@@ -173,6 +214,22 @@ relatedItemsPath.addMethod("POST", relatedItemsLambdaIntegration, {
   authorizationType: AuthorizationType.NONE,
 });
 
+// resolves the related items of several source items in one call
+const relatedItemsBatchPath = relatedItemsPath.addResource("batch", {
+  defaultMethodOptions: {
+    authorizationType: AuthorizationType.NONE,
+  },
+  defaultCorsPreflightOptions: {
+    allowOrigins: ["*"],
+    allowMethods: Cors.ALL_METHODS,
+    allowHeaders: Cors.DEFAULT_HEADERS,
+  },
+});
+
+relatedItemsBatchPath.addMethod("POST", relatedItemsLambdaIntegration, {
+  authorizationType: AuthorizationType.NONE,
+});
+
 const createIndexPath = restAPI.root.addResource("create-index", {
   defaultMethodOptions: {
     authorizationType: AuthorizationType.NONE,
@@ -211,6 +268,25 @@ getAllIndexesPath.addMethod("POST", getAllIndexesLambdaIntegration, {
   authorizationType: AuthorizationType.NONE,
 });
 
+const groupItemsPath = restAPI.root.addResource("group-items", {
+  defaultMethodOptions: {
+    authorizationType: AuthorizationType.NONE,
+  },
+  defaultCorsPreflightOptions: {
+    allowOrigins: ["*"],
+    allowMethods: Cors.ALL_METHODS,
+    allowHeaders: Cors.DEFAULT_HEADERS,
+  },
+});
+
+const groupItemsLambdaIntegration = new LambdaIntegration(
+  cfnGroupItemsFunction
+);
+
+groupItemsPath.addMethod("POST", groupItemsLambdaIntegration, {
+  authorizationType: AuthorizationType.NONE,
+});
+
 // Add IAM permissions for Bedrock
 const bedrockPolicy = new PolicyStatement({
   actions: ["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
@@ -260,6 +336,8 @@ const opensearchPolicy = new PolicyStatement({
 cfnIngestItemsFunction.addToRolePolicy(dynamoJobStatusPolicy);
 cfnIngestItemsFunction.addToRolePolicy(ssmPolicy);
 cfnIngestItemsFunction.addToRolePolicy(s3Policy);
+// snapshots of the indexes searched in-process are uploaded to the asset bucket
+cfnIngestItemsFunction.addToRolePolicy(s3UploadPolicy);
 cfnIngestItemsFunction.addToRolePolicy(bedrockPolicy);
 cfnIngestItemsFunction.addToRolePolicy(opensearchPolicy);
 
@@ -270,12 +348,47 @@ const dynamoIndexConfigPolicy = new PolicyStatement({
 
 cfnIngestItemsFunction.addToRolePolicy(dynamoIndexConfigPolicy);
 
+const dynamoProcessingQueueBatchPolicy = new PolicyStatement({
+  actions: ["dynamodb:BatchWriteItem"],
+  resources: ["*"],
+});
+
+cfnIngestItemsFunction.addToRolePolicy(dynamoProcessingQueueBatchPolicy);
+
+const dynamoEmbeddingCachePolicy = new PolicyStatement({
+  actions: ["dynamodb:BatchGetItem", "dynamodb:BatchWriteItem"],
+  resources: ["*"],
+});
+
+cfnIngestItemsFunction.addToRolePolicy(dynamoEmbeddingCachePolicy);
+
+// ingestItems continues large files by invoking itself asynchronously
+const selfInvokePolicy = new PolicyStatement({
+  actions: ["lambda:InvokeFunction"],
+  resources: ["*"],
+});
+
+cfnIngestItemsFunction.addToRolePolicy(selfInvokePolicy);
+
 cfnFindRelatedItemsFunction.addToRolePolicy(dynamoJobStatusPolicy);
+cfnFindRelatedItemsFunction.addToRolePolicy(dynamoIndexConfigPolicy);
+cfnFindRelatedItemsFunction.addToRolePolicy(dynamoEmbeddingCachePolicy);
 cfnFindRelatedItemsFunction.addToRolePolicy(ssmPolicy);
 cfnFindRelatedItemsFunction.addToRolePolicy(s3Policy);
 cfnFindRelatedItemsFunction.addToRolePolicy(bedrockPolicy);
 cfnFindRelatedItemsFunction.addToRolePolicy(opensearchPolicy);
 
+cfnGroupItemsFunction.addToRolePolicy(dynamoJobStatusPolicy);
+cfnGroupItemsFunction.addToRolePolicy(dynamoIndexConfigPolicy);
+cfnGroupItemsFunction.addToRolePolicy(dynamoProcessingQueueBatchPolicy);
+cfnGroupItemsFunction.addToRolePolicy(dynamoEmbeddingCachePolicy);
+cfnGroupItemsFunction.addToRolePolicy(selfInvokePolicy);
+cfnGroupItemsFunction.addToRolePolicy(ssmPolicy);
+cfnGroupItemsFunction.addToRolePolicy(s3Policy);
+cfnGroupItemsFunction.addToRolePolicy(s3UploadPolicy);
+cfnGroupItemsFunction.addToRolePolicy(bedrockPolicy);
+cfnGroupItemsFunction.addToRolePolicy(opensearchPolicy);
+
 cfnCreateIndexFunction.addToRolePolicy(opensearchPolicy);
 cfnCreateIndexFunction.addToRolePolicy(ssmPolicy);
 cfnCreateIndexFunction.addToRolePolicy(dynamoJobStatusPolicy);
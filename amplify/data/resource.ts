@@ -20,7 +20,15 @@ const schema = a.schema({
       fileName: a.string().required(),
       vectorFieldList: a.string().array().required(),
       exactFieldList: a.string().array().required(),
+      identifierFieldList: a.string().array(),
+      // HNSW profile the index was created with, see createIndex/index_profiles.py
+      indexProfile: a.json(),
+      // float, or compact int8 or binary vectors, used to embed documents and queries of the index
+      embeddingType: a.string(),
       searchConfig: a.string(),
+      // bumped whenever items are written to the index, invalidating cached related-item results
+      indexGeneration: a.integer(),
+      indexGenerationUpdatedAt: a.integer(),
       userId: a.string().required(),
       updatedAt: a.datetime().required(),
       createdAt: a.datetime().required(),
@@ -45,6 +45,8 @@ export const vars = {
     ASSET_S3_BUCKET_NAME: appPrefix + '-assets',
     API_PATHS: {
         FIND_RELATED_ITEMS: 'related-items',
+        FIND_RELATED_ITEMS_BATCH: 'related-items/batch',
+        GROUP_ITEMS: 'group-items',
         CREATE_INDEX: 'create-index',
         GET_ALL_INDEXES: 'get-all-indexes'
     },
@@ -0,0 +1 @@
+"""Offline benchmark of the Python functions, see __main__.py"""
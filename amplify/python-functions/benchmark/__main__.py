@@ -0,0 +1,361 @@
+"""
+Offline benchmark of ingestion and related-item searches, without an AWS account or network.
+
+A synthetic catalog is loaded into a new index by the createIndex and ingestItems handlers, then related items of
+a sample of its items are searched with the findRelatedItems handler, single and batched, the way the mapper page
+calls it. Bedrock, DynamoDB, S3, SSM, Lambda and OpenSearch are replaced by the local stand-ins of
+benchmark/stand_ins.py, so the numbers measure the functions' own work plus the configured embedding latency.
+
+Usage (from amplify/python-functions, with the ingestItems and findRelatedItems requirements installed):
+    python -m benchmark                                   # 10k rows, 200 searches
+    python -m benchmark --rows 100000 --format parquet    # larger catalog
+    python -m benchmark --embed-latency-ms 150 --embed-per-text-ms 1  # Bedrock-like latency
+    python -m benchmark --output results.json             # save the results of this commit
+    python -m benchmark --baseline results.json --max-regression-pct 10  # fail on regressions
+    python -m benchmark --rows 20000 --search-backend local  # in-process search, with its parity with the index
+
+The in-process search backend searches vectors exhaustively, so at 1M rows prefer a smaller --dimension.
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+import numpy as np
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the handlers read these when they are imported
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('AWS_DEFAULT_REGION', os.environ['AWS_REGION'])
+os.environ.setdefault('AWS_BRANCH', 'benchmark')
+# results of a freshly loaded index are cached right away instead of after the settle time of OpenSearch Serverless
+os.environ.setdefault('RESULT_CACHE_SETTLE_SECONDS', '0')
+os.environ.pop('EMBEDDING_CACHE_SQLITE_PATH', None)
+os.environ.setdefault('ASSET_BUCKET_NAME', 'benchmark-bucket')
+
+sys.path.insert(0, FUNCTIONS_DIR)
+
+import shared.clients
+from shared.local_search import compare_with_opensearch
+from shared.search_queries import build_query, get_embedding_type, make_lean_query, parse_search_config
+from benchmark.catalog import FIELD_CONFIGURATION, generate_catalog, write_catalog
+from benchmark.stand_ins import FakeBedrockRuntime, FakeLambdaContext, install_stand_ins
+
+BUCKET = os.environ['ASSET_BUCKET_NAME']
+
+# Metrics compared with a baseline, and whether a higher value is better
+COMPARED_METRICS = [
+    ('ingest.rowsPerSecond', True),
+    ('find.single.p50Ms', False),
+    ('find.single.p99Ms', False),
+    ('find.repeat.p50Ms', False),
+    ('find.batch.p50Ms', False),
+    ('find.batch.p99Ms', False),
+]
+
+def load_handler(function_name):
+    """Import a function's index module under its own name, with its directory on the path like in its bundle"""
+    function_dir = os.path.join(FUNCTIONS_DIR, function_name)
+    sys.path.insert(1, function_dir)
+    spec = importlib.util.spec_from_file_location(f"{function_name}_index", os.path.join(function_dir, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def new_execution_environment():
+    """Forget the state shared.clients keeps across warm invocations, as a new Lambda execution environment would"""
+    shared.clients._cold_start = True
+    shared.clients._parameters = None
+    shared.clients._opensearch_clients.clear()
+    shared.clients._embedding_cache = None
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """Silence the logs of the handlers, which would otherwise dominate the run time"""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def to_json_value(value):
+    """DynamoDB items as the frontend receives them, numbers as ints or floats"""
+    if isinstance(value, Decimal):
+        return int(value) if value == int(value) else float(value)
+    if isinstance(value, dict):
+        return {key: to_json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, set)):
+        return [to_json_value(item) for item in value]
+    return value
+
+def latency_summary(latencies_ms):
+    if not latencies_ms:
+        return {'requests': 0}
+    values = np.asarray(latencies_ms)
+    return {
+        'requests': len(values),
+        'p50Ms': round(float(np.percentile(values, 50)), 2),
+        'p90Ms': round(float(np.percentile(values, 90)), 2),
+        'p99Ms': round(float(np.percentile(values, 99)), 2),
+        'meanMs': round(float(values.mean()), 2),
+        'maxMs': round(float(values.max()), 2),
+    }
+
+def create_index(create_handler, index_name, args):
+    body = {
+        'indexName': index_name,
+        'fieldConfiguration': FIELD_CONFIGURATION,
+        'fileName': f"catalog.{args.format}",
+        'userId': 'benchmark',
+        'indexProfile': args.index_profile,
+        'embeddingType': args.embedding_type,
+        'searchBackend': args.search_backend,
+    }
+    with quiet(args.verbose):
+        response = create_handler.lambda_handler({'body': json.dumps(body)}, FakeLambdaContext('createIndex'))
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"Creating index {index_name} failed: {response['body']}")
+
+def run_ingest(ingest_handler, stand_ins, file_key, rows, args):
+    """Ingest the uploaded catalog, running continuations until the file is done"""
+    event = {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': file_key}}}]}
+    invocations = 0
+    result = {}
+    stages_ms = {}
+    start = time.perf_counter()
+    while event is not None:
+        invocations += 1
+        with quiet(args.verbose):
+            response = ingest_handler.lambda_handler(event, FakeLambdaContext('ingestItems', args.ingest_timeout))
+        if response is None or response.get('statusCode') not in [200, 202]:
+            raise RuntimeError(f"Ingestion failed: {response}")
+        # the counts of the file are kept from the last invocation ingesting it, before e.g. a snapshot export
+        body = json.loads(response['body'])
+        result = {**result, **body}
+        for stage, total_ms in body.get('stagesMs', {}).items():
+            stages_ms[stage] = round(stages_ms.get(stage, 0) + total_ms, 1)
+        event = stand_ins.lambda_client.invocations.pop(0)[1] if stand_ins.lambda_client.invocations else None
+    seconds = time.perf_counter() - start
+
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 2),
+        'rowsPerSecond': round(rows / seconds, 1),
+        'invocations': invocations,
+        'indexedRows': result.get('indexedRows'),
+        'failedRows': result.get('failedRows'),
+        'peakRssMb': result.get('peakRssMb'),
+        'stagesMs': stages_ms,
+    }
+
+def parse_server_timing(header):
+    """{stage: ms} of a Server-Timing header such as 'embed;dur=84.2, search;dur=31.0'"""
+    timings = {}
+    for metric in (header or '').split(','):
+        name, _, duration = metric.strip().partition(';dur=')
+        if duration:
+            timings[name] = float(duration)
+    return timings
+
+def run_single_searches(find_handler, index_name, index_config, items, args):
+    latencies = []
+    stages = {}
+    errors = identifier_matches = cache_hits = 0
+    for item in items:
+        event = {
+            'resource': '/related-items',
+            'body': json.dumps({**item, 'indexName': index_name, 'opensearchQuery': index_config})
+        }
+        start = time.perf_counter()
+        with quiet(args.verbose):
+            response = find_handler.lambda_handler(event, FakeLambdaContext('findRelatedItems'))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        if response['statusCode'] != 200:
+            errors += 1
+            continue
+        identifier_matches += json.loads(response['body'])['_identifierMatch']
+        cache_hits += response['headers'].get('X-Cache') == 'HIT'
+        for stage, duration in parse_server_timing(response['headers'].get('Server-Timing')).items():
+            stages.setdefault(stage, []).append(duration)
+
+    # median time of each stage over the requests that ran it
+    stages_p50 = {stage: round(float(np.percentile(durations, 50)), 2) for stage, durations in stages.items() if stage != 'total'}
+    return {**latency_summary(latencies), 'errors': errors, 'identifierMatches': identifier_matches, 'cacheHits': cache_hits, 'stagesP50Ms': stages_p50}
+
+def run_batch_searches(find_handler, index_name, index_config, items, args):
+    latencies = []
+    errors = 0
+    for start in range(0, len(items), args.batch_size):
+        batch = items[start:start + args.batch_size]
+        event = {
+            'resource': '/related-items/batch',
+            'body': json.dumps({'items': batch, 'indexName': index_name, 'opensearchQuery': index_config, 'skipCache': True})
+        }
+        request_start = time.perf_counter()
+        with quiet(args.verbose):
+            response = find_handler.lambda_handler(event, FakeLambdaContext('findRelatedItems'))
+        latencies.append((time.perf_counter() - request_start) * 1000)
+        if response['statusCode'] != 200:
+            errors += len(batch)
+        else:
+            errors += sum('error' in result for result in json.loads(response['body'])['_results'])
+    summary = latency_summary(latencies)
+    if latencies:
+        summary['perItemMs'] = round(sum(latencies) / len(items), 2)
+    return {**summary, 'batchSize': args.batch_size, 'errors': errors}
+
+def check_parity(find_handler, index_name, index_config, items):
+    """Compare the results of the snapshot searched in-process with those of the search backend, for the queries of items"""
+    local_index = find_handler.get_local_index(index_name)
+    if local_index is None:
+        return {'error': 'no snapshot of the current generation of the index'}
+    search_config = parse_search_config(index_config)
+    queries = []
+    for item in items:
+        query, pending_vectors = build_query(search_config, item)
+        find_handler.embed_query_vectors(pending_vectors, get_embedding_type(index_config))
+        queries.append(make_lean_query(query))
+    return compare_with_opensearch(shared.clients.get_opensearch_client(), local_index, queries)
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=FUNCTIONS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', '.'], cwd=FUNCTIONS_DIR, capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def get_metric(results, path):
+    value = results
+    for name in path.split('.'):
+        if not isinstance(value, dict) or name not in value:
+            return None
+        value = value[name]
+    return value
+
+def compare(results, baseline, max_regression_pct):
+    """Print the change of each compared metric, returning the metrics that regressed by more than max_regression_pct"""
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('createdAt')})")
+    print(f"  {'metric':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    regressions = []
+    for path, higher_is_better in COMPARED_METRICS:
+        before, after = get_metric(baseline, path), get_metric(results, path)
+        if not before or after is None:
+            continue
+        change = (after - before) / before * 100
+        print(f"  {path:<24} {before:>10} {after:>10} {change:>+7.1f}%")
+        regression = -change if higher_is_better else change
+        if max_regression_pct is not None and regression > max_regression_pct:
+            regressions.append(path)
+    if baseline.get('config') != results['config']:
+        print("  (the baseline was run with a different configuration)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='rows of the synthetic catalog')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the catalog and of the sampled searches')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'xlsx'], default='csv', help='file format of the catalog')
+    parser.add_argument('--catalog', help='ingest this file instead of a synthetic catalog')
+    parser.add_argument('--index-profile', default='balanced', help='index profile of the created index')
+    parser.add_argument('--embedding-type', default='float', help='float, int8 or binary embeddings')
+    parser.add_argument('--search-backend', choices=['opensearch', 'local'], default='opensearch', help='backend searching the index')
+    parser.add_argument('--dimension', type=int, default=1024, help='dimension of the fake embeddings')
+    parser.add_argument('--embed-latency-ms', type=float, default=0, help='latency of every embedding request')
+    parser.add_argument('--embed-per-text-ms', type=float, default=0, help='additional latency per embedded text')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='fraction of embedding requests throttled')
+    parser.add_argument('--ingest-timeout', type=int, default=900, help='timeout of each ingestItems invocation in seconds')
+    parser.add_argument('--searches', type=int, default=200, help='items whose related items are searched')
+    parser.add_argument('--repeat', action='store_true', help='search the same items again, served by the result cache')
+    parser.add_argument('--batch-size', type=int, default=100, help='items per batch request, 0 to skip batch searches')
+    parser.add_argument('--verbose', action='store_true', help='show the logs of the handlers')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file written by --output to compare against')
+    parser.add_argument('--max-regression-pct', type=float, help='fail when a compared metric regresses by more than this')
+    args = parser.parse_args()
+
+    stand_ins = install_stand_ins(FakeBedrockRuntime(args.dimension, args.embed_latency_ms, args.embed_per_text_ms, args.throttle_rate, args.seed))
+    create_handler = load_handler('createIndex')
+    sys.modules['index_profiles'].EMBEDDING_DIMENSION = args.dimension
+    ingest_handler = load_handler('ingestItems')
+    find_handler = load_handler('findRelatedItems')
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark-')
+    if args.catalog:
+        catalog_path = args.catalog
+        args.format = catalog_path.rsplit('.', 1)[-1].lower()
+    else:
+        start = time.perf_counter()
+        catalog = generate_catalog(args.rows, args.seed)
+        catalog_path = write_catalog(catalog, os.path.join(work_dir, f"catalog.{args.format}"))
+        print(f"Generated {args.rows} rows in {time.perf_counter() - start:.1f}s: {catalog_path}")
+
+    index_name = 'benchmark'
+    file_key = f"assets/benchmark/{index_name}/catalog.{args.format}"
+    stand_ins.s3.upload_local_file(catalog_path, BUCKET, file_key)
+    create_index(create_handler, index_name, args)
+
+    print(f"Ingesting {catalog_path}")
+    ingest = run_ingest(ingest_handler, stand_ins, file_key, args.rows, args)
+    if args.catalog:
+        ingest['rows'] = ingest['indexedRows'] + ingest['failedRows']
+        ingest['rowsPerSecond'] = round(ingest['rows'] / ingest['seconds'], 1)
+    print(f"  {ingest['rowsPerSecond']} rows/sec, {ingest['indexedRows']} indexed, {ingest['failedRows']} failed in {ingest['seconds']}s")
+
+    # findRelatedItems runs in its own execution environment, sharing only the persistent embedding cache
+    new_execution_environment()
+    index_config = to_json_value(stand_ins.dynamodb.Table(stand_ins.parameters['INDEX_CONFIG_TABLE']).get_item(Key={'indexName': index_name})['Item'])
+    queue_items = sorted(stand_ins.dynamodb.Table(stand_ins.parameters['PROCESSING_QUEUE_TABLE']).scan()['Items'], key=lambda item: item['id'])
+    random = np.random.default_rng(args.seed)
+    sample = [to_json_value(queue_items[position]) for position in random.choice(len(queue_items), size=min(args.searches, len(queue_items)), replace=False)]
+
+    print(f"Searching related items of {len(sample)} items")
+    find = {'single': run_single_searches(find_handler, index_name, index_config, sample, args)}
+    if args.repeat:
+        find['repeat'] = run_single_searches(find_handler, index_name, index_config, sample, args)
+    if args.batch_size:
+        find['batch'] = run_batch_searches(find_handler, index_name, index_config, sample, args)
+    for mode, summary in find.items():
+        print(f"  {mode}: p50 {summary.get('p50Ms')} ms, p99 {summary.get('p99Ms')} ms over {summary['requests']} requests, {summary['errors']} errors")
+    if args.search_backend == 'local':
+        with quiet(args.verbose):
+            find['parity'] = check_parity(find_handler, index_name, index_config, sample)
+        print(f"  parity with the search backend: {find['parity']}")
+
+    config = {name: value for name, value in vars(args).items() if name not in ['output', 'baseline', 'max_regression_pct', 'verbose']}
+    results = {
+        'commit': git_commit(),
+        'createdAt': datetime.now(timezone.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
+        'python': sys.version.split()[0],
+        'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} cpus",
+        'config': config,
+        'ingest': ingest,
+        'find': find,
+        'embedder': stand_ins.bedrock_runtime.stats(),
+        'searchBackend': stand_ins.search_backend.stats(),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.max_regression_pct)
+    if regressions:
+        print(f"\nRegressed by more than {args.max_regression_pct:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Synthetic catalogs of titles for benchmarks, the same for a given size and seed.
+
+A catalog lists works the way the spreadsheets loaded into the tool do, with some works listed several times
+(a different spelling of the title, a year off by one, the cast in another order), so searches find related items
+and some of them share an identifier.
+"""
+import numpy as np
+import pandas as pd
+
+# Field configuration of the index created for a catalog, as sent by the create index page
+FIELD_CONFIGURATION = {
+    'title': 'VECTOR',
+    'directors': 'VECTOR',
+    'actors': 'VECTOR',
+    'year': 'EXACT',
+    'eidr_id': 'IDENTIFIER',
+    'genre': 'IGNORE'
+}
+
+GENRES = ['Drama', 'Comedy', 'Documentary', 'Thriller', 'Animation', 'Horror', 'Romance', 'Science Fiction', 'Western', 'Family']
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'vor', 'shi', 'an', 'del', 'mo', 'ri', 'sa', 'ul', 'ber', 'no', 'ga', 'pel', 'ti', 'zan', 'ek']
+
+TITLE_WORDS = [
+    'night', 'river', 'last', 'summer', 'house', 'city', 'dark', 'king', 'road', 'silent', 'blue', 'winter', 'star',
+    'garden', 'lost', 'return', 'island', 'shadow', 'fire', 'empire', 'secret', 'journey', 'heart', 'storm', 'little',
+    'great', 'war', 'dream', 'moon', 'stone', 'wild', 'golden', 'broken', 'hidden', 'endless', 'ocean', 'glass', 'iron',
+    'paper', 'morning', 'edge', 'light', 'crown', 'north', 'red', 'white', 'black', 'forest', 'valley', 'harbor'
+]
+
+# Fraction of works listed more than once, and of works with an EIDR identifier
+DUPLICATE_RATE = 0.3
+IDENTIFIER_RATE = 0.2
+
+def make_names(random, count):
+    """Distinct pronounceable 'First Last' names"""
+    def words(size):
+        syllables = random.integers(0, len(SYLLABLES), size=(size, 3))
+        lengths = random.integers(2, 4, size=size)
+        return [''.join(SYLLABLES[s] for s in row[:length]).capitalize() for row, length in zip(syllables, lengths)]
+    return list(dict.fromkeys(f"{first} {last}" for first, last in zip(words(count * 2), words(count * 2))))[:count]
+
+def generate_catalog(rows, seed=0):
+    """DataFrame of a catalog of the given number of rows"""
+    random = np.random.default_rng(seed)
+    people = make_names(random, max(200, rows // 5))
+
+    works = int(rows / (1 + DUPLICATE_RATE)) + 1
+    title_lengths = random.integers(1, 5, size=works)
+    title_words = random.integers(0, len(TITLE_WORDS), size=(works, 4))
+    titles = [
+        ' '.join(TITLE_WORDS[word] for word in words[:length]).title() + (f" {number}" if number > 1 else '')
+        for words, length, number in zip(title_words, title_lengths, random.integers(1, 6, size=works))
+    ]
+    years = random.integers(1930, 2025, size=works)
+    directors = random.integers(0, len(people), size=(works, 2))
+    director_counts = random.choice([1, 1, 1, 2], size=works)
+    actors = random.integers(0, len(people), size=(works, 6))
+    actor_counts = random.integers(2, 7, size=works)
+    genres = random.integers(0, len(GENRES), size=works)
+    identifiers = [
+        f"10.5240/{value >> 32 & 0xFFFF:04X}-{value >> 16 & 0xFFFF:04X}-{value & 0xFFFF:04X}" if has_identifier else ''
+        for value, has_identifier in zip(random.integers(0, 2 ** 48, size=works), random.random(works) < IDENTIFIER_RATE)
+    ]
+
+    # every work is listed once, then duplicates of random works fill the remaining rows
+    listed = np.concatenate([np.arange(works), random.integers(0, works, size=max(0, rows - works))])[:rows]
+    random.shuffle(listed)
+    variant = np.zeros(rows, dtype=bool)
+    variant[works:] = True
+    variant = variant[np.argsort(random.random(rows))]
+
+    records = []
+    for work, is_variant, change in zip(listed, variant, random.integers(0, 4, size=rows)):
+        title = titles[work]
+        year = int(years[work])
+        cast = [people[person] for person in actors[work][:actor_counts[work]]]
+        if is_variant:
+            if change == 0:
+                title = title.upper()
+            elif change == 1:
+                title = f"{title}: {TITLE_WORDS[(work + 7) % len(TITLE_WORDS)].title()}"
+            elif change == 2:
+                year += 1
+            else:
+                cast = cast[::-1]
+        records.append({
+            'title': title,
+            'year': year,
+            'directors': ', '.join(people[person] for person in directors[work][:director_counts[work]]),
+            'actors': ', '.join(cast),
+            'genre': GENRES[genres[work]],
+            'eidr_id': identifiers[work]
+        })
+    return pd.DataFrame.from_records(records, columns=list(FIELD_CONFIGURATION))
+
+def write_catalog(frame, path):
+    """Write a catalog as .csv, .parquet or .xlsx, by the extension of path"""
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        frame.to_csv(path, index=False)
+    elif extension == 'parquet':
+        frame.to_parquet(path, index=False)
+    elif extension == 'xlsx':
+        frame.to_excel(path, index=False)
+    else:
+        raise ValueError(f"Unsupported catalog format .{extension}, expected .csv, .parquet or .xlsx")
+    return path
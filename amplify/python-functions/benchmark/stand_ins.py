@@ -0,0 +1,990 @@
+"""
+Local stand-ins for the AWS services and the OpenSearch collection the functions call, for offline benchmarks.
+
+install_stand_ins() patches boto3 and the OpenSearch client factory of shared.clients, so the handlers run
+unchanged in this process:
+
+- bedrock-runtime: FakeBedrockRuntime, deterministic hash-based embeddings with a configurable latency
+- dynamodb: FakeDynamoDB, in-memory tables supporting the update and condition expressions the functions use
+- s3, lambda, ssm: FakeS3, FakeLambda (records asynchronous invocations) and FakeSSM (the branch parameters)
+- OpenSearch: InProcessSearchBackend behind a real opensearch-py client, through InProcessConnection, so
+  requests and responses are serialized like on the wire; knn clauses are answered by exact (brute-force) search
+
+Documents are searchable as soon as they are indexed, there is no refresh delay.
+"""
+import copy
+import fnmatch
+import functools
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+import boto3
+import numpy as np
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+from opensearchpy import OpenSearch
+from opensearchpy.connection import Connection
+
+import shared.clients
+
+# Key attributes of the table each SSM parameter names, as in amplify/data/resource.ts and amplify/backend.ts
+TABLE_KEYS = {
+    'INDEX_CONFIG_TABLE': ('indexName',),
+    'PROCESSING_QUEUE_TABLE': ('indexName', 'id'),
+    'INGEST_JOB_TABLE': ('fileKey',),
+    'EMBEDDING_CACHE_TABLE': ('cacheKey',),
+    'GROUP_JOB_TABLE': ('indexName',),
+}
+
+def client_error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+class ConditionalCheckFailedException(ClientError):
+    def __init__(self, operation='UpdateItem'):
+        super().__init__({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, operation)
+
+class FakeBedrockRuntime:
+    """
+    Cohere embed v3 stand-in. Texts are embedded by hashing their words and character trigrams into a normalized
+    vector, so identical texts get identical vectors and texts sharing words get similar ones, always the same
+    across runs. Every request sleeps latency_ms plus per_text_ms per text; throttle_rate is the fraction of
+    requests rejected with a ThrottlingException.
+    """
+
+    def __init__(self, dimension=1024, latency_ms=0, per_text_ms=0, throttle_rate=0, seed=0):
+        self.dimension = dimension
+        self.latency_ms = latency_ms
+        self.per_text_ms = per_text_ms
+        self.throttle_rate = throttle_rate
+        self.random = np.random.default_rng(seed)
+        self.requests = 0
+        self.texts = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        texts = request['texts']
+        if not 1 <= len(texts) <= 96:
+            raise client_error('ValidationException', f"texts must hold 1 to 96 texts, got {len(texts)}", 'InvokeModel')
+
+        with self._lock:
+            self.requests += 1
+            throttled = self.throttle_rate and self.random.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+            else:
+                self.texts += len(texts)
+        if throttled:
+            raise client_error('ThrottlingException', 'Too many requests, please wait before trying again.', 'InvokeModel')
+
+        delay = (self.latency_ms + self.per_text_ms * len(texts)) / 1000
+        if delay:
+            time.sleep(delay)
+
+        vectors = [self.embed(text) for text in texts]
+        embedding_types = request.get('embedding_types')
+        if embedding_types:
+            embeddings = {embedding_type: [convert_embedding(vector, embedding_type) for vector in vectors] for embedding_type in embedding_types}
+        else:
+            embeddings = [vector.tolist() for vector in vectors]
+
+        payload = {'id': str(uuid.uuid4()), 'texts': texts, 'embeddings': embeddings, 'response_type': 'embeddings_by_type' if embedding_types else 'embeddings_floats'}
+        return {'body': io.BytesIO(json.dumps(payload).encode('utf-8')), 'contentType': 'application/json'}
+
+    def embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            for feature, weight in _word_features(word):
+                position, sign = _feature_slot(feature, self.dimension)
+                vector[position] += sign * weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def stats(self):
+        return {'requests': self.requests, 'texts': self.texts, 'throttled': self.throttled}
+
+@functools.lru_cache(maxsize=200000)
+def _word_features(word):
+    padded = f"<{word}>"
+    return [(word, 1.0)] + [(padded[start:start + 3], 0.5) for start in range(len(padded) - 2)]
+
+@functools.lru_cache(maxsize=200000)
+def _feature_slot(feature, dimension):
+    digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+    value = int.from_bytes(digest, 'little')
+    return value % dimension, 1.0 if value >> 63 else -1.0
+
+def convert_embedding(vector, embedding_type):
+    """Compact form of a float vector: int8 scaled to [-127, 127], or binary (sign bits packed in signed bytes)"""
+    if embedding_type == 'int8':
+        scale = np.abs(vector).max() or 1.0
+        return np.round(vector / scale * 127).astype(np.int8).tolist()
+    if embedding_type == 'binary':
+        return np.packbits(vector > 0).view(np.int8).tolist()
+    return vector.tolist()
+
+def to_dynamodb(value):
+    """Convert a value the way boto3 stores it: numbers become Decimal and bytes Binary, floats are rejected"""
+    if isinstance(value, bool) or value is None or isinstance(value, (str, Decimal, Binary)):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        raise TypeError('Float types are not supported. Use Decimal types instead.')
+    if isinstance(value, (bytes, bytearray)):
+        return Binary(bytes(value))
+    if isinstance(value, dict):
+        return {key: to_dynamodb(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_dynamodb(item) for item in value]
+    if isinstance(value, set):
+        return {to_dynamodb(item) for item in value}
+    raise TypeError(f"Unsupported type {type(value)} for value {value}")
+
+class FakeTable:
+    """
+    In-memory DynamoDB table with the subset of expressions used by the functions. Keys must name exactly the
+    key attributes of the table and items must have all of them, or requests fail with a ValidationException.
+    """
+
+    def __init__(self, name, key):
+        self.name = name
+        self.key = tuple(key)
+        self.items = {}
+        self.meta = None
+        self._lock = threading.Lock()
+
+    def _item_key(self, key, operation='GetItem'):
+        if set(key) != set(self.key) or any(key[name] is None for name in self.key):
+            raise client_error('ValidationException', 'The provided key element does not match the schema', operation)
+        return tuple(key[name] for name in self.key)
+
+    def _key_of_item(self, item, operation='PutItem'):
+        if any(item.get(name) is None for name in self.key):
+            raise client_error('ValidationException', 'One or more parameter values were invalid: Missing the key in the item', operation)
+        return tuple(item[name] for name in self.key)
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False):
+        with self._lock:
+            item = copy.deepcopy(self.items.get(self._item_key(Key)))
+        if item is None:
+            return {}
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            attributes = [names.get(path.strip(), path.strip()) for path in ProjectionExpression.split(',')]
+            item = {name: value for name, value in item.items() if name in attributes}
+        return {'Item': item}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        item = to_dynamodb(Item)
+        with self._lock:
+            key = self._key_of_item(item)
+            current = self.items.get(key)
+            if ConditionExpression and not _evaluate_condition(ConditionExpression, current, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise ConditionalCheckFailedException('PutItem')
+            self.items[key] = item
+        return {}
+
+    def delete_item(self, Key):
+        with self._lock:
+            self.items.pop(self._item_key(Key, 'DeleteItem'), None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues='NONE'):
+        names = ExpressionAttributeNames or {}
+        values = to_dynamodb(ExpressionAttributeValues or {})
+        with self._lock:
+            key = self._item_key(Key, 'UpdateItem')
+            current = self.items.get(key)
+            if ConditionExpression and not _evaluate_condition(ConditionExpression, current, names, values):
+                raise ConditionalCheckFailedException('UpdateItem')
+            item = copy.deepcopy(current) if current is not None else dict(to_dynamodb(Key))
+            _apply_update(UpdateExpression, item, names, values)
+            self.items[key] = item
+            attributes = copy.deepcopy(item)
+        return {'Attributes': attributes} if ReturnValues == 'ALL_NEW' else {}
+
+    def scan(self, **kwargs):
+        with self._lock:
+            items = copy.deepcopy(list(self.items.values()))
+        return {'Items': items, 'Count': len(items)}
+
+    def batch_writer(self, **kwargs):
+        return _BatchWriter(self)
+
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+# SET/REMOVE/ADD clauses of an update expression, in any order
+UPDATE_CLAUSE = re.compile(r'\b(SET|REMOVE|ADD|DELETE)\b')
+
+def _split_top_level(expression, separator=','):
+    parts, depth, current = [], 0, ''
+    for character in expression:
+        if character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        if character == separator and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += character
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+def _operand(token, item, names, values):
+    token = token.strip()
+    if token.startswith(':'):
+        return values[token]
+    match = re.fullmatch(r'if_not_exists\((.+),(.+)\)', token)
+    if match:
+        name = names.get(match.group(1).strip(), match.group(1).strip())
+        return item[name] if name in item else _operand(match.group(2), item, names, values)
+    return item.get(names.get(token, token))
+
+def _apply_update(expression, item, names, values):
+    tokens = UPDATE_CLAUSE.split(expression)
+    for clause, body in zip(tokens[1::2], tokens[2::2]):
+        for action in _split_top_level(body):
+            if clause == 'SET':
+                path, value = action.split('=', 1)
+                item[names.get(path.strip(), path.strip())] = copy.deepcopy(_operand(value, item, names, values))
+            elif clause == 'REMOVE':
+                item.pop(names.get(action, action), None)
+            elif clause == 'ADD':
+                path, value = action.split()
+                name = names.get(path, path)
+                increment = values[value]
+                if isinstance(increment, set):
+                    item[name] = set(item.get(name, set())) | increment
+                else:
+                    item[name] = item.get(name, Decimal(0)) + increment
+            else:
+                path, value = action.split()
+                name = names.get(path, path)
+                item[name] = set(item.get(name, set())) - values[value]
+
+CONDITION_COMPARISON = re.compile(r'(.+?)\s*(<>|<=|>=|=|<|>)\s*(.+)')
+
+def _evaluate_condition(expression, item, names, values):
+    """Conditions made of attribute_exists, attribute_not_exists and comparisons joined by AND / OR"""
+    item = item or {}
+    names = names or {}
+    values = to_dynamodb(values or {})
+    return any(
+        all(_evaluate_comparison(term.strip(), item, names, values) for term in re.split(r'\s+AND\s+', alternative))
+        for alternative in re.split(r'\s+OR\s+', expression)
+    )
+
+def _evaluate_comparison(term, item, names, values):
+    match = re.fullmatch(r'(attribute_exists|attribute_not_exists)\((.+)\)', term)
+    if match:
+        exists = names.get(match.group(2).strip(), match.group(2).strip()) in item
+        return exists if match.group(1) == 'attribute_exists' else not exists
+
+    left, operator, right = CONDITION_COMPARISON.fullmatch(term).groups()
+    left, right = _operand(left, item, names, values), _operand(right, item, names, values)
+    if left is None or right is None:
+        return operator == '<>' and left != right
+    return {
+        '=': left == right, '<>': left != right, '<': left < right,
+        '<=': left <= right, '>': left > right, '>=': left >= right
+    }[operator]
+
+class _ClientExceptions:
+    ConditionalCheckFailedException = ConditionalCheckFailedException
+
+class FakeDynamoDBClient:
+    """Low-level DynamoDB client of FakeDynamoDB, taking python values like the client of a boto3 resource"""
+
+    exceptions = _ClientExceptions
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.resource.Table(table_name)
+            responses[table_name] = [response['Item'] for response in (table.get_item(Key=key) for key in request['Keys']) if 'Item' in response]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems):
+        for table_name, requests in RequestItems.items():
+            if len(requests) > 25:
+                raise client_error('ValidationException', 'Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+            table = self.resource.Table(table_name)
+            # a batch with an invalid key is rejected as a whole, before any of its writes
+            for request in requests:
+                if 'PutRequest' in request:
+                    table._key_of_item(request['PutRequest']['Item'], 'BatchWriteItem')
+                else:
+                    table._item_key(request['DeleteRequest']['Key'], 'BatchWriteItem')
+            for request in requests:
+                if 'PutRequest' in request:
+                    table.put_item(Item=request['PutRequest']['Item'])
+                else:
+                    table.delete_item(Key=request['DeleteRequest']['Key'])
+        return {'UnprocessedItems': {}}
+
+class _Meta:
+    def __init__(self, client):
+        self.client = client
+
+class FakeDynamoDB:
+    """In-memory DynamoDB, serving as both boto3.resource('dynamodb') and boto3.client('dynamodb')"""
+
+    def __init__(self):
+        self.tables = {}
+        self.meta = _Meta(FakeDynamoDBClient(self))
+
+    def create_table(self, name, key):
+        table = FakeTable(name, key)
+        table.meta = self.meta
+        self.tables[name] = table
+        return table
+
+    def Table(self, name):
+        if name not in self.tables:
+            raise client_error('ResourceNotFoundException', f"Requested resource not found: Table: {name} not found", 'DescribeTable')
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        return self.meta.client.batch_get_item(RequestItems=RequestItems)
+
+    def batch_write_item(self, RequestItems):
+        return self.meta.client.batch_write_item(RequestItems=RequestItems)
+
+class FakeS3:
+    """S3 objects held as local files"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_local_file(self, path, bucket, key):
+        self.objects[(bucket, key)] = path
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        """Keep a copy of an uploaded file, as the caller may delete it"""
+        handle, path = tempfile.mkstemp(suffix=os.path.basename(Key))
+        os.close(handle)
+        shutil.copyfile(Filename, path)
+        self.objects[(Bucket, Key)] = path
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise client_error('404', 'Not Found', 'HeadObject')
+        shutil.copyfile(self.objects[(Bucket, Key)], Filename)
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {'Contents': [{'Key': key, 'Size': os.path.getsize(self.objects[(Bucket, key)])} for key in keys], 'IsTruncated': False}
+
+class FakeLambda:
+    """Records asynchronous invocations, e.g. the continuations of ingestItems, for the caller to run"""
+
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload=b'', **kwargs):
+        self.invocations.append((FunctionName, json.loads(Payload)))
+        return {'StatusCode': 202}
+
+class FakeSSM:
+    def __init__(self, parameters):
+        self.parameters = parameters
+
+    def get_parameters_by_path(self, Path, WithDecryption=False, NextToken=None, **kwargs):
+        return {'Parameters': [{'Name': Path + name, 'Value': value} for name, value in self.parameters.items()]}
+
+class FakeLambdaContext:
+    """Lambda context whose remaining time counts down from timeout_seconds"""
+
+    def __init__(self, function_name, timeout_seconds=900):
+        self.function_name = function_name
+        self.invoked_function_arn = f"arn:aws:lambda:us-east-1:000000000000:function:{function_name}"
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.time() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.time()) * 1000))
+
+class _VectorColumn:
+    """Vectors of one knn field, in a growable matrix, with the position of the document of each row"""
+
+    def __init__(self, dimension, dtype):
+        self.rows = 0
+        self.positions = np.zeros(1024, dtype=np.int64)
+        self.data = np.zeros((1024, dimension), dtype=dtype)
+        self.row_of = {}
+        self._norms = None
+
+    def set(self, position, vector):
+        if self.rows == len(self.positions):
+            self.positions = np.concatenate([self.positions, np.zeros_like(self.positions)])
+            self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+        self.positions[self.rows] = position
+        self.data[self.rows] = vector
+        self.row_of[position] = self.rows
+        self.rows += 1
+
+    def matrix(self):
+        return self.data[:self.rows]
+
+    def squared_norms(self):
+        """Squared norm of every vector, computed once per vector"""
+        if self._norms is None or len(self._norms) < self.rows:
+            done = 0 if self._norms is None else len(self._norms)
+            added = np.einsum('ij,ij->i', self.data[done:self.rows].astype(np.float32), self.data[done:self.rows].astype(np.float32))
+            self._norms = added if self._norms is None else np.concatenate([self._norms, added])
+        return self._norms
+
+class _Index:
+    def __init__(self, name, settings, properties):
+        self.name = name
+        self.settings = settings
+        self.properties = properties
+        self.sources = []
+        self.ids = []
+        self.deleted = set()
+        self.id_positions = {}
+        self.postings = {}
+        # field -> [documents having the field, (document, term) pairs], deleted documents included until they
+        # are merged away, which never happens here
+        self.field_statistics = {}
+        self.vectors = {}
+
+    def vector_settings(self, field):
+        mapping = self.properties.get(field) or {}
+        if mapping.get('type') != 'knn_vector':
+            return None
+        data_type = mapping.get('data_type', 'float')
+        space_type = mapping.get('method', {}).get('space_type') or mapping.get('space_type') or 'l2'
+        dimension = mapping['dimension'] // 8 if data_type == 'binary' else mapping['dimension']
+        return data_type, space_type, dimension
+
+class InProcessSearchBackend:
+    """
+    Minimal OpenSearch in memory: indexes, mappings, settings, _bulk, _search and _msearch with the query types
+    build_query and the ingestion use (bool, function_score, knn, term, terms, match_all). knn clauses are exact
+    searches scored like the HNSW engines (l2, cosinesimil, innerproduct and hamming spaces), keeping the
+    neighbours above min_score, or the k nearest.
+    """
+
+    MAX_TRACKED_TOTAL_HITS = 10000
+
+    def __init__(self):
+        self.indices = {}
+        self.requests = {}
+        self.seconds = 0.0
+        self._lock = threading.RLock()
+
+    def stats(self):
+        return {'requests': dict(self.requests), 'seconds': round(self.seconds, 3)}
+
+    def handle(self, method, url, params, body):
+        """Answer a request, returning (status, response body)"""
+        start = time.perf_counter()
+        path = url.split('?')[0].strip('/').split('/')
+        try:
+            with self._lock:
+                return self._route(method, path, params or {}, body)
+        except _SearchError as e:
+            return e.status, {'error': {'type': e.error_type, 'reason': str(e)}, 'status': e.status}
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def _record(self, operation):
+        self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def _route(self, method, path, params, body):
+        if path[0] == '_bulk' or path[-1] == '_bulk':
+            self._record('bulk')
+            return 200, self._bulk(path[0] if len(path) > 1 else None, body)
+        if path[-1] == '_msearch':
+            self._record('msearch')
+            return 200, self._msearch(path[0] if len(path) > 1 else None, body, params)
+        if path[0] == '_cat' and path[1:] == ['indices']:
+            return 200, [{'index': name} for name in self.indices]
+        if path[:3] == ['_plugins', '_knn', 'warmup']:
+            return 200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+        index = path[0]
+        action = path[1] if len(path) > 1 else None
+        if action is None:
+            if method == 'HEAD':
+                return (200 if index in self.indices else 404), {}
+            if method == 'PUT':
+                return 200, self._create_index(index, json.loads(body or '{}'))
+            if method == 'DELETE':
+                self._get_index(index)
+                del self.indices[index]
+                return 200, {'acknowledged': True}
+        if action == '_search':
+            self._record('search')
+            return 200, self._search(self._get_index(index), json.loads(body or '{}'), params)
+        if action == '_count':
+            query = json.loads(body or '{}').get('query', {'match_all': {}})
+            target = self._get_index(index)
+            matches, _, _ = self._evaluate(target, query)
+            return 200, {'count': int(_drop_deleted(target, matches).sum())}
+        if action == '_mapping' and method == 'GET':
+            return 200, {index: {'mappings': {'properties': dict(self._get_index(index).properties)}}}
+        if action == '_mapping':
+            properties = json.loads(body or '{}').get('properties', {})
+            self._get_index(index).properties.update(properties)
+            return 200, {'acknowledged': True}
+        if action == '_settings':
+            target = self._get_index(index)
+            if method == 'GET':
+                return 200, {index: {'settings': dict(target.settings)}}
+            target.settings.update({key if key.startswith('index.') else f"index.{key}": str(value) for key, value in json.loads(body).items()})
+            return 200, {'acknowledged': True}
+        if action in ['_refresh', '_forcemerge', '_flush']:
+            self._get_index(index)
+            return 200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+        raise _SearchError(400, 'illegal_argument_exception', f"{method} /{'/'.join(path)} is not supported by the in-process backend")
+
+    def _get_index(self, name):
+        if name not in self.indices:
+            raise _SearchError(404, 'index_not_found_exception', f"no such index [{name}]")
+        return self.indices[name]
+
+    def _create_index(self, name, body):
+        if name in self.indices:
+            raise _SearchError(400, 'resource_already_exists_exception', f"index [{name}] already exists")
+        settings = {key if key.startswith('index.') else f"index.{key}": str(value) for key, value in body.get('settings', {}).items()}
+        self.indices[name] = _Index(name, settings, dict(body.get('mappings', {}).get('properties', {})))
+        return {'acknowledged': True, 'shards_acknowledged': True, 'index': name}
+
+    def _bulk(self, default_index, body):
+        lines = [line for line in body.splitlines() if line.strip()]
+        items = []
+        position = 0
+        while position < len(lines):
+            action = json.loads(lines[position])
+            operation, metadata = next(iter(action.items()))
+            index_name = metadata.get('_index', default_index)
+            document = json.loads(lines[position + 1]) if operation != 'delete' else None
+            position += 1 if operation == 'delete' else 2
+            try:
+                index = self._get_index(index_name)
+                if operation == 'delete':
+                    result = self._delete_document(index, metadata['_id'])
+                elif operation == 'update':
+                    result = self._update_document(index, metadata['_id'], document)
+                else:
+                    result = self._index_document(index, metadata.get('_id'), document, create=operation == 'create')
+                items.append({operation: {'_index': index_name, '_id': result[0], 'status': result[1], 'result': result[2]}})
+            except _SearchError as e:
+                items.append({operation: {'_index': index_name, '_id': metadata.get('_id'), 'status': e.status, 'error': {'type': e.error_type, 'reason': str(e)}}})
+        return {'took': 1, 'errors': any('error' in next(iter(item.values())) for item in items), 'items': items}
+
+    def _index_document(self, index, document_id, document, create=False):
+        vectors = {}
+        for field in list(document):
+            settings = index.vector_settings(field)
+            if settings is None:
+                continue
+            if document[field] is None:
+                # a null vector field has no vector, as if the field were missing
+                document.pop(field)
+                continue
+            data_type, _, dimension = settings
+            vector = np.asarray(document.pop(field), dtype=np.float32 if data_type == 'float' else np.int8)
+            if vector.shape != (dimension,):
+                raise _SearchError(400, 'mapper_parsing_exception', f"Vector dimension mismatch. Expected: {dimension}, Given: {vector.size}")
+            vectors[field] = vector
+
+        result = 'created'
+        if document_id is not None and document_id in index.id_positions:
+            if create:
+                raise _SearchError(409, 'version_conflict_engine_exception', f"[{document_id}]: version conflict, document already exists")
+            self._delete_document(index, document_id)
+            result = 'updated'
+        document_id = document_id or uuid.uuid4().hex[:20]
+
+        position = len(index.sources)
+        index.sources.append(document)
+        index.ids.append(document_id)
+        index.id_positions[document_id] = position
+        for field, value in document.items():
+            terms = {str(term) for term in (value if isinstance(value, list) else [value]) if term is not None}
+            for term in terms:
+                index.postings.setdefault(field, {}).setdefault(term, []).append(position)
+            if terms:
+                statistics = index.field_statistics.setdefault(field, [0, 0])
+                statistics[0] += 1
+                statistics[1] += len(terms)
+        for field, vector in vectors.items():
+            if field not in index.vectors:
+                index.vectors[field] = _VectorColumn(vector.size, vector.dtype)
+            index.vectors[field].set(position, vector)
+        return document_id, 201 if result == 'created' else 200, result
+
+    def _update_document(self, index, document_id, partial):
+        """Partial update: the fields of partial['doc'] replace those of the document, vectors included"""
+        position = index.id_positions.get(document_id)
+        if position is None:
+            raise _SearchError(404, 'document_missing_exception', f"[{document_id}]: document missing")
+        document = dict(index.sources[position])
+        for field, column in index.vectors.items():
+            if position in column.row_of:
+                document[field] = column.data[column.row_of[position]].tolist()
+        document.update(partial.get('doc', {}))
+        return self._index_document(index, document_id, document)
+
+    def _delete_document(self, index, document_id):
+        position = index.id_positions.pop(document_id, None)
+        if position is None:
+            return document_id, 404, 'not_found'
+        index.deleted.add(position)
+        return document_id, 200, 'deleted'
+
+    def _msearch(self, default_index, body, params):
+        lines = [line for line in body.splitlines() if line.strip()]
+        responses = []
+        for header, query in zip(lines[0::2], lines[1::2]):
+            index_name = json.loads(header).get('index', default_index)
+            try:
+                response = self._search(self._get_index(index_name), json.loads(query), {})
+                response['status'] = 200
+            except _SearchError as e:
+                response = {'error': {'type': e.error_type, 'reason': str(e)}, 'status': e.status}
+            responses.append(response)
+        return {'took': 1, 'responses': responses}
+
+    def _search(self, index, body, params):
+        start = time.perf_counter()
+        matches, scores, named = self._evaluate(index, body.get('query', {'match_all': {}}))
+        _drop_deleted(index, matches)
+        if body.get('min_score') is not None:
+            matches &= scores >= float(body['min_score'])
+
+        candidates = np.flatnonzero(matches)
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        sort_fields = _sort_fields(body.get('sort'))
+        if sort_fields:
+            order = self._sorted(index, candidates, sort_fields, body.get('search_after'))
+        offset = int(body.get('from', params.get('from', 0)))
+        size = int(body.get('size', params.get('size', 10)))
+        named_scores = str(params.get('include_named_queries_score', 'false')).lower() == 'true'
+
+        hits = []
+        for position in order[offset:offset + size]:
+            hit = {'_index': index.name, '_id': index.ids[position], '_score': float(scores[position])}
+            if sort_fields:
+                hit['sort'] = [index.sources[position].get(field) for field, _ in sort_fields]
+            source = self._source(index, position, body.get('_source', True))
+            if source is not None:
+                hit['_source'] = source
+            matched = {name: float(clause_scores[position]) for name, clause_matches, clause_scores in named if clause_matches[position]}
+            if matched:
+                hit['matched_queries'] = matched if named_scores else list(matched)
+            hits.append(hit)
+
+        total = len(candidates)
+        return {
+            'took': int((time.perf_counter() - start) * 1000),
+            'timed_out': False,
+            'hits': {
+                'total': {'value': min(total, self.MAX_TRACKED_TOTAL_HITS), 'relation': 'eq' if total <= self.MAX_TRACKED_TOTAL_HITS else 'gte'},
+                'max_score': float(scores[order[0]]) if len(order) else None,
+                'hits': hits
+            }
+        }
+
+    def _sorted(self, index, candidates, sort_fields, search_after=None):
+        """Candidates in the order of keyword sort fields, after the sort values of search_after"""
+        def key(position):
+            # documents without a value sort last, as with the default missing: _last
+            return [(value is None, '' if value is None else str(value)) for value in (index.sources[position].get(field) for field, _ in sort_fields)]
+        order = sorted(candidates.tolist(), key=key, reverse=sort_fields[0][1] == 'desc')
+        if search_after is not None:
+            after = [(value is None, '' if value is None else str(value)) for value in search_after]
+            order = [position for position in order if (key(position) < after if sort_fields[0][1] == 'desc' else key(position) > after)]
+        return np.asarray(order, dtype=np.int64)
+
+    def _source(self, index, position, source_filter):
+        if source_filter is False:
+            return None
+        includes, excludes = [], []
+        if isinstance(source_filter, list):
+            includes = source_filter
+        elif isinstance(source_filter, str):
+            includes = [source_filter]
+        elif isinstance(source_filter, dict):
+            includes = source_filter.get('includes') or []
+            excludes = source_filter.get('excludes') or []
+
+        source = dict(index.sources[position])
+        for field, column in index.vectors.items():
+            if position in column.row_of and _selected(field, includes, excludes):
+                source[field] = column.data[column.row_of[position]].tolist()
+        return {field: value for field, value in source.items() if _selected(field, includes, excludes)}
+
+    def _evaluate(self, index, clause):
+        """Evaluate a query clause on every document, returning (matches, scores, [(name, matches, scores)])"""
+        count = len(index.sources)
+        query_type, query = next(iter(clause.items()))
+
+        if query_type == 'match_all':
+            return np.ones(count, dtype=bool), np.ones(count), []
+
+        if query_type in ['term', 'terms']:
+            field, value = next(iter(query.items()))
+            if query_type == 'term':
+                values = [value.get('value') if isinstance(value, dict) else value]
+            else:
+                values = value
+            matches = np.zeros(count, dtype=bool)
+            postings = index.postings.get(field, {})
+            for term in values:
+                matches[postings.get(str(term), [])] = True
+            boost = float(value.get('boost', 1.0)) if isinstance(value, dict) else 1.0
+            if query_type == 'term' and matches.any():
+                # BM25 on a keyword field: no term frequencies nor lengths, so only the rarity of the term counts
+                documents, pairs = index.field_statistics[field]
+                doc_freq = len(postings[str(values[0])])
+                boost *= math.log(1 + (documents - doc_freq + 0.5) / (doc_freq + 0.5)) / (1 + 1.2 * (0.25 + 0.75 * documents / pairs))
+            return matches, np.where(matches, boost, 0.0), []
+
+        if query_type == 'exists':
+            field = query['field']
+            column = index.vectors.get(field)
+            matches = np.fromiter(
+                (source.get(field) is not None or (column is not None and position in column.row_of) for position, source in enumerate(index.sources)),
+                dtype=bool, count=count
+            )
+            return matches, matches.astype(float), []
+
+        if query_type == 'knn':
+            return self._knn(index, query)
+
+        if query_type == 'function_score':
+            matches, scores, named = self._evaluate(index, query.get('query', {'match_all': {}}))
+            scores = scores * float(query.get('weight', 1.0))
+            if query.get('_name'):
+                named = named + [(query['_name'], matches, scores)]
+            return matches, scores, named
+
+        if query_type == 'bool':
+            return self._bool(index, query, count)
+
+        raise _SearchError(400, 'parsing_exception', f"unknown query [{query_type}] for the in-process backend")
+
+    def _bool(self, index, query, count):
+        matches = np.ones(count, dtype=bool)
+        scores = np.zeros(count)
+        named = []
+        for clause in query.get('must', []):
+            clause_matches, clause_scores, clause_named = self._evaluate(index, clause)
+            matches &= clause_matches
+            scores += np.where(clause_matches, clause_scores, 0)
+            named += clause_named
+        for clause in query.get('filter', []):
+            clause_matches, _, clause_named = self._evaluate(index, clause)
+            matches &= clause_matches
+            named += clause_named
+        for clause in query.get('must_not', []):
+            matches &= ~self._evaluate(index, clause)[0]
+
+        should = query.get('should', [])
+        if should:
+            should_matched = np.zeros(count, dtype=np.int64)
+            for clause in should:
+                clause_matches, clause_scores, clause_named = self._evaluate(index, clause)
+                should_matched += clause_matches
+                scores += np.where(clause_matches, clause_scores, 0)
+                named += clause_named
+            default = 0 if query.get('must') or query.get('filter') else 1
+            minimum = _minimum_should_match(query.get('minimum_should_match', default), len(should))
+            if not query.get('must') and not query.get('filter'):
+                # a bool of should clauses only matches documents matching one of them, whatever the minimum
+                minimum = max(minimum, 1)
+            matches &= should_matched >= minimum
+        elif not query.get('must') and not query.get('filter'):
+            scores += 1.0
+        return matches, np.where(matches, scores, 0), [(name, clause_matches & matches, clause_scores) for name, clause_matches, clause_scores in named]
+
+    def _knn(self, index, query):
+        field, options = next(iter(query.items()))
+        count = len(index.sources)
+        matches, scores = np.zeros(count, dtype=bool), np.zeros(count)
+        settings = index.vector_settings(field)
+        if settings is None:
+            raise _SearchError(400, 'query_shard_exception', f"Field '{field}' is not knn_vector type.")
+        column = index.vectors.get(field)
+        if column is None or not column.rows:
+            return matches, scores, []
+
+        data_type, space_type, dimension = settings
+        vector = np.asarray(options['vector'], dtype=np.float32)
+        if vector.shape != (dimension,):
+            raise _SearchError(400, 'illegal_argument_exception', f"Query vector has invalid dimension: {vector.size}. Dimension should be: {dimension}")
+        field_scores = knn_scores(column, vector, space_type)
+
+        positions = column.positions[:column.rows]
+        if 'min_score' in options:
+            keep = field_scores >= float(options['min_score'])
+        elif 'max_distance' in options:
+            keep = field_scores >= knn_scores_threshold(float(options['max_distance']), space_type)
+        else:
+            k = int(options.get('k', 10))
+            keep = np.zeros(len(field_scores), dtype=bool)
+            keep[np.argsort(-field_scores, kind='stable')[:k]] = True
+        matches[positions[keep]] = True
+        scores[positions[keep]] = field_scores[keep] * float(options.get('boost', 1.0))
+        return matches, scores, []
+
+def _drop_deleted(index, matches):
+    if index.deleted:
+        matches[list(index.deleted)] = False
+    return matches
+
+def _sort_fields(sort):
+    """[(field, order)] of the sort of a search on document fields, in the directions of the first field"""
+    fields = []
+    for entry in sort or []:
+        if isinstance(entry, str):
+            fields.append((entry, 'asc'))
+        else:
+            field, options = next(iter(entry.items()))
+            fields.append((field, options.get('order', 'asc') if isinstance(options, dict) else options))
+    return [(field, order) for field, order in fields if field != '_score']
+
+def _selected(field, includes, excludes):
+    included = not includes or any(fnmatch.fnmatchcase(field, pattern) for pattern in includes)
+    return included and not any(fnmatch.fnmatchcase(field, pattern) for pattern in excludes)
+
+def knn_scores(column, query, space_type):
+    """Scores of the knn query of every vector of a column, as the OpenSearch knn engines compute them"""
+    vectors = column.matrix()
+    if space_type == 'hamming':
+        bits = np.unpackbits(np.bitwise_xor(vectors.view(np.uint8), query.astype(np.int8).view(np.uint8)), axis=1).sum(axis=1)
+        return 1 / (1 + bits)
+    products = vectors @ query if vectors.dtype == np.float32 else vectors.astype(np.float32) @ query
+    if space_type == 'l2':
+        distances = np.maximum(column.squared_norms() - 2 * products + query @ query, 0)
+        return 1 / (1 + distances)
+    if space_type == 'cosinesimil':
+        norms = np.sqrt(column.squared_norms()) * np.linalg.norm(query)
+        return (1 + np.divide(products, norms, out=np.zeros_like(products), where=norms > 0)) / 2
+    if space_type == 'innerproduct':
+        return np.where(products >= 0, 1 + products, 1 / (1 - products))
+    raise _SearchError(400, 'illegal_argument_exception', f"Unsupported space type {space_type}")
+
+def knn_scores_threshold(max_distance, space_type):
+    if space_type == 'l2':
+        return 1 / (1 + max_distance)
+    if space_type == 'cosinesimil':
+        return 1 - max_distance / 2
+    return -np.inf
+
+def _minimum_should_match(value, clauses):
+    value = str(value).strip()
+    if value.endswith('%'):
+        return int(clauses * float(value[:-1]) / 100)
+    minimum = int(value)
+    return clauses + minimum if minimum < 0 else minimum
+
+class _SearchError(Exception):
+    def __init__(self, status, error_type, reason):
+        super().__init__(reason)
+        self.status = status
+        self.error_type = error_type
+
+class InProcessConnection(Connection):
+    """opensearch-py connection answering every request with an InProcessSearchBackend instead of HTTP"""
+
+    backend = None
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        # the client encodes query string values, e.g. True as b'true'
+        params = {name: value.decode('utf-8') if isinstance(value, bytes) else value for name, value in (params or {}).items()}
+        status, response = self.backend.handle(method, url, params, body)
+        raw_data = json.dumps(response) if method != 'HEAD' else ''
+        if not (200 <= status < 300) and status not in ignore:
+            self._raise_error(status, raw_data, 'application/json')
+        return status, {'content-type': 'application/json'}, raw_data
+
+class StandIns:
+    """The stand-ins installed in this process, to inspect after a run"""
+
+    def __init__(self, bedrock_runtime, dynamodb, s3, lambda_client, parameters, search_backend):
+        self.bedrock_runtime = bedrock_runtime
+        self.dynamodb = dynamodb
+        self.s3 = s3
+        self.lambda_client = lambda_client
+        self.parameters = parameters
+        self.search_backend = search_backend
+
+def install_stand_ins(bedrock_runtime=None, search_backend=None):
+    """
+    Route the AWS and OpenSearch clients of this process to new stand-ins, creating the tables the functions
+    read from their SSM parameters. Call before importing the handlers, which create clients at import time.
+    """
+    bedrock_runtime = bedrock_runtime or FakeBedrockRuntime()
+    search_backend = search_backend or InProcessSearchBackend()
+    dynamodb = FakeDynamoDB()
+    s3 = FakeS3()
+    lambda_client = FakeLambda()
+
+    parameters = {'OPENSEARCH_ENDPOINT': 'https://in-process.aoss.local'}
+    for parameter, key in TABLE_KEYS.items():
+        table_name = parameter.replace('_TABLE', '').title().replace('_', '') + '-benchmark'
+        dynamodb.create_table(table_name, key)
+        parameters[parameter] = table_name
+    ssm = FakeSSM(parameters)
+
+    services = {'bedrock-runtime': bedrock_runtime, 'dynamodb': dynamodb, 's3': s3, 'lambda': lambda_client, 'ssm': ssm}
+
+    def client(service_name, *args, **kwargs):
+        if service_name not in services:
+            raise ValueError(f"No stand-in for the {service_name} service")
+        return services[service_name]
+
+    boto3.client = client
+    boto3.resource = client
+    boto3.Session = lambda *args, **kwargs: type('FakeSession', (), {'get_credentials': lambda self: None})()
+
+    connection_class = type('BoundInProcessConnection', (InProcessConnection,), {'backend': search_backend})
+
+    def opensearch_client(**options):
+        options.update(connection_class=connection_class, http_auth=None, use_ssl=False, verify_certs=False)
+        return OpenSearch(**options)
+
+    shared.clients.OpenSearch = opensearch_client
+    shared.clients.AWSV4SignerAuth = lambda *args, **kwargs: None
+    shared.clients._parameters = None
+    shared.clients._opensearch_clients.clear()
+    shared.clients._embedding_cache = None
+
+    return StandIns(bedrock_runtime, dynamodb, s3, lambda_client, parameters, search_backend)
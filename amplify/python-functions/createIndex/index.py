@@ -1,8 +1,14 @@
 import json
-import os
 import boto3
 from datetime import datetime, timezone
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from shared.clients import get_opensearch_client, get_parameter, record_invocation
+from shared.local_search import SEARCH_BACKENDS
+from shared.metrics import InvocationMetrics
+from shared.rescoring import RESCORE_VECTOR_MAPPING, rescore_vector_field
+from shared.search_queries import INGEST_MODES
+from index_profiles import DEFAULT_MIN_SCORES, generate_vector_mapping, resolve_index_profile
+
+dynamodb = boto3.resource('dynamodb')
 
 def to_camel_case(snake_str):
     # Handle spaces and convert to camelCase
@@ -13,7 +19,7 @@ def to_camel_case(snake_str):
         return snake_str.lower()
     return components[0].lower() + ''.join(word.capitalize() for word in components[1:])
 
-def generate_search_config(field_config):
+def generate_search_config(field_config, min_score=0.5):
     must_queries = []
     should_queries = []
     
@@ -30,7 +36,7 @@ def generate_search_config(field_config):
                         "knn": {
                             f"{camel_case_name}Embedding": {
                                 "vector": f"{camel_case_name}Embedding",
-                                "min_score": 0.5
+                                "min_score": min_score
                             }
                         }
                     },
@@ -39,7 +45,7 @@ def generate_search_config(field_config):
                 }
             }
             should_queries.append(query)
-        elif field_type == 'EXACT':
+        elif field_type in ['EXACT', 'IDENTIFIER']:
             query = {
                 "function_score": {
                     "query": {
@@ -57,7 +63,7 @@ def generate_search_config(field_config):
     
     return {
         "size": 15,
-        "explain": True,
+        "explain": False,
         "query": {
             "bool": {
                 "minimum_should_match": "0",
@@ -67,14 +73,22 @@ def generate_search_config(field_config):
         }
     }
 
-def generate_opensearch_index_request(field_config):
+def generate_opensearch_index_request(field_config, profile):
     settings = {
         "index.knn": True,
-        "knn.algo_param.ef_search": 512,
-        "number_of_shards": 2
+        "knn.algo_param.ef_search": profile['efSearch'],
+        "number_of_shards": profile['shards']
     }
     
-    properties = {}
+    # itemId links each document to its ProcessingQueue item, contentHash is the hash of its row for upserts
+    properties = {
+        "itemId": {
+            "type": "keyword"
+        },
+        "contentHash": {
+            "type": "keyword"
+        }
+    }
     
     for field_name, field_type in field_config.items():
         if field_type == 'IGNORE':
@@ -84,23 +98,14 @@ def generate_opensearch_index_request(field_config):
         
         if field_type == 'VECTOR':
             embedding_name = f"{camel_case_name}Embedding"
-            properties[embedding_name] = {
-                "type": "knn_vector",
-                "dimension": 1024,
-                "method": {
-                    "name": "hnsw",
-                    "space_type": "l2",
-                    "engine": "faiss",
-                    "parameters": {
-                        "ef_construction": 15000,
-                        "m": 100
-                    }
-                }
-            }
+            properties[embedding_name] = generate_vector_mapping(profile)
+            # compact vectors are rescored with the float vectors kept with the documents
+            if profile['embeddingType'] != 'float':
+                properties[rescore_vector_field(camel_case_name)] = dict(RESCORE_VECTOR_MAPPING)
             properties[camel_case_name] = {
                 "type": "keyword"
             }
-        elif field_type == 'EXACT':
+        elif field_type in ['EXACT', 'IDENTIFIER']:
             properties[camel_case_name] = {
                 "type": "keyword"
             }
@@ -113,40 +118,52 @@ def generate_opensearch_index_request(field_config):
     }
 
 def lambda_handler(event, context):
+    """
+    Create an index and save its configuration. Logs one metrics record per invocation with the time spent
+    listing, creating and saving the index, see shared.metrics.
+    """
+    cold = record_invocation()
+    metrics = InvocationMetrics('createIndex')
+    metrics.set_property('coldStart', cold)
     try:
         body = json.loads(event['body']) if isinstance(event.get('body'), str) else event.get('body', {})
         field_configuration = body.get('fieldConfiguration', {})
         index_name = body.get('indexName')
         file_name = body.get('fileName', '')
         user_id = body.get('userId', '')
+
+        # HNSW parameters of the index, from a named profile with optional space type and quantization, for
+        # float or compact (int8 or binary) embeddings
+        index_profile = resolve_index_profile(
+            body.get('indexProfile'), body.get('spaceType'), body.get('quantization'), body.get('embeddingType')
+        )
+
+        # small indexes can be searched in-process by findRelatedItems, from a snapshot exported after each ingestion
+        search_backend = body.get('searchBackend') or 'opensearch'
+        if search_backend not in SEARCH_BACKENDS:
+            raise ValueError(f"Unknown search backend {search_backend}, expected one of {', '.join(SEARCH_BACKENDS)}")
+
+        # in upsert mode, uploading a file again only writes the rows that changed, identified by the upsertKey
+        # column (or by their content without one), and deleteMissing deletes the items the file no longer has
+        ingest_mode = body.get('ingestMode') or 'append'
+        if ingest_mode not in INGEST_MODES:
+            raise ValueError(f"Unknown ingest mode {ingest_mode}, expected one of {', '.join(INGEST_MODES)}")
+        upsert_key = body.get('upsertKey') or None
+        if upsert_key and upsert_key not in (body.get('columns') or field_configuration):
+            raise ValueError(f"Upsert key {upsert_key} is not a column of the file")
         
         # Generate OpenSearch index request
-        index_request = generate_opensearch_index_request(field_configuration)
-        
-        # Get OpenSearch endpoint from SSM
-        ssm = boto3.client('ssm')
-        branch = os.environ.get('AWS_BRANCH')
-        endpoint_param = ssm.get_parameter(Name=f'/{branch}/OPENSEARCH_ENDPOINT')
-        host = endpoint_param['Parameter']['Value'].replace('https://', '')
-        
-        # Set up OpenSearch client
-        credentials = boto3.Session().get_credentials()
-        auth = AWSV4SignerAuth(credentials, os.environ.get('AWS_REGION'), 'aoss')
+        index_request = generate_opensearch_index_request(field_configuration, index_profile)
         
-        client = OpenSearch(
-            hosts=[{'host': host, 'port': 443}],
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-            pool_maxsize=20,
-        )
+        # OpenSearch client kept across warm invocations, with the endpoint from the cached SSM parameters
+        client = get_opensearch_client()
         
         # Get existing indexes and find next item index number
         if not index_name:
             try:
                 # Get all indices at once (no pagination needed for cat.indices)
-                indices_response = client.cat.indices(format='json', h='index')
+                with metrics.stage('list'):
+                    indices_response = client.cat.indices(format='json', h='index')
                 all_indices = [idx['index'] for idx in indices_response] if indices_response else []
             except Exception:
                 all_indices = []
@@ -154,35 +171,47 @@ def lambda_handler(event, context):
             item_indexes = [idx for idx in all_indices if idx.startswith('item') and len(idx) > 4 and idx[4:7].isdigit()]
             next_num = max([int(idx[4:7]) for idx in item_indexes], default=0) + 1
             index_name = f"item{next_num:03d}-{user_id}"
+        metrics.set_property('indexName', index_name)
         
         # Create index if it doesn't exist
-        if not client.indices.exists(index=index_name):
-            response = client.indices.create(index=index_name, body=index_request)
+        with metrics.stage('create'):
+            exists = client.indices.exists(index=index_name)
+            if not exists:
+                response = client.indices.create(index=index_name, body=index_request)
+        if not exists:
             
             # Generate and save search config
-            search_config = generate_search_config(field_configuration)
+            search_config = generate_search_config(field_configuration, DEFAULT_MIN_SCORES[index_profile['spaceType']])
             
             # Save configuration to DynamoDB
-            dynamodb = boto3.resource('dynamodb')
-            table_name_param = ssm.get_parameter(Name=f'/{branch}/INDEX_CONFIG_TABLE')
-            table = dynamodb.Table(table_name_param['Parameter']['Value'])
+            table = dynamodb.Table(get_parameter('INDEX_CONFIG_TABLE'))
             
             vector_fields = [field for field, type_ in field_configuration.items() if type_ == 'VECTOR']
-            exact_fields = [field for field, type_ in field_configuration.items() if type_ == 'EXACT']
+            # identifiers are exact fields whose match is enough to relate two items, see findRelatedItems
+            exact_fields = [field for field, type_ in field_configuration.items() if type_ in ['EXACT', 'IDENTIFIER']]
+            identifier_fields = [field for field, type_ in field_configuration.items() if type_ == 'IDENTIFIER']
             
-            table.put_item(
-                Item={
-                    'indexName': index_name,
-                    'fileName': file_name,
-                    'vectorFieldList': vector_fields,
-                    'exactFieldList': exact_fields,
-                    'userId': user_id,
-                    'searchConfig': json.dumps(search_config),
-                    # Format to ISO and replace +00:00 with "Z"
-                    'updatedAt': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
-                    'createdAt': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
-                }
-            )
+            with metrics.stage('dynamodb'):
+                table.put_item(
+                    Item={
+                        'indexName': index_name,
+                        'fileName': file_name,
+                        'vectorFieldList': vector_fields,
+                        'exactFieldList': exact_fields,
+                        'identifierFieldList': identifier_fields,
+                        'indexProfile': index_profile,
+                        'embeddingType': index_profile['embeddingType'],
+                        'searchBackend': search_backend,
+                        'ingestMode': ingest_mode,
+                        'upsertKey': upsert_key,
+                        'deleteMissing': bool(body.get('deleteMissing')) and ingest_mode == 'upsert',
+                        'userId': user_id,
+                        'searchConfig': json.dumps(search_config),
+                        # Format to ISO and replace +00:00 with "Z"
+                        'updatedAt': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+                        'createdAt': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+                    }
+                )
             
             return {
                 'statusCode': 200,
@@ -194,6 +223,10 @@ def lambda_handler(event, context):
                 },
                 'body': json.dumps({
                     'message': f'Index {index_name} created successfully',
+                    'indexProfile': index_profile,
+                    'embeddingType': index_profile['embeddingType'],
+                    'searchBackend': search_backend,
+                    'ingestMode': ingest_mode,
                     'indexRequest': index_request,
                     'response': response
                 })
@@ -214,6 +247,8 @@ def lambda_handler(event, context):
             }
             
     except Exception as e:
+        print(f"Lambda handler error: {type(e).__name__}: {str(e)}")
+        metrics.count('errors')
         return {
             'statusCode': 500,
             'headers': {
@@ -225,4 +260,6 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'error': str(e)
             })
-        }
\ No newline at end of file
+        }
+    finally:
+        metrics.emit()
\ No newline at end of file
@@ -0,0 +1,133 @@
+from shared.embeddings import EMBEDDING_TYPES
+
+# Dimension of the Cohere embed-multilingual-v3 vectors
+EMBEDDING_DIMENSION = 1024
+
+DEFAULT_INDEX_PROFILE = 'balanced'
+
+SPACE_TYPES = ['l2', 'cosinesimil', 'innerproduct']
+
+# fp16 is faiss scalar quantization; faiss only quantizes float vectors to fp16, so byte (int8) quantization
+# uses the lucene engine's scalar quantizer. Both take and return float vectors, nothing changes at ingest or search.
+QUANTIZATIONS = ['none', 'fp16', 'byte']
+
+# HNSW build and search parameters, trading recall for build time and memory
+INDEX_PROFILES = {
+    'fast-build': {
+        'm': 16,
+        'efConstruction': 128,
+        'efSearch': 100,
+        'spaceType': 'l2',
+        'quantization': 'fp16',
+        'shards': 1
+    },
+    'balanced': {
+        'm': 32,
+        'efConstruction': 256,
+        'efSearch': 256,
+        'spaceType': 'l2',
+        'quantization': 'fp16',
+        'shards': 2
+    },
+    'high-recall': {
+        'm': 64,
+        'efConstruction': 512,
+        'efSearch': 512,
+        'spaceType': 'l2',
+        'quantization': 'none',
+        'shards': 2
+    },
+    # the parameters of indexes created before profiles existed
+    'legacy': {
+        'm': 100,
+        'efConstruction': 15000,
+        'efSearch': 512,
+        'spaceType': 'l2',
+        'quantization': 'none',
+        'shards': 2
+    }
+}
+
+# Compact embeddings are stored in knn_vector fields of their own data type, which fixes the engine and space:
+# int8 vectors are compared by cosine on the lucene engine (cosine ignores the int8 scale) and binary vectors,
+# 1024 bits packed in 128 bytes, by hamming distance on faiss. They are already compact and not quantized again.
+COMPACT_VECTOR_SETTINGS = {
+    'int8': {'dataType': 'byte', 'engine': 'lucene', 'spaceType': 'cosinesimil'},
+    'binary': {'dataType': 'binary', 'engine': 'faiss', 'spaceType': 'hamming'}
+}
+
+# knn scores depend on the space type, these thresholds all keep neighbours with a cosine similarity of about 0.5
+# or more (the embeddings are normalized): l2 scores 1 / (1 + d^2), cosinesimil (1 + cos) / 2, innerproduct 1 + ip
+# and hamming 1 / (1 + bits differing), about a third of the 1024 bits at that angle
+DEFAULT_MIN_SCORES = {
+    'l2': 0.5,
+    'cosinesimil': 0.75,
+    'innerproduct': 1.5,
+    'hamming': 0.003
+}
+
+def resolve_index_profile(name=None, space_type=None, quantization=None, embedding_type=None):
+    """
+    Get the parameters of a named index profile, with its space type or quantization optionally replaced,
+    for vectors of the given embedding type (float by default). Raises ValueError for unknown profiles or options.
+    """
+    name = name or DEFAULT_INDEX_PROFILE
+    if name not in INDEX_PROFILES:
+        raise ValueError(f"Unknown index profile {name}, expected one of {', '.join(INDEX_PROFILES)}")
+    profile = {'name': name, **INDEX_PROFILES[name]}
+
+    if space_type:
+        if space_type not in SPACE_TYPES:
+            raise ValueError(f"Unknown space type {space_type}, expected one of {', '.join(SPACE_TYPES)}")
+        profile['spaceType'] = space_type
+    if quantization:
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization}, expected one of {', '.join(QUANTIZATIONS)}")
+        profile['quantization'] = quantization
+
+    embedding_type = embedding_type or 'float'
+    if embedding_type not in EMBEDDING_TYPES:
+        raise ValueError(f"Unknown embedding type {embedding_type}, expected one of {', '.join(EMBEDDING_TYPES)}")
+    profile['embeddingType'] = embedding_type
+
+    if embedding_type in COMPACT_VECTOR_SETTINGS:
+        settings = COMPACT_VECTOR_SETTINGS[embedding_type]
+        if space_type and space_type != settings['spaceType']:
+            raise ValueError(f"{embedding_type} embeddings only support the {settings['spaceType']} space type")
+        if quantization and quantization != 'none':
+            raise ValueError(f"{embedding_type} embeddings cannot be quantized further")
+        profile.update(settings)
+        profile['quantization'] = 'none'
+    else:
+        profile['dataType'] = 'float'
+        profile['engine'] = 'lucene' if profile['quantization'] == 'byte' else 'faiss'
+    return profile
+
+def generate_vector_mapping(profile):
+    """knn_vector mapping of the embedding fields of an index created with a profile"""
+    mapping = {
+        "type": "knn_vector",
+        "dimension": EMBEDDING_DIMENSION,
+        "method": generate_knn_method(profile)
+    }
+    if profile['dataType'] != 'float':
+        mapping["data_type"] = profile['dataType']
+    return mapping
+
+def generate_knn_method(profile):
+    """HNSW method of the knn_vector fields of an index created with a profile"""
+    parameters = {
+        "ef_construction": profile['efConstruction'],
+        "m": profile['m']
+    }
+    if profile['quantization'] == 'fp16':
+        parameters["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+    elif profile['quantization'] == 'byte':
+        parameters["encoder"] = {"name": "sq"}
+
+    return {
+        "name": "hnsw",
+        "space_type": profile['spaceType'],
+        "engine": profile['engine'],
+        "parameters": parameters
+    }
@@ -1,204 +1,393 @@
-import pandas as pd
 import boto3
 import os
 import json
-import logging
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+import time
+from shared.clients import get_embedding_cache, get_opensearch_client, get_parameter, record_invocation
+from shared.local_search import LocalIndexStore
+from shared.metrics import InvocationMetrics, SampledLogger
+from shared.reranking import (
+    RERANK_CANDIDATES, RERANK_MAX_CANDIDATES, build_candidate_query, candidate_fingerprint_query, rerank_candidates, score_candidates
+)
+from shared.rescoring import RESCORE_OVERSAMPLE, RESCORE_VECTOR_SUFFIX, include_rescore_vectors, rescore_search_response
+from shared.result_cache import RESULT_CACHE_SETTLE_SECONDS, QueryResultCache, get_index_generation, query_fingerprint
+from shared.search_queries import (
+    build_identifier_query, build_query, fill_query_vectors, get_embedding_type, get_identifier_fields,
+    get_score_breakdown, get_search_backend, get_space_type, make_lean_query, parse_search_config
+)
 
+# Only lightweight modules are imported and no AWS call is made at import time, as this function is on the
+# critical path of the mapper page; SSM parameters and the embedding cache are loaded by the first request
+bedrock_runtime = boto3.client('bedrock-runtime')
 dynamodb = boto3.resource('dynamodb')
 
-def get_parameters():
-    """Get parameters from AWS Parameter Store"""
-    ssm = boto3.client('ssm')
-    response = ssm.get_parameters_by_path(
-        Path='/' + os.environ.get('AWS_BRANCH') + '/',
-        WithDecryption=True
-    )
-    params = {}
-    for param in response['Parameters']:
-        name = param['Name'].split('/')[-1]
-        params[name] = param['Value']
-    return params 
-
-params = get_parameters()
-bedrock_runtime = boto3.client('bedrock-runtime')
+# results of repeated lookups, kept across warm invocations for the current generation of each index
+result_cache = QueryResultCache()
+
+# snapshots of the indexes searched in-process, kept across warm invocations for the current generation of each index
+local_indexes = LocalIndexStore(os.environ.get('ASSET_BUCKET_NAME'))
+
+# Largest number of source items accepted by one batch request
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', 100))
+
+RESPONSE_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+    "Content-Type": "application/json",
+    # lets the browser show the Server-Timing breakdown of cross-origin responses
+    "Timing-Allow-Origin": "*"
+}
 
 def lambda_handler(event, context):
+    """
+    Find the related items of one source item, or of several with POST /related-items/batch.
+    The time spent in each stage (parse, cache, load, identifier, embed, search, rescore, rerank, serialize) is returned in
+    a Server-Timing header and logged in one metrics record per invocation, see shared.metrics.
+    """
+    cold = record_invocation()
+    metrics = InvocationMetrics('findRelatedItems')
+    metrics.set_property('coldStart', cold)
     try:
-        credentials = boto3.Session().get_credentials()
-        auth = AWSV4SignerAuth(credentials, os.environ.get('AWS_REGION'), 'aoss')
-        
-        # Get OpenSearch endpoint from SSM
-        opensearch_endpoint = params.get('OPENSEARCH_ENDPOINT')
-        host = opensearch_endpoint.replace('https://', '')
-
-        # create an opensearch client and use the request-signer
-        client = OpenSearch(
-            hosts=[{'host': host, 'port': 443}],
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-            pool_maxsize=20,
-        )
+        # OpenSearch client kept across warm invocations, reusing its pooled connections
+        client = get_opensearch_client()
 
-        try:
-            request = json.loads(event.get('body'))
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
-            raise
-
-        opensearch_query = request.get("opensearchQuery")
-        query = opensearch_query.get("searchConfig")
-        
-        # If searchConfig is a string, parse it as JSON
-        if isinstance(query, str):
+        with metrics.stage('parse'):
             try:
-                query = json.loads(query)
+                request = json.loads(event.get('body'))
             except json.JSONDecodeError as e:
-                print(f"Failed to parse searchConfig JSON string: {e}")
-                raise ValueError(f"Invalid JSON in searchConfig: {e}")
+                print(f"JSON decode error: {e}")
+                raise
 
-        for query_type in ['must', 'should']:
-            if query_type not in query['query']['bool']:
-                continue
-            
-            queries = query['query']['bool'][query_type]
-            
-            for i in range(len(queries) - 1, -1, -1):
-                subquery = queries[i]
-                if not isinstance(subquery, dict) or 'function_score' not in subquery:
-                    continue
-                
-                function_score_query = subquery['function_score']['query']
-                
-                if 'knn' in function_score_query:
-                    # Handle KNN queries
-                    knn_obj = function_score_query['knn']
-                    if not isinstance(knn_obj, dict):
-                        continue
-                    
-                    first_key = next(iter(knn_obj)) # e.g. actorsEmbedding
-                    first_key_without_embedding = first_key.replace('Embedding', '') # e.g. actors
-                    
-                    # Get the value and apply deduplication if needed
-                    value = request.get(first_key_without_embedding)
-                    
-                    if value == '':
-                        queries.pop(i)
-                        continue
-                        
-                    # some of these fields include a lot of duplicate names and are indexed and embedded with duplicates removed, so we need to remove here also
-                    if first_key_without_embedding in ['producers', 'directors', 'writers', 'actors']:
-                        value = remove_duplicate_names(value)
-                    
-                    #get embedding, but remove "Embedding from key name"
-                    bedrock_response = bedrock_runtime.invoke_model(
-                        modelId="cohere.embed-multilingual-v3",
-                        body=json.dumps({
-                            "input_type": "search_document",
-                            "texts": [value],
-                            "truncate": "NONE"
-                        })
-                    )
-
-                    bedrock_result = json.loads(bedrock_response['body'].read())
-                    
-                    embeddings = bedrock_result.get('embeddings', [])
-                    embedding = embeddings[0]
-                    knn_obj[first_key]['vector'] = embedding
-                    
-                    # Add _name field for vector queries
-                    if '_name' not in subquery['function_score']:
-                        subquery['function_score']['_name'] = f"{first_key}_function"
-                    
-                elif 'term' in function_score_query:
-                    # Handle term queries
-                    term_obj = function_score_query['term']
-                    if not isinstance(term_obj, dict):
-                        continue
-                    
-                    first_key = next(iter(term_obj))
-                    field_value = request.get(first_key)
-                    
-                    # Don't try to look for similarity if the source record doesn't have a value
-                    if field_value == '' or field_value is None:
-                        queries.pop(i)
-                        continue
-                    
-                    term_obj[first_key] = field_value
-                    
-                    # Add _name field for exact queries
-                    if '_name' not in subquery['function_score']:
-                        subquery['function_score']['_name'] = f"{first_key}_function"
-
-        print(f"Final query: {json.dumps(query, default=str)}")
-        
-        # Post to OpenSearch to find k-NN + hybrid search query
-        response = client.search(
-            body = query,
-            index = request.get('indexName')
-        )
-        
-        item_results = response['hits']['hits']
-        
-        # iterate over the item_results array, and remove certain keys
-        for item_result in item_results:
-            item_result.pop('_index', None)
-            item_result.pop('_id', None)
-
-            if '_source' in item_result and isinstance(item_result['_source'], dict):
-                # Remove any field that ends with "Embedding"
-                embedding_fields = [key for key in item_result['_source'].keys() if key.endswith('Embedding')]
-                for field in embedding_fields:
-                    item_result['_source'].pop(field, None)
-            
+            search_config = parse_search_config(request.get("opensearchQuery"))
+
+        # exact identifier matches are looked up first, unless the caller asks for the full search
+        identifier_fields = [] if request.get('skipIdentifierLookup') else get_identifier_fields(request.get("opensearchQuery"))
+
+        # explain trees are large and slow to compute, so they are only returned when the request or the search config asks
+        explain = bool(request.get('explain', search_config.get('explain', False)))
+
+        # queries are embedded like the documents of the index; results found with compact vectors are
+        # reordered with float vectors unless the request turns rescoring off
+        embedding_type = get_embedding_type(request.get("opensearchQuery"))
+        # with rerank, a wider pool of candidates is searched and reranked locally with the weights and thresholds
+        # of the search config, so lookups differing only by those (e.g. while tuning them) are not searched again
+        rerank = bool(request.get('rerank', False))
+        candidates = min(int(request.get('rerankCandidates', RERANK_CANDIDATES)), RERANK_MAX_CANDIDATES) if rerank else 0
+        rescore = embedding_type != 'float' and bool(request.get('rescore', True)) and not rerank
+
+        # results are cached for the current generation of the index, which changes whenever items are written to it
+        index_name = request.get('indexName')
+        metrics.set_property('indexName', index_name)
+        with metrics.stage('cache'):
+            generation = None if request.get('skipCache') else get_cache_generation(index_name)
+
+        # indexes created for the local backend are searched in-process, with the snapshot of their current
+        # generation, which scores every vector exactly so there is nothing to rerank
+        if get_search_backend(request.get("opensearchQuery")) == 'local':
+            with metrics.stage('load'):
+                local_index = get_local_index(index_name)
+            metrics.set_property('searchBackend', 'local' if local_index is not None else 'opensearch')
+            if local_index is not None:
+                client = local_index
+                candidates = 0
+
+        # POST /related-items/batch resolves several source items of the same index in one call
+        if (event.get('resource') or '').rstrip('/').endswith('/batch'):
+            body = find_related_items_batch(client, request, search_config, identifier_fields, explain, generation, embedding_type, metrics)
+            cache_status = None
+        else:
+            with metrics.stage('parse'):
+                query, pending_vectors = build_query(search_config, request)
+                make_lean_query(query, explain)
+
+            with metrics.stage('cache'):
+                fingerprint = query_fingerprint(
+                    query, pending_vectors, identifierFields=identifier_fields, itemId=request.get('id'), embeddingType=embedding_type,
+                    rescore=rescore, rerankCandidates=candidates
+                )
+                body = result_cache.get(index_name, generation, fingerprint) if generation is not None else None
+            cache_status = 'HIT' if body is not None else 'MISS'
+            metrics.count('cacheHits' if body is not None else 'cacheMisses')
+            if body is None:
+                body = find_related_items(
+                    client, index_name, query, pending_vectors, identifier_fields, request.get('id'), embedding_type, rescore, metrics,
+                    rerank_candidates=candidates, space_type=get_space_type(request.get("opensearchQuery")), generation=generation
+                )
+                if generation is not None:
+                    result_cache.put(index_name, generation, fingerprint, body)
+            metrics.count('results', len(body['_items']))
+
+        print(f"Result cache: {result_cache.stats()}")
+        with metrics.stage('serialize'):
+            response_body = json.dumps(body)
+        metrics.count('responseBytes', len(response_body))
+
+        headers = {**RESPONSE_HEADERS, 'Server-Timing': metrics.server_timing()}
+        if cache_status is not None:
+            headers['X-Cache'] = cache_status
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                '_totalResults': response['hits']['total']['value'],
-                '_maxScore': response['hits']['max_score'],
-                '_items': item_results
-            }),
-            'headers': {
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*",
-                "Content-Type": "application/json"
-            }
+            'body': response_body,
+            'headers': headers
         }
     except Exception as e:
         print(f"Lambda handler error: {type(e).__name__}: {str(e)}")
+        metrics.count('errors')
         return {
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e),
                 'error_type': type(e).__name__
             }),
-            'headers': {
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Headers": "*",
-                "Content-Type": "application/json"
-            }
+            'headers': {**RESPONSE_HEADERS, 'Server-Timing': metrics.server_timing()}
         }
-    
-def remove_duplicate_names(csv_string):
+    finally:
+        metrics.emit()
+
+def get_cache_generation(index_name):
     """
-    Removes duplicate names from a comma-separated string while preserving order.
+    Generation of the index that cached results are valid for, or None when results of the index should not be
+    cached right now: its generation changed too recently for new documents to be searchable, or it is unknown.
     """
-    if not csv_string or not csv_string.strip():
-        return csv_string
-    
-    names = [name.strip() for name in csv_string.split(',') if name.strip()]
-    seen = set()
-    unique_names = []
-    
-    for name in names:
-        if name not in seen:
-            seen.add(name)
-            unique_names.append(name)
+    try:
+        generation, updated_at = get_index_generation(dynamodb.Table(get_parameter('INDEX_CONFIG_TABLE')), index_name)
+    except Exception as e:
+        print(f"Error getting index generation: {e}")
+        return None
+    if time.time() - updated_at < RESULT_CACHE_SETTLE_SECONDS:
+        return None
+    return generation
+
+def get_local_index(index_name):
+    """
+    Snapshot of an index for its current generation, loaded from the asset bucket the first time, or None when
+    the index has to be searched with OpenSearch: no snapshot was recorded for its current generation yet.
+    """
+    try:
+        response = dynamodb.Table(get_parameter('INDEX_CONFIG_TABLE')).get_item(
+            Key={'indexName': index_name},
+            ProjectionExpression='indexGeneration, localSnapshot',
+            ConsistentRead=True
+        )
+        item = response.get('Item') or {}
+        return local_indexes.get(index_name, int(item.get('indexGeneration', 0)), item.get('localSnapshot'))
+    except Exception as e:
+        print(f"Error loading the snapshot of {index_name}, searching OpenSearch: {e}")
+        return None
+
+def find_related_items(
+    client, index_name, query, pending_vectors, identifier_fields=(), source_item_id=None, embedding_type='float', rescore=False, metrics=None,
+    rerank_candidates=0, space_type='l2', generation=None
+):
+    """
+    Run the identifier lookup then, without an identifier match, the hybrid search of a query built by build_query.
+    With rescore, RESCORE_OVERSAMPLE times more results are searched and reordered with float vectors.
+    With rerank_candidates, the hybrid search is replaced by find_reranked_items.
+    Each step is timed as a stage of metrics.
+    """
+    metrics = metrics or InvocationMetrics('findRelatedItems')
+
+    # an item sharing an identifier with the source item settles the answer: skip embeddings and the hybrid search
+    identifier_query = build_identifier_query(query, identifier_fields, source_item_id) if identifier_fields else None
+    if identifier_query:
+        with metrics.stage('identifier'):
+            response = client.search(body=identifier_query, index=index_name, include_named_queries_score=True)
+        if response['hits']['hits']:
+            print(f"Identifier match: {json.dumps(identifier_query, default=str)}")
+            metrics.count('identifierMatches')
+            return format_search_response(response, identifier_match=True)
+
+    if rerank_candidates:
+        return find_reranked_items(client, index_name, query, pending_vectors, rerank_candidates, embedding_type, space_type, generation, metrics)
+
+    with metrics.stage('embed'):
+        embed_query_vectors(pending_vectors, embedding_type)
+
+    size = query.get('size', 10)
+    if rescore:
+        query['size'] = size * RESCORE_OVERSAMPLE
+        include_rescore_vectors(query)
+
+    print(f"Final query: {json.dumps(query, default=str)}")
+
+    # Post to OpenSearch to find k-NN + hybrid search query
+    with metrics.stage('search'):
+        response = client.search(
+            body = query,
+            index = index_name,
+            include_named_queries_score = True
+        )
+    if rescore:
+        with metrics.stage('rescore'):
+            rescore_search_response(bedrock_runtime, response, query, pending_vectors, size, cache=get_embedding_cache())
+
+    print(f"Embedding cache: {get_embedding_cache().stats()}")
+    return format_search_response(response)
+
+def find_reranked_items(client, index_name, query, pending_vectors, candidates, embedding_type='float', space_type='l2', generation=None, metrics=None):
+    """
+    Search the candidates nearest neighbours of every vector field of a query built by build_query, with their
+    vectors, then score and rank them locally with the weights and thresholds of the query (see shared.reranking).
+
+    The scored candidates are cached for the index generation under a fingerprint without weights or thresholds,
+    so the same lookup with other weights or thresholds is reranked without embedding or searching again.
+    Results are ranked on the vectors stored in the index, compact ones included, and carry no explain tree.
+    """
+    metrics = metrics or InvocationMetrics('findRelatedItems')
+    with metrics.stage('cache'):
+        fingerprint = query_fingerprint(
+            candidate_fingerprint_query(query), pending_vectors, embeddingType=embedding_type, spaceType=space_type, candidates=candidates
+        )
+        scored = result_cache.get(index_name, generation, fingerprint) if generation is not None else None
+
+    if scored is None:
+        with metrics.stage('embed'):
+            embed_query_vectors(pending_vectors, embedding_type)
+        candidate_query, vector_fields = build_candidate_query(query, candidates)
+        print(f"Candidate search of {candidate_query['size']} items on {', '.join(vector_fields) or 'no vector field'}")
+
+        with metrics.stage('search'):
+            response = client.search(body=candidate_query, index=index_name, include_named_queries_score=True)
+        with metrics.stage('rerank'):
+            scored = score_candidates(response, query, space_type)
+        if generation is not None:
+            result_cache.put(index_name, generation, fingerprint, scored)
+        print(f"Embedding cache: {get_embedding_cache().stats()}")
+    else:
+        metrics.count('candidateCacheHits')
+    metrics.count('candidates', len(scored['hits']))
+
+    with metrics.stage('rerank'):
+        response = rerank_candidates(scored, query, query.get('size', 10))
+    return format_search_response(response)
+
+def find_related_items_batch(client, request, search_config, identifier_fields=(), explain=False, generation=None, embedding_type='float', metrics=None):
+    """
+    Find the related items of every source item in request['items'], all searched in request['indexName']
+    with the same search config. Identifier lookups of all items are sent first with one _msearch; the
+    vector fields of the items without an identifier match are then embedded together and their searches
+    are sent with a single _msearch.
+
+    Returns {'_results': [...]} with one entry per source item, in order: either the same
+    _totalResults/_maxScore/_items/_identifierMatch object as a single search, or {'error': message}.
+    _msearch cannot return the scores of named queries, so the _scoreBreakdown of batch results only names
+    the matched clauses, and results on compact vectors are not rescored. With an index generation, items
+    found in the result cache are not searched again and the new results are cached. Each step is timed as a
+    stage of metrics, and items whose search fails are logged through a SampledLogger.
+    """
+    metrics = metrics or InvocationMetrics('findRelatedItems')
+    items = request.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError("Batch request requires a non-empty 'items' list")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise ValueError(f"Batch request has {len(items)} items, the maximum is {MAX_BATCH_ITEMS}")
+
+    index_name = request.get('indexName')
+    metrics.count('batchItems', len(items))
+    with metrics.stage('parse'):
+        built_queries = [build_query(search_config, item) for item in items]
+        for query, _ in built_queries:
+            make_lean_query(query, explain)
+    results = [None] * len(items)
+
+    # batch results are cached apart from single results, as their score breakdowns carry no scores
+    with metrics.stage('cache'):
+        fingerprints = [
+            query_fingerprint(query, pending_vectors, identifierFields=identifier_fields, itemId=item.get('id'), batch=True)
+            for item, (query, pending_vectors) in zip(items, built_queries)
+        ]
+        if generation is not None:
+            for position, fingerprint in enumerate(fingerprints):
+                results[position] = result_cache.get(index_name, generation, fingerprint)
+    cached = {position for position, result in enumerate(results) if result is not None}
+    metrics.count('cacheHits', len(cached))
+
+    identifier_lookups = []
+    if identifier_fields:
+        for position, (item, (query, _)) in enumerate(zip(items, built_queries)):
+            if results[position] is not None:
+                continue
+            identifier_query = build_identifier_query(query, identifier_fields, item.get('id'))
+            if identifier_query:
+                identifier_lookups.append((position, identifier_query))
+    if identifier_lookups:
+        with metrics.stage('identifier'):
+            responses = msearch(client, index_name, [identifier_query for _, identifier_query in identifier_lookups])
+        for (position, _), item_response in zip(identifier_lookups, responses):
+            # failed lookups fall back to the full search
+            if 'error' not in item_response and item_response['hits']['hits']:
+                results[position] = format_search_response(item_response, identifier_match=True)
+
+    remaining = [position for position, result in enumerate(results) if result is None]
+    pending_vectors = []
+    for position in remaining:
+        pending_vectors.extend(built_queries[position][1])
+    with metrics.stage('embed'):
+        embed_query_vectors(pending_vectors, embedding_type)
+
+    identifier_matches = len(items) - len(remaining) - len(cached)
+    metrics.count('identifierMatches', identifier_matches)
+    print(f"Batch of {len(items)} items, {len(cached)} cached, {identifier_matches} identifier matches, {len(pending_vectors)} vector clauses")
+    print(f"Embedding cache: {get_embedding_cache().stats()}")
+
+    if remaining:
+        with metrics.stage('search'):
+            responses = msearch(client, index_name, [built_queries[position][0] for position in remaining])
+        item_errors = SampledLogger()
+        for position, item_response in zip(remaining, responses):
+            if 'error' in item_response:
+                error = item_response['error']
+                results[position] = {'error': error.get('reason', str(error)) if isinstance(error, dict) else str(error)}
+                item_errors.log(f"Error searching related items of item {position}: {results[position]['error']}")
+                metrics.count('errors')
+            else:
+                results[position] = format_search_response(item_response)
+        item_errors.print_summary('item errors')
+
+    if generation is not None:
+        for position, result in enumerate(results):
+            if position not in cached and 'error' not in result:
+                result_cache.put(index_name, generation, fingerprints[position], result)
+    return {'_results': results}
+
+def msearch(client, index_name, queries):
+    """Send several searches on one index with a single _msearch, returning one response per query"""
+    searches = []
+    for query in queries:
+        searches.append({'index': index_name})
+        searches.append(query)
+    return client.msearch(body=searches)['responses']
+
+def embed_query_vectors(pending_vectors, embedding_type='float'):
+    """Embed the values of all pending knn clauses with a single batched call, failing the request if one cannot be embedded"""
+    errors = fill_query_vectors(bedrock_runtime, pending_vectors, cache=get_embedding_cache(), embedding_type=embedding_type)
+    if errors:
+        position, message = next(iter(errors.items()))
+        raise ValueError(f"Error embedding {pending_vectors[position][1].replace('Embedding', '')}: {message}")
+
+def format_search_response(response, identifier_match=False):
+    """
+    Shape a search response for the frontend, without index names, ids or embedding fields.
+    Each item gets a _scoreBreakdown of its score per matched clause, in place of the raw matched_queries.
+    _identifierMatch tells whether the results come from the exact identifier lookup instead of the hybrid search.
+    """
+    item_results = response['hits']['hits']
     
-    return ', '.join(unique_names)
\ No newline at end of file
+    # iterate over the item_results array, and remove certain keys
+    for item_result in item_results:
+        item_result.pop('_index', None)
+        item_result.pop('_id', None)
+        item_result['_scoreBreakdown'] = get_score_breakdown(item_result)
+        item_result.pop('matched_queries', None)
+
+        if '_source' in item_result and isinstance(item_result['_source'], dict):
+            # Remove any field that ends with "Embedding" (or holds a rescore vector), for search configs selecting their own _source fields
+            embedding_fields = [key for key in item_result['_source'].keys() if key.endswith('Embedding') or key.endswith(RESCORE_VECTOR_SUFFIX)]
+            for field in embedding_fields:
+                item_result['_source'].pop(field, None)
+
+    return {
+        '_totalResults': response['hits']['total']['value'],
+        '_maxScore': response['hits']['max_score'],
+        '_items': item_results,
+        '_identifierMatch': identifier_match
+    }
@@ -1,44 +1,35 @@
 import json
-import os
-import boto3
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from shared.clients import get_opensearch_client, record_invocation
+from shared.metrics import InvocationMetrics
 
 def lambda_handler(event, context):
+    """List the indexes of a user, logging one metrics record per invocation (see shared.metrics)"""
+    cold = record_invocation()
+    metrics = InvocationMetrics('getAllIndexes')
+    metrics.set_property('coldStart', cold)
     try:
         body = json.loads(event['body']) if isinstance(event.get('body'), str) else event.get('body', {})
         user_id = body.get('userId', '')
 
-        # Get OpenSearch endpoint from SSM
-        ssm = boto3.client('ssm')
-        branch = os.environ.get('AWS_BRANCH')
-        endpoint_param = ssm.get_parameter(Name=f'/{branch}/OPENSEARCH_ENDPOINT')
-        host = endpoint_param['Parameter']['Value'].replace('https://', '')
-        
-        # Set up OpenSearch client
-        credentials = boto3.Session().get_credentials()
-        auth = AWSV4SignerAuth(credentials, os.environ.get('AWS_REGION'), 'aoss')
-        
-        client = OpenSearch(
-            hosts=[{'host': host, 'port': 443}],
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-            pool_maxsize=20,
-        )
+        # OpenSearch client kept across warm invocations, with the endpoint from the cached SSM parameters
+        client = get_opensearch_client()
         
         # Get indices with wildcard pattern for user suffix
         try:
             # Use wildcard to get indices ending with user_id
             pattern = f"*-{user_id}"
-            indices_response = client.indices.get(index=pattern, ignore=[404])
+            with metrics.stage('list'):
+                indices_response = client.indices.get(index=pattern, ignore=[404])
             index_list = list(indices_response.keys()) if indices_response else []
         except Exception:
             # Fallback to getting all indices if wildcard fails
-            indices_response = client.cat.indices(format='json', h='index')
+            metrics.count('listFallbacks')
+            with metrics.stage('list'):
+                indices_response = client.cat.indices(format='json', h='index')
             all_indices = [idx['index'] for idx in indices_response] if indices_response else []
             suffix = f"-{user_id}"
             index_list = [idx for idx in all_indices if idx.endswith(suffix)]
+        metrics.count('indexes', len(index_list))
         
         return {
             'statusCode': 200,
@@ -54,6 +45,8 @@ def lambda_handler(event, context):
         }
         
     except Exception as e:
+        print(f"Lambda handler error: {type(e).__name__}: {str(e)}")
+        metrics.count('errors')
         return {
             'statusCode': 500,
             'headers': {
@@ -65,4 +58,6 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'error': str(e)
             })
-        }
\ No newline at end of file
+        }
+    finally:
+        metrics.emit()
\ No newline at end of file
@@ -0,0 +1,214 @@
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+STATUS_MATCHING = 'MATCHING'
+STATUS_ASSIGNING = 'ASSIGNING'
+STATUS_COMPLETED = 'COMPLETED'
+
+COUNT_NAMES = ['processedItems', 'failedItems', 'matchedPairs', 'assignedItems', 'groups', 'groupedItems', 'opensearchFailedItems']
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+class JobRunningError(Exception):
+    """Another invocation currently holds the lease of the grouping job of this index"""
+
+class GroupJob:
+    """
+    Persisted state of the title grouping job of one index, stored in the group job table keyed by index name.
+
+    The job first matches every ProcessingQueue item of the index (MATCHING), one page of items at a time,
+    then merges the matches into groups and writes the group id of every item (ASSIGNING). Each phase
+    stores the DynamoDB cursor of the next page, so the job continues where it stopped in a new invocation.
+    Like ingestion checkpoints, an invocation must hold the lease of the job to advance it.
+    """
+
+    def __init__(self, dynamodb_resource, table_name, index_name, owner=None):
+        self.table = dynamodb_resource.Table(table_name)
+        self.index_name = index_name
+        self.owner = owner
+        self.item = None
+
+    def load(self):
+        """Load the job, returning False when the index was never grouped"""
+        response = self.table.get_item(Key={'indexName': self.index_name}, ConsistentRead=True)
+        self.item = response.get('Item')
+        return self.item is not None
+
+    def create(self, min_score):
+        """Start a new job, replacing any previous job of the index unless it is running"""
+        now = int(time.time())
+        timestamp = _now_iso()
+        item = {
+            'indexName': self.index_name,
+            'jobId': str(uuid.uuid4()),
+            'status': STATUS_MATCHING,
+            'minScore': str(min_score),
+            'matchPages': 0,
+            'createdAt': timestamp,
+            'updatedAt': timestamp,
+        }
+        item.update({name: 0 for name in COUNT_NAMES})
+        try:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(leaseExpiresAt) OR leaseExpiresAt < :now',
+                ExpressionAttributeValues={':now': now},
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise JobRunningError(f"Grouping of {self.index_name} is running")
+            raise
+        self.item = item
+
+    def acquire(self, lease_seconds):
+        """Take the lease of an unfinished job. Raises JobRunningError if another invocation holds it."""
+        now = int(time.time())
+        try:
+            response = self.table.update_item(
+                Key={'indexName': self.index_name},
+                UpdateExpression='SET #owner = :owner, leaseExpiresAt = :lease, updatedAt = :timestamp ADD invocations :one',
+                ConditionExpression='attribute_exists(jobId) AND (attribute_not_exists(leaseExpiresAt) OR leaseExpiresAt < :now OR #owner = :owner)',
+                ExpressionAttributeNames={'#owner': 'owner'},
+                ExpressionAttributeValues={
+                    ':owner': self.owner,
+                    ':lease': now + lease_seconds,
+                    ':now': now,
+                    ':timestamp': _now_iso(),
+                    ':one': 1,
+                },
+                ReturnValues='ALL_NEW',
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise JobRunningError(f"Grouping of {self.index_name} is owned by another invocation")
+            raise
+        self.item = response['Attributes']
+
+    @property
+    def is_running(self):
+        """Whether an invocation currently holds the lease"""
+        return bool(self.item) and int(self.item.get('leaseExpiresAt', 0)) >= int(time.time())
+
+    @property
+    def status(self):
+        return self.item['status']
+
+    @property
+    def job_id(self):
+        return self.item['jobId']
+
+    @property
+    def min_score(self):
+        return float(self.item['minScore'])
+
+    @property
+    def match_pages(self):
+        return int(self.item.get('matchPages', 0))
+
+    def cursor(self, phase):
+        """DynamoDB ExclusiveStartKey of the next page of the phase, or None to start from the first page"""
+        cursor = self.item.get(f"{phase}Cursor")
+        return json.loads(cursor) if cursor else None
+
+    def set_total_items(self, total_items):
+        self._update('SET totalItems = :total, updatedAt = :timestamp', {':total': total_items})
+        self.item['totalItems'] = total_items
+
+    def commit_match_page(self, cursor, processed_items, failed_items, matched_pairs):
+        """Record a matched page, moving to the assignment phase after the last page"""
+        values = {
+            ':pages': 1,
+            ':processed': processed_items,
+            ':failed': failed_items,
+            ':pairs': matched_pairs,
+        }
+        if cursor:
+            update_expression = 'SET matchCursor = :cursor, updatedAt = :timestamp'
+            values[':cursor'] = json.dumps(cursor)
+        else:
+            update_expression = 'SET #status = :status, updatedAt = :timestamp REMOVE matchCursor'
+            values[':status'] = STATUS_ASSIGNING
+        update_expression += ' ADD matchPages :pages, processedItems :processed, failedItems :failed, matchedPairs :pairs'
+        self._update(update_expression, values)
+
+        self.item['matchCursor'] = json.dumps(cursor) if cursor else None
+        self.item['matchPages'] = self.match_pages + 1
+        self._add_counts(processedItems=processed_items, failedItems=failed_items, matchedPairs=matched_pairs)
+        if not cursor:
+            self.item['status'] = STATUS_ASSIGNING
+
+    def set_group_counts(self, groups, grouped_items):
+        self._update('SET #groups = :groups, groupedItems = :grouped, updatedAt = :timestamp', {':groups': groups, ':grouped': grouped_items})
+        self.item['groups'] = groups
+        self.item['groupedItems'] = grouped_items
+
+    def commit_assign_page(self, cursor, assigned_items, opensearch_failed_items):
+        """Record an assigned page, completing the job after the last page"""
+        values = {':assigned': assigned_items, ':opensearch_failed': opensearch_failed_items}
+        if cursor:
+            update_expression = 'SET assignCursor = :cursor, updatedAt = :timestamp'
+            values[':cursor'] = json.dumps(cursor)
+        else:
+            update_expression = 'SET #status = :status, updatedAt = :timestamp REMOVE assignCursor'
+            values[':status'] = STATUS_COMPLETED
+        update_expression += ' ADD assignedItems :assigned, opensearchFailedItems :opensearch_failed'
+        self._update(update_expression, values)
+
+        self.item['assignCursor'] = json.dumps(cursor) if cursor else None
+        self._add_counts(assignedItems=assigned_items, opensearchFailedItems=opensearch_failed_items)
+        if not cursor:
+            self.item['status'] = STATUS_COMPLETED
+
+    def release(self):
+        self._update('SET updatedAt = :timestamp REMOVE #owner, leaseExpiresAt', {})
+        self.item.pop('leaseExpiresAt', None)
+
+    def progress(self):
+        """Status and counts of the job, for API responses and logs"""
+        progress = {
+            'indexName': self.index_name,
+            'jobId': self.item['jobId'],
+            'status': self.item['status'],
+            'running': self.is_running,
+            'minScore': self.min_score,
+            'totalItems': int(self.item['totalItems']) if 'totalItems' in self.item else None,
+            'createdAt': self.item.get('createdAt'),
+            'updatedAt': self.item.get('updatedAt'),
+        }
+        progress.update({name: int(self.item.get(name, 0)) for name in COUNT_NAMES})
+
+        # matching and assignment each read every item once
+        total_items = progress['totalItems']
+        if self.item['status'] == STATUS_COMPLETED:
+            progress['percentComplete'] = 100.0
+        elif total_items:
+            done = progress['processedItems'] + progress['assignedItems']
+            progress['percentComplete'] = round(min(99.9, 100 * done / (2 * total_items)), 1)
+        else:
+            progress['percentComplete'] = 0.0
+        return progress
+
+    def _add_counts(self, **counts):
+        for name, value in counts.items():
+            self.item[name] = int(self.item.get(name, 0)) + value
+
+    def _update(self, update_expression, values):
+        values = dict(values)
+        values[':me'] = self.owner
+        values[':timestamp'] = _now_iso()
+        names = {'#owner': 'owner'}
+        if '#status' in update_expression:
+            names['#status'] = 'status'
+        if '#groups' in update_expression:
+            names['#groups'] = 'groups'
+        self.table.update_item(
+            Key={'indexName': self.index_name},
+            UpdateExpression=update_expression,
+            ConditionExpression='#owner = :me',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
@@ -0,0 +1,457 @@
+import os
+import boto3
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from botocore.config import Config
+from boto3.dynamodb.conditions import Key
+from shared.clients import get_embedding_cache, get_opensearch_client, get_parameter, record_invocation
+from shared.search_queries import build_query, fill_query_vectors, get_embedding_type, parse_search_config
+from shared.concurrency import AdaptiveConcurrencyLimiter
+from shared.metrics import InvocationMetrics, SampledLogger
+from shared.processing_queue import ProcessingQueueWriter
+from shared.result_cache import bump_index_generation
+from group_job import GroupJob, JobRunningError, STATUS_ASSIGNING, STATUS_COMPLETED, STATUS_MATCHING
+from union_find import DisjointSet
+
+# Concurrency of Bedrock embedding requests, adjusted between these bounds as throttling appears
+EMBEDDING_INITIAL_CONCURRENCY = int(os.environ.get('EMBEDDING_INITIAL_CONCURRENCY', 2))
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get('EMBEDDING_MAX_CONCURRENCY', 16))
+
+# Number of ProcessingQueue items matched or assigned per page; the job checkpoints after every page
+GROUP_PAGE_ITEMS = int(os.environ.get('GROUP_PAGE_ITEMS', 200))
+
+# Number of searches per _msearch request, and number of _msearch requests in flight
+GROUP_MSEARCH_ITEMS = int(os.environ.get('GROUP_MSEARCH_ITEMS', 25))
+GROUP_SEARCH_CONCURRENCY = int(os.environ.get('GROUP_SEARCH_CONCURRENCY', 4))
+
+# Time kept in reserve at the end of an invocation to checkpoint and start the continuation
+GROUP_DEADLINE_RESERVE_SECONDS = int(os.environ.get('GROUP_DEADLINE_RESERVE_SECONDS', 60))
+
+# Matches and groups are stored under this prefix of the asset bucket, outside of the ingested assets/ prefix
+GROUP_JOB_PREFIX = 'group-jobs'
+
+dynamodb_resource = boto3.resource('dynamodb')
+s3_client = boto3.client('s3')
+
+# throttles are retried by the embedding stage (which adapts its concurrency to them) instead of by botocore
+bedrock_runtime = boto3.client(
+    'bedrock-runtime',
+    config=Config(retries={'max_attempts': 1, 'mode': 'standard'}, max_pool_connections=EMBEDDING_MAX_CONCURRENCY)
+)
+
+asset_bucket_name = os.environ.get('ASSET_BUCKET_NAME')
+
+embedding_limiter = AdaptiveConcurrencyLimiter(initial=EMBEDDING_INITIAL_CONCURRENCY, maximum=EMBEDDING_MAX_CONCURRENCY)
+
+RESPONSE_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+    "Content-Type": "application/json"
+}
+
+def get_index_config(index_name):
+    """Get index configuration from DynamoDB"""
+    table = dynamodb_resource.Table(get_parameter('INDEX_CONFIG_TABLE'))
+    response = table.get_item(Key={'indexName': index_name})
+    return response.get('Item')
+
+def get_search_client():
+    # throttled or failed searches are retried by the client
+    return get_opensearch_client(
+        pool_maxsize=max(20, GROUP_SEARCH_CONCURRENCY * 2),
+        max_retries=3,
+        retry_on_status=(429, 502, 503, 504),
+        retry_on_timeout=True,
+    )
+
+def from_dynamodb(value):
+    """Convert the Decimal numbers of a DynamoDB item back to int or float"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {key: from_dynamodb(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_dynamodb(item) for item in value]
+    return value
+
+def query_items_page(index_name, cursor):
+    """Read one page of the ProcessingQueue items of an index, returning (items, cursor of the next page or None)"""
+    query = {
+        'KeyConditionExpression': Key('indexName').eq(index_name),
+        'Limit': GROUP_PAGE_ITEMS,
+    }
+    if cursor:
+        query['ExclusiveStartKey'] = cursor
+    response = dynamodb_resource.Table(get_parameter('PROCESSING_QUEUE_TABLE')).query(**query)
+    return response.get('Items', []), response.get('LastEvaluatedKey')
+
+def count_items(index_name):
+    """Number of ProcessingQueue items of an index, for progress reporting"""
+    table = dynamodb_resource.Table(get_parameter('PROCESSING_QUEUE_TABLE'))
+    query = {'KeyConditionExpression': Key('indexName').eq(index_name), 'Select': 'COUNT'}
+    total = 0
+    while True:
+        response = table.query(**query)
+        total += response['Count']
+        if 'LastEvaluatedKey' not in response:
+            return total
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def matches_key(index_name, job_id, page):
+    return f"{GROUP_JOB_PREFIX}/{index_name}/{job_id}/matches/{page:08d}.json"
+
+def groups_key(index_name, job_id):
+    return f"{GROUP_JOB_PREFIX}/{index_name}/{job_id}/groups.json"
+
+def match_page(client, index_name, search_config, items, min_score, embedding_type='float'):
+    """
+    Run the search config of the index for every item of a page, returning (matched pairs, failed items).
+    A pair (itemId, itemId) is kept when the match scores at least min_score. Queries are embedded with
+    the embedding_type of the index.
+    """
+    searches = []
+    pending_vectors = []
+    failed_items = 0
+    item_errors = SampledLogger()
+    for item in items:
+        query, item_pending_vectors = build_query(search_config, from_dynamodb(item))
+        if not query['query']['bool'].get('must') and not query['query']['bool'].get('should'):
+            # the item has no value for any field of the search config
+            continue
+
+        # only the item id of the matches is needed
+        query['_source'] = ['itemId']
+        query.pop('explain', None)
+        searches.append((item['id'], query, len(pending_vectors), len(item_pending_vectors)))
+        pending_vectors.extend(item_pending_vectors)
+
+    # items with a value that cannot be embedded are not searched
+    errors = fill_query_vectors(
+        bedrock_runtime, pending_vectors, cache=get_embedding_cache(), limiter=embedding_limiter, embedding_type=embedding_type
+    )
+    if errors:
+        kept = []
+        for search in searches:
+            item_id, _, first, count = search
+            embedding_errors = [errors[position] for position in range(first, first + count) if position in errors]
+            if embedding_errors:
+                item_errors.log(f"Error embedding item {item_id}: {embedding_errors[0]}")
+                failed_items += 1
+            else:
+                kept.append(search)
+        searches = kept
+
+    batches = [searches[start:start + GROUP_MSEARCH_ITEMS] for start in range(0, len(searches), GROUP_MSEARCH_ITEMS)]
+
+    def run_batch(batch):
+        body = []
+        for _, query, _, _ in batch:
+            body.append({'index': index_name})
+            body.append(query)
+        return client.msearch(body=body)['responses']
+
+    pairs = []
+    with ThreadPoolExecutor(max_workers=max(1, min(GROUP_SEARCH_CONCURRENCY, len(batches)))) as executor:
+        for batch, responses in zip(batches, executor.map(run_batch, batches)):
+            for (item_id, _, _, _), response in zip(batch, responses):
+                if 'error' in response:
+                    item_errors.log(f"Error searching matches of item {item_id}: {response['error']}")
+                    failed_items += 1
+                    continue
+                for hit in response['hits']['hits']:
+                    match_id = (hit.get('_source') or {}).get('itemId')
+                    if match_id and match_id != item_id and hit.get('_score') is not None and hit['_score'] >= min_score:
+                        pairs.append((item_id, match_id))
+
+    item_errors.print_summary('item errors')
+    return pairs, failed_items
+
+def run_matching(job, client, search_config, deadline, embedding_type='float', metrics=None):
+    """
+    Match pages of items until the last page or the deadline, returning False if time ran out.
+    Reading and checkpointing pages, matching them and storing their matches are timed as stages of metrics.
+    """
+    metrics = metrics or InvocationMetrics('groupItems')
+    index_name = job.index_name
+    cursor = job.cursor('match')
+    slowest_page_seconds = 0
+
+    while True:
+        if time.time() + GROUP_DEADLINE_RESERVE_SECONDS + 1.5 * slowest_page_seconds > deadline:
+            return False
+
+        page_start_time = time.perf_counter()
+        with metrics.stage('dynamodb'):
+            items, next_cursor = query_items_page(index_name, cursor)
+        with metrics.stage('matching'):
+            pairs, failed_items = match_page(client, index_name, search_config, items, job.min_score, embedding_type)
+        metrics.count('matchedItems', len(items))
+        metrics.count('matchPairs', len(pairs))
+        metrics.count('failedItems', failed_items)
+
+        # the matches of a page are stored before the cursor moves past it, a page matched twice overwrites the same object
+        with metrics.stage('upload'):
+            s3_client.put_object(
+                Bucket=asset_bucket_name,
+                Key=matches_key(index_name, job.job_id, job.match_pages),
+                Body=json.dumps(pairs).encode('utf-8'),
+                ContentType='application/json',
+            )
+        with metrics.stage('dynamodb'):
+            job.commit_match_page(next_cursor, len(items), failed_items, len(pairs))
+
+        page_seconds = time.perf_counter() - page_start_time
+        slowest_page_seconds = max(slowest_page_seconds, page_seconds)
+        print(f"Matched {len(items)} items in {page_seconds:.1f}s ({len(pairs)} pairs): {job.progress()}")
+
+        if not next_cursor:
+            return True
+        cursor = next_cursor
+
+def load_group_ids(job):
+    """
+    Merge all matched pairs of the job into groups, returning item id -> group id for the items that have a match.
+    The result is stored next to the matches, so later invocations of the assignment phase only read one object.
+    """
+    key = groups_key(job.index_name, job.job_id)
+    try:
+        response = s3_client.get_object(Bucket=asset_bucket_name, Key=key)
+        return json.loads(response['Body'].read())
+    except s3_client.exceptions.NoSuchKey:
+        pass
+
+    groups = DisjointSet()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    prefix = f"{GROUP_JOB_PREFIX}/{job.index_name}/{job.job_id}/matches/"
+    for page in paginator.paginate(Bucket=asset_bucket_name, Prefix=prefix):
+        for s3_object in page.get('Contents', []):
+            pairs = json.loads(s3_client.get_object(Bucket=asset_bucket_name, Key=s3_object['Key'])['Body'].read())
+            for item_id, match_id in pairs:
+                groups.union(item_id, match_id)
+
+    group_ids = groups.group_ids()
+    s3_client.put_object(Bucket=asset_bucket_name, Key=key, Body=json.dumps(group_ids).encode('utf-8'), ContentType='application/json')
+    job.set_group_counts(len(set(group_ids.values())), len(group_ids))
+    print(f"Merged matches into {len(set(group_ids.values()))} groups of {len(group_ids)} items")
+    return group_ids
+
+def write_group_ids_to_opensearch(client, index_name, group_ids_by_item):
+    """Set groupId on the documents of the given items, returning the number of items that could not be updated"""
+    item_ids = list(group_ids_by_item)
+    response = client.search(
+        index=index_name,
+        body={
+            "size": len(item_ids),
+            "_source": ["itemId"],
+            "query": {"terms": {"itemId": item_ids}}
+        }
+    )
+    actions = []
+    for hit in response['hits']['hits']:
+        item_id = hit['_source'].get('itemId')
+        actions.append({'update': {'_index': index_name, '_id': hit['_id']}})
+        actions.append({'doc': {'groupId': group_ids_by_item[item_id]}})
+    if not actions:
+        return len(item_ids)
+
+    result = client.bulk(body=actions)
+    failed = sum(1 for item in result.get('items', []) if item.get('update', {}).get('status', 500) >= 300)
+    return failed + len(item_ids) - len(actions) // 2
+
+def run_assignment(job, client, deadline, write_to_opensearch, metrics=None):
+    """
+    Write the group id of every item, page by page, until the last page or the deadline, returning False if time ran out.
+    Merging the matches, the ProcessingQueue reads and writes and the OpenSearch updates are timed as stages of metrics.
+    """
+    metrics = metrics or InvocationMetrics('groupItems')
+    index_name = job.index_name
+    with metrics.stage('grouping'):
+        group_ids = load_group_ids(job)
+    cursor = job.cursor('assign')
+    slowest_page_seconds = 0
+
+    if write_to_opensearch:
+        try:
+            client.indices.put_mapping(index=index_name, body={"properties": {"groupId": {"type": "keyword"}}})
+        except Exception as e:
+            print(f"Error adding groupId mapping: {e}")
+
+    with ProcessingQueueWriter(dynamodb_resource, get_parameter('PROCESSING_QUEUE_TABLE')) as processing_queue:
+        while True:
+            if time.time() + GROUP_DEADLINE_RESERVE_SECONDS + 1.5 * slowest_page_seconds > deadline:
+                return False
+
+            page_start_time = time.perf_counter()
+            # items without a match are a group of their own
+            with metrics.stage('dynamodb'):
+                items, next_cursor = query_items_page(index_name, cursor)
+                group_ids_by_item = {item['id']: group_ids.get(item['id'], item['id']) for item in items}
+                for item in items:
+                    item['groupId'] = group_ids_by_item[item['id']]
+                    processing_queue.put(item)
+                processing_queue.flush()
+
+            opensearch_failed_items = 0
+            if write_to_opensearch and items:
+                with metrics.stage('assigning'):
+                    try:
+                        opensearch_failed_items = write_group_ids_to_opensearch(client, index_name, group_ids_by_item)
+                    except Exception as e:
+                        print(f"Error writing group ids to OpenSearch: {e}")
+                        opensearch_failed_items = len(items)
+            metrics.count('assignedItems', len(items))
+            metrics.count('failedItems', opensearch_failed_items)
+
+            with metrics.stage('dynamodb'):
+                job.commit_assign_page(next_cursor, len(items), opensearch_failed_items)
+
+                # group ids are part of the documents returned by findRelatedItems, so its cached results are replaced
+                if write_to_opensearch and items:
+                    bump_index_generation(dynamodb_resource.Table(get_parameter('INDEX_CONFIG_TABLE')), index_name)
+
+            page_seconds = time.perf_counter() - page_start_time
+            slowest_page_seconds = max(slowest_page_seconds, page_seconds)
+            print(f"Assigned groups to {len(items)} items in {page_seconds:.1f}s: {job.progress()}")
+
+            if not next_cursor:
+                return True
+            cursor = next_cursor
+
+def invoke_continuation(context, index_name, write_to_opensearch):
+    """Continue the grouping job in a new asynchronous invocation of this function"""
+    boto3.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({'groupContinuation': {'indexName': index_name, 'writeToOpenSearch': write_to_opensearch}})
+    )
+
+def run_job(event, context, metrics=None):
+    """Advance the grouping job of an index until it completes or the invocation runs out of time"""
+    metrics = metrics or InvocationMetrics('groupItems')
+    index_name = event['indexName']
+    write_to_opensearch = event.get('writeToOpenSearch', True)
+
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000
+    deadline = time.time() + remaining_seconds
+    job = GroupJob(dynamodb_resource, get_parameter('GROUP_JOB_TABLE'), index_name, owner=getattr(context, 'aws_request_id', None) or str(uuid.uuid4()))
+    try:
+        with metrics.stage('dynamodb'):
+            job.acquire(lease_seconds=int(remaining_seconds) + 60)
+    except JobRunningError as e:
+        print(str(e))
+        return {'statusCode': 409, 'error': str(e)}
+
+    metrics.set_property('jobId', job.job_id)
+    metrics.set_property('jobStatus', job.status)
+    try:
+        if job.status == STATUS_COMPLETED:
+            print(f"Grouping of {index_name} is already completed")
+            return {'statusCode': 200, 'body': json.dumps(job.progress())}
+
+        client = get_search_client()
+        if job.status == STATUS_MATCHING:
+            with metrics.stage('dynamodb'):
+                if 'totalItems' not in job.item:
+                    job.set_total_items(count_items(index_name))
+                index_config = get_index_config(index_name)
+            if not index_config or not index_config.get('searchConfig'):
+                raise ValueError(f"Index {index_name} has no search config")
+            run_matching(job, client, parse_search_config(index_config), deadline, get_embedding_type(index_config), metrics)
+
+        if job.status == STATUS_ASSIGNING:
+            run_assignment(job, client, deadline, write_to_opensearch, metrics)
+    finally:
+        job.release()
+
+    print(f"Embedding cache: {get_embedding_cache().stats()}")
+    print(f"Embedding requests: {embedding_limiter.stats()}")
+
+    if job.status != STATUS_COMPLETED:
+        print(f"Continuing grouping of {index_name} in a new invocation")
+        invoke_continuation(context, index_name, write_to_opensearch)
+        return {'statusCode': 202, 'body': json.dumps(job.progress())}
+
+    print(f"Grouping of {index_name} completed: {job.progress()}")
+    return {'statusCode': 200, 'body': json.dumps(job.progress())}
+
+def handle_api_request(request, context, metrics=None):
+    """
+    Start or resume the grouping job of an index and report its progress.
+    A new job is started when the index was never grouped or when restart is set; an unfinished job
+    that is not running (e.g. after a failure) is resumed; otherwise the progress of the job is returned.
+    """
+    index_name = request.get('indexName')
+    if not index_name:
+        raise ValueError("indexName is required")
+    write_to_opensearch = request.get('writeToOpenSearch', True)
+
+    metrics = metrics or InvocationMetrics('groupItems')
+    metrics.set_property('indexName', index_name)
+    job = GroupJob(dynamodb_resource, get_parameter('GROUP_JOB_TABLE'), index_name)
+    with metrics.stage('dynamodb'):
+        exists = job.load()
+
+    if not exists or request.get('restart'):
+        if request.get('minScore') is None:
+            raise ValueError("minScore is required to start grouping")
+        try:
+            with metrics.stage('dynamodb'):
+                job.create(float(request['minScore']))
+        except JobRunningError as e:
+            return {'statusCode': 409, 'body': json.dumps({'error': str(e), **job.progress()}), 'headers': RESPONSE_HEADERS}
+        print(f"Starting grouping of {index_name} with job {job.job_id}")
+        invoke_continuation(context, index_name, write_to_opensearch)
+        return {'statusCode': 202, 'body': json.dumps(job.progress()), 'headers': RESPONSE_HEADERS}
+
+    if job.status != STATUS_COMPLETED and not job.is_running:
+        print(f"Resuming grouping of {index_name}, job {job.job_id}")
+        invoke_continuation(context, index_name, write_to_opensearch)
+        return {'statusCode': 202, 'body': json.dumps(job.progress()), 'headers': RESPONSE_HEADERS}
+
+    return {'statusCode': 200, 'body': json.dumps(job.progress()), 'headers': RESPONSE_HEADERS}
+
+def lambda_handler(event, context):
+    """
+    Groups the related items of a whole index: every item is searched with the search config of the index,
+    matches scoring at least minScore are merged into groups with union-find, and the group id of every
+    item is written to the ProcessingQueue table and its OpenSearch document.
+
+    Parameters:
+    - event: API request {"indexName": ..., "minScore": ..., "restart": false, "writeToOpenSearch": true},
+      or {'groupContinuation': {'indexName': ...}} to advance the job
+    - context: Lambda context
+
+    Logs one metrics record per invocation with the time spent in each stage (dynamodb, matching, upload,
+    grouping, assigning), see shared.metrics.
+    """
+    cold = record_invocation()
+    metrics = InvocationMetrics('groupItems')
+    metrics.set_property('coldStart', cold)
+    try:
+        if 'groupContinuation' in event:
+            print(f"continuation event: {event['groupContinuation']}")
+            metrics.set_property('indexName', event['groupContinuation'].get('indexName'))
+            return run_job(event['groupContinuation'], context, metrics)
+
+        try:
+            request = json.loads(event.get('body'))
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error: {e}")
+            raise
+        return handle_api_request(request, context, metrics)
+    except Exception as e:
+        print(f"Lambda handler error: {type(e).__name__}: {str(e)}")
+        metrics.count('errors')
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'error': str(e),
+                'error_type': type(e).__name__
+            }),
+            'headers': RESPONSE_HEADERS
+        }
+    finally:
+        metrics.emit()
@@ -0,0 +1,43 @@
+class DisjointSet:
+    """
+    Union-find over item ids, with path halving and union by size.
+    Items are added when they first appear in a union, so items without any match are not stored.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, item):
+        parent = self.parent
+        if item not in parent:
+            parent[item] = item
+            self.size[item] = 1
+            return item
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, first, second):
+        first_root = self.find(first)
+        second_root = self.find(second)
+        if first_root == second_root:
+            return first_root
+        if self.size[first_root] < self.size[second_root]:
+            first_root, second_root = second_root, first_root
+        self.parent[second_root] = first_root
+        self.size[first_root] += self.size[second_root]
+        return first_root
+
+    def group_ids(self):
+        """
+        Map every item of a group to the group id, the smallest item id of the group, so the id of a group
+        does not depend on the order the matches were merged in.
+        """
+        smallest = {}
+        for item in self.parent:
+            root = self.find(item)
+            if root not in smallest or item < smallest[root]:
+                smallest[root] = item
+        return {item: smallest[self.find(item)] for item in self.parent}
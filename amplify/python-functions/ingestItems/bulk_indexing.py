@@ -0,0 +1,104 @@
+import os
+import time
+from opensearchpy import helpers
+
+# Size limits of each _bulk request, in documents and in bytes
+BULK_CHUNK_DOCS = int(os.environ.get('BULK_CHUNK_DOCS', 100))
+BULK_CHUNK_BYTES = int(os.environ.get('BULK_CHUNK_BYTES', 5 * 1024 * 1024))
+
+# Rejected items are retried with exponential backoff, up to this many times
+BULK_MAX_RETRIES = int(os.environ.get('BULK_MAX_RETRIES', 3))
+BULK_INITIAL_BACKOFF_SECONDS = 2
+BULK_MAX_BACKOFF_SECONDS = 30
+
+# Item statuses worth retrying, 'N/A' is reported when the whole request failed (e.g. connection errors)
+RETRYABLE_STATUSES = {429, 502, 503, 504, 'N/A'}
+
+def bulk_index_documents(client, index_name, documents, chunk_size=BULK_CHUNK_DOCS, max_chunk_bytes=BULK_CHUNK_BYTES, max_retries=BULK_MAX_RETRIES, document_ids=None):
+    """
+    Indexes documents with the _bulk API.
+    Items rejected with a retryable status (throttling, unavailable) are retried on their own with backoff,
+    items rejected for any other reason (e.g. mapping errors) are not retried.
+
+    Documents given an existing document id in document_ids are partial updates of that document: their fields
+    replace the indexed ones and the fields they leave out (e.g. unchanged embeddings) are kept. The others are
+    indexed as new documents, with an id assigned by OpenSearch.
+
+    Returns a tuple (successful, errors) where successful is the number of indexed documents
+    and errors maps the position of each document that could not be indexed to its error.
+    """
+    def action(position):
+        if document_ids and document_ids[position]:
+            return {'_op_type': 'update', '_index': index_name, '_id': document_ids[position], 'doc': documents[position]}
+        return {'_op_type': 'index', '_index': index_name, '_source': documents[position]}
+
+    return _bulk_with_retries(client, action, len(documents), chunk_size, max_chunk_bytes, max_retries)
+
+def bulk_delete_documents(client, index_name, document_ids, chunk_size=BULK_CHUNK_DOCS, max_chunk_bytes=BULK_CHUNK_BYTES, max_retries=BULK_MAX_RETRIES):
+    """
+    Deletes documents by id with the _bulk API, retried like bulk_index_documents. Documents already deleted
+    count as deleted. Returns a tuple (successful, errors) like bulk_index_documents.
+    """
+    def action(position):
+        return {'_op_type': 'delete', '_index': index_name, '_id': document_ids[position]}
+
+    return _bulk_with_retries(client, action, len(document_ids), chunk_size, max_chunk_bytes, max_retries)
+
+def _bulk_with_retries(client, action, count, chunk_size, max_chunk_bytes, max_retries):
+    """Send the bulk actions of positions 0 to count - 1, built by action(position), retrying rejected ones"""
+    successful = 0
+    errors = {}
+    pending = list(range(count))
+
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            backoff = min(BULK_INITIAL_BACKOFF_SECONDS * 2 ** (attempt - 1), BULK_MAX_BACKOFF_SECONDS)
+            print(f"Retrying {len(pending)} rejected documents in {backoff}s (attempt {attempt} of {max_retries})")
+            time.sleep(backoff)
+
+        actions = (action(position) for position in pending)
+
+        # results are yielded in the same order as the actions because retries are handled here, not by the helper
+        retry = []
+        results = helpers.streaming_bulk(
+            client,
+            actions,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            max_retries=0,
+            raise_on_error=False,
+            raise_on_exception=False,
+        )
+        for position, (ok, result) in zip(pending, results):
+            operation, info = next(iter(result.items()), ('index', {}))
+            if ok or (operation == 'delete' and info.get('status') == 404):
+                successful += 1
+                errors.pop(position, None)
+                continue
+
+            errors[position] = info.get('error') or info.get('exception') or 'Unknown bulk indexing error'
+            if info.get('status') in RETRYABLE_STATUSES:
+                retry.append(position)
+
+        if not retry:
+            break
+        pending = retry
+
+    return successful, errors
+
+def find_indexed_item_ids(client, index_name, item_ids):
+    """
+    Return the item ids that already have a document in the index. Only searchable documents are found: the
+    index is refreshed first when documents were written since its last refresh, e.g. in the bulk-load state.
+    """
+    if not item_ids:
+        return set()
+    response = client.search(
+        index=index_name,
+        body={
+            "size": len(item_ids),
+            "_source": ["itemId"],
+            "query": {"terms": {"itemId": item_ids}}
+        }
+    )
+    return {hit['_source'].get('itemId') for hit in response['hits']['hits']}
@@ -0,0 +1,206 @@
+import math
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+# Number of rows processed together; vector field values of a chunk are embedded in full batches
+INGEST_CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 480))
+
+# Time kept in reserve at the end of an invocation to commit the checkpoint and start the continuation
+INGEST_DEADLINE_RESERVE_SECONDS = int(os.environ.get('INGEST_DEADLINE_RESERVE_SECONDS', 60))
+
+# Namespace of the deterministic item ids derived from the file key and row number
+ITEM_ID_NAMESPACE = uuid.UUID('6f1d3c52-8a0e-4b7d-9c61-2f4e5a7b8c90')
+
+STATUS_IN_PROGRESS = 'IN_PROGRESS'
+STATUS_COMPLETED = 'COMPLETED'
+STATUS_FAILED = 'FAILED'
+
+def item_id_for_row(file_key, row_number):
+    """Deterministic item id of a row, so a chunk processed twice writes the same ProcessingQueue items"""
+    return str(uuid.uuid5(ITEM_ID_NAMESPACE, f"{file_key}:{row_number}"))
+
+def lease_seconds(context, chunk_seconds=None):
+    """
+    Seconds to hold the lease on a job for: until the deadline of the next chunk when the duration of a chunk
+    is known (1.5 times the slowest one, plus INGEST_DEADLINE_RESERVE_SECONDS to commit it), never past the
+    timeout of the invocation. A retry of an invocation killed by a timeout or out of memory can then take the
+    job over as soon as the chunk it was writing should have been committed.
+    """
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000 if context else INGEST_DEADLINE_RESERVE_SECONDS * 10
+    if chunk_seconds is not None:
+        remaining_seconds = min(remaining_seconds, INGEST_DEADLINE_RESERVE_SECONDS + 1.5 * chunk_seconds)
+    return max(math.ceil(remaining_seconds), 1)
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+class LeaseUnavailableError(Exception):
+    """Another invocation currently owns the ingestion job of this file"""
+
+class IngestCheckpoint:
+    """
+    Persisted progress of the ingestion of one file, stored in the ingest job table keyed by file key.
+
+    An invocation first acquires a lease on the job (so duplicate S3 events or continuations never process
+    the same file concurrently), then for every chunk of rows records the chunk as pending before writing it
+    and commits it (advancing nextRow and the counts) once it is written. A pending chunk found when acquiring
+    the lease was interrupted mid-write and must be recovered before continuing.
+
+    The lease is renewed with every chunk until the deadline of the chunk (see lease_seconds), so it expires
+    shortly after an invocation that was killed. A job whose file cannot be read is marked as failed.
+
+    While the index is in the bulk-load state, the settings to restore are kept with the job, so whichever
+    invocation completes the file or fails restores them.
+
+    Snapshot exports and restores are jobs of the same table, keyed by their snapshot: rows are documents, and
+    an export commits the search_after cursor of its last document with each part.
+    """
+
+    def __init__(self, dynamodb_resource, table_name, file_key, index_name, owner):
+        self.table = dynamodb_resource.Table(table_name)
+        self.file_key = file_key
+        self.index_name = index_name
+        self.owner = owner
+        self.next_row = 0
+        self.pending_chunk = None
+        self.status = STATUS_IN_PROGRESS
+        self.counts = {'indexedRows': 0, 'failedRows': 0, 'storedItems': 0, 'unchangedRows': 0}
+        self.bulk_load_settings = None
+        self.cursor = None
+
+    def acquire(self, lease_seconds):
+        """
+        Create the job if needed and take its lease, loading the committed progress.
+        Raises LeaseUnavailableError if another invocation holds an unexpired lease.
+        """
+        now = int(time.time())
+        timestamp = _now_iso()
+        try:
+            response = self.table.update_item(
+                Key={'fileKey': self.file_key},
+                UpdateExpression=(
+                    'SET #owner = :owner, leaseExpiresAt = :lease, updatedAt = :timestamp, '
+                    'indexName = if_not_exists(indexName, :index_name), #status = if_not_exists(#status, :status), '
+                    'nextRow = if_not_exists(nextRow, :zero), createdAt = if_not_exists(createdAt, :timestamp) '
+                    'ADD invocations :one'
+                ),
+                ConditionExpression='attribute_not_exists(leaseExpiresAt) OR leaseExpiresAt < :now OR #owner = :owner',
+                ExpressionAttributeNames={'#owner': 'owner', '#status': 'status'},
+                ExpressionAttributeValues={
+                    ':owner': self.owner,
+                    ':lease': now + lease_seconds,
+                    ':now': now,
+                    ':timestamp': timestamp,
+                    ':index_name': self.index_name,
+                    ':status': STATUS_IN_PROGRESS,
+                    ':zero': 0,
+                    ':one': 1,
+                },
+                ReturnValues='ALL_NEW',
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise LeaseUnavailableError(f"Ingestion of {self.file_key} is owned by another invocation")
+            raise
+
+        job = response['Attributes']
+        self.next_row = int(job.get('nextRow', 0))
+        self.status = job.get('status', STATUS_IN_PROGRESS)
+        self.pending_chunk = job.get('pendingChunk')
+        if self.pending_chunk:
+            self.pending_chunk = {'start': int(self.pending_chunk['start']), 'end': int(self.pending_chunk['end'])}
+        for name in self.counts:
+            self.counts[name] = int(job.get(name, 0))
+        self.bulk_load_settings = job.get('bulkLoadSettings')
+        self.cursor = job.get('cursor')
+
+    @property
+    def completed(self):
+        return self.status == STATUS_COMPLETED
+
+    @property
+    def failed(self):
+        return self.status == STATUS_FAILED
+
+    def renew_lease(self, lease_seconds):
+        """Extend the lease to lease_seconds from now"""
+        self._update('SET leaseExpiresAt = :lease, updatedAt = :timestamp', {':lease': int(time.time()) + lease_seconds})
+
+    def begin_chunk(self, start, end, lease_seconds=None):
+        """Record the rows [start, end) as being written, renewing the lease to lease_seconds from now when given"""
+        update_expression = 'SET pendingChunk = :chunk, updatedAt = :timestamp'
+        values = {':chunk': {'start': start, 'end': end}}
+        if lease_seconds is not None:
+            update_expression += ', leaseExpiresAt = :lease'
+            values[':lease'] = int(time.time()) + lease_seconds
+        self._update(update_expression, values)
+        self.pending_chunk = {'start': start, 'end': end}
+
+    def commit_chunk(self, end, indexed_rows, failed_rows, stored_items, cursor=None, unchanged_rows=0):
+        """
+        Mark the pending chunk as written and continue from row end, or from the search_after cursor when given.
+        unchanged_rows counts the rows of an upsert that were skipped because their documents are up to date.
+        """
+        values = {':end': end, ':indexed': indexed_rows, ':failed': failed_rows, ':stored': stored_items, ':unchanged': unchanged_rows}
+        set_cursor = ''
+        if cursor is not None:
+            set_cursor = ', #cursor = :cursor'
+            values[':cursor'] = cursor
+        self._update(
+            f'SET nextRow = :end, updatedAt = :timestamp{set_cursor} REMOVE pendingChunk ADD indexedRows :indexed, failedRows :failed, storedItems :stored, unchangedRows :unchanged',
+            values, extra_names={'#cursor': 'cursor'} if cursor is not None else None,
+        )
+        self.next_row = end
+        if cursor is not None:
+            self.cursor = cursor
+        self.pending_chunk = None
+        self.counts['indexedRows'] += indexed_rows
+        self.counts['failedRows'] += failed_rows
+        self.counts['storedItems'] += stored_items
+        self.counts['unchangedRows'] += unchanged_rows
+
+    def save_bulk_load_settings(self, settings):
+        """Record that the index entered the bulk-load state, with the settings to restore"""
+        self._update('SET bulkLoadSettings = :settings, updatedAt = :timestamp', {':settings': settings})
+        self.bulk_load_settings = settings
+
+    def clear_bulk_load_settings(self):
+        """Record that the index left the bulk-load state"""
+        self._update('SET updatedAt = :timestamp REMOVE bulkLoadSettings', {})
+        self.bulk_load_settings = None
+
+    def release(self, completed=False):
+        """Give up the lease, marking the job as completed when all rows were committed"""
+        update_expression = 'SET updatedAt = :timestamp REMOVE #owner, leaseExpiresAt'
+        values = {}
+        if completed:
+            update_expression = 'SET updatedAt = :timestamp, #status = :status REMOVE #owner, leaseExpiresAt'
+            values[':status'] = STATUS_COMPLETED
+        self._update(update_expression, values, extra_names={'#status': 'status'} if completed else None)
+        if completed:
+            self.status = STATUS_COMPLETED
+
+    def fail(self, error):
+        """Give up the lease, marking the job as failed with error so it is not attempted again"""
+        self._update(
+            'SET updatedAt = :timestamp, #status = :status, #error = :error REMOVE #owner, leaseExpiresAt',
+            {':status': STATUS_FAILED, ':error': error}, extra_names={'#status': 'status', '#error': 'error'},
+        )
+        self.status = STATUS_FAILED
+
+    def _update(self, update_expression, values, extra_names=None):
+        names = {'#owner': 'owner'}
+        names.update(extra_names or {})
+        values = dict(values)
+        values[':me'] = self.owner
+        values[':timestamp'] = _now_iso()
+        self.table.update_item(
+            Key={'fileKey': self.file_key},
+            UpdateExpression=update_expression,
+            ConditionExpression='#owner = :me',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
@@ -1,45 +1,50 @@
 import os
-import pandas as pd
 import boto3
 import json
+import shutil
 import urllib.parse
 import tempfile
 import uuid
-from datetime import datetime, timezone
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+import time
+import resource
+from botocore.config import Config
+from shared.clients import get_embedding_cache, get_opensearch_client, get_parameter, record_invocation
+from shared.embeddings import embed_slots
+from shared.metrics import InvocationMetrics, SampledLogger
+from shared.search_queries import get_embedding_type, get_ingest_mode, get_search_backend, get_space_type
+from shared.concurrency import AdaptiveConcurrencyLimiter
+from shared.local_search import publish_snapshot, write_snapshot
+from shared.processing_queue import ProcessingQueueWriter, store_items
+from shared.rescoring import encode_rescore_vector, rescore_vector_field
+from shared.result_cache import RESULT_CACHE_SETTLE_SECONDS, bump_index_generation, get_index_generation
+from bulk_indexing import bulk_delete_documents, bulk_index_documents, find_indexed_item_ids
+from readers import read_row_chunks
+from transform import build_documents, plan_columns, to_camel_case
+from checkpoint import INGEST_CHUNK_ROWS, INGEST_DEADLINE_RESERVE_SECONDS, IngestCheckpoint, LeaseUnavailableError, item_id_for_row, lease_seconds
+from index_lifecycle import INGEST_BULK_LOAD, enter_bulk_load, ensure_item_id_mapping, ensure_rescore_vector_mapping, leave_bulk_load, warm_up_index
+from upsert import CONTENT_HASH_FIELD, content_hash, find_indexed_documents, iter_indexed_item_ids, plan_upsert, upsert_item_id
+from snapshot_jobs import export_index_snapshot, restore_index_snapshot
  
+# Concurrency of Bedrock embedding requests, adjusted between these bounds as throttling appears
+EMBEDDING_INITIAL_CONCURRENCY = int(os.environ.get('EMBEDDING_INITIAL_CONCURRENCY', 2))
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get('EMBEDDING_MAX_CONCURRENCY', 16))
+
 dynamodb = boto3.client('dynamodb')
 dynamodb_resource = boto3.resource('dynamodb')
-bedrock_runtime = boto3.client('bedrock-runtime')
 
-def get_parameters():
-    """Get parameters from AWS Parameter Store"""
-    ssm = boto3.client('ssm')
+# throttles are retried by the embedding stage (which adapts its concurrency to them) instead of by botocore
+bedrock_runtime = boto3.client(
+    'bedrock-runtime',
+    config=Config(retries={'max_attempts': 1, 'mode': 'standard'}, max_pool_connections=EMBEDDING_MAX_CONCURRENCY)
+)
 
-    # Get all parameters with path prefix
-    response = ssm.get_parameters_by_path(
-        Path='/' + os.environ.get('AWS_BRANCH') + '/',
-        WithDecryption=True
-    )
-    
-    # Convert list of parameters to dict
-    params = {}
-    for param in response['Parameters']:
-        # Extract parameter name after the path prefix
-        name = param['Name'].split('/')[-1]
-        params[name] = param['Value']
-        
-    return params 
-
-# Get parameters from Parameter Store
-params = get_parameters()
-processing_queue_table_name = params.get('PROCESSING_QUEUE_TABLE')
-index_config_table = params.get('INDEX_CONFIG_TABLE')
+# the learned concurrency limit is kept across chunks and warm invocations
+embedding_limiter = AdaptiveConcurrencyLimiter(initial=EMBEDDING_INITIAL_CONCURRENCY, maximum=EMBEDDING_MAX_CONCURRENCY)
 
 def get_index_config(index_name):
     """Get index configuration from DynamoDB"""
     try:
-        table = dynamodb_resource.Table(index_config_table)
+        table = dynamodb_resource.Table(get_parameter('INDEX_CONFIG_TABLE'))
         response = table.get_item(Key={'indexName': index_name})
         if 'Item' in response:
             return response['Item']
@@ -48,36 +53,307 @@ def get_index_config(index_name):
         print(f"Error getting index config: {e}")
         return None
 
-def to_camel_case(snake_str):
-    """Convert snake_case to camelCase"""
-    components = snake_str.replace('_', ' ').split(' ')
-    components = [comp for comp in components if comp]
-    if not components:
-        return snake_str.lower()
-    return components[0].lower() + ''.join(word.capitalize() for word in components[1:])
+def get_peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is reported in KB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def embed_documents(rows, vector_columns, embedding_type='float', fields_to_embed=None):
+    """
+    Adds embeddings for the vector fields of a chunk of rows, embedding all values in as few Bedrock calls as possible.
+    Empty values are not embedded. Vectors are of the embedding_type the index stores; with compact vectors, the
+    float vectors are kept in the rescore vector fields of the documents, to rescore search results.
+    fields_to_embed maps the position of a row to the vector fields to embed for it, all of them by default.
+
+    Returns a dict of row position -> error message for rows with a field that could not be embedded.
+    """
+    vector_fields = [to_camel_case(column) for column in vector_columns]
+
+    slots = []
+    for position, (_, document) in enumerate(rows):
+        for camel_field in (vector_fields if fields_to_embed is None else fields_to_embed[position]):
+            field_value = document.get(camel_field)
+            if field_value is None or not str(field_value).strip():
+                continue
+            slots.append(((position, camel_field), str(field_value)))
+
+    float_embeddings = {} if embedding_type != 'float' else None
+    embeddings, errors = embed_slots(
+        bedrock_runtime, slots, cache=get_embedding_cache(), limiter=embedding_limiter, embedding_type=embedding_type,
+        float_embeddings=float_embeddings
+    )
+
+    for (position, camel_field), embedding in embeddings.items():
+        rows[position][1][f"{camel_field}Embedding"] = embedding
+    for (position, camel_field), vector in (float_embeddings or {}).items():
+        rows[position][1][rescore_vector_field(camel_field)] = encode_rescore_vector(vector)
+
+    failed_rows = {}
+    for (position, camel_field), error in errors.items():
+        failed_rows.setdefault(position, f"Error embedding {camel_field}: {error}")
+    return failed_rows
+
+def process_chunk(client, index_name, file_key, chunk, column_plan, vector_columns, embedding_fields, processing_queue, recover_until=None, embedding_type='float', metrics=None, row_errors=None):
+    """
+    Embeds, indexes and stores one chunk of rows, returning (indexed rows, failed rows, stored items).
+    Rows before recover_until belong to a chunk interrupted mid-write: those already in the index are not indexed again.
+    Each step is timed as a stage of metrics, and rows that fail are logged through the row_errors SampledLogger.
+    """
+    metrics = metrics or InvocationMetrics('ingestItems')
+    row_errors = row_errors or SampledLogger()
+
+    with metrics.stage('transform'):
+        rows = list(zip(chunk.index, build_documents(chunk, column_plan)))
+        for index, document in rows:
+            document['itemId'] = item_id_for_row(file_key, index)
+
+    already_indexed = set()
+    if recover_until is not None:
+        with metrics.stage('recover'):
+            already_indexed = find_indexed_item_ids(client, index_name, [document['itemId'] for index, document in rows if index < recover_until])
+        print(f"Recovering interrupted rows {chunk.index[0]} to {recover_until - 1}, {len(already_indexed)} already indexed")
+
+    pending_rows = [(index, document) for index, document in rows if document['itemId'] not in already_indexed]
+    with metrics.stage('embed'):
+        failed_rows = embed_documents(pending_rows, vector_columns, embedding_type)
+
+    embedded_rows = []
+    for position, (index, document) in enumerate(pending_rows):
+        if position in failed_rows:
+            values = {field: value for field, value in document.items() if field not in embedding_fields}
+            row_errors.log(f"Error processing row {index}: {failed_rows[position]} {values}")
+            continue
+        embedded_rows.append((index, document))
+
+    # Post the chunk to OpenSearch with the _bulk API
+    with metrics.stage('index'):
+        indexed, index_errors = bulk_index_documents(client, index_name, [document for _, document in embedded_rows])
+    for position, error in index_errors.items():
+        row_errors.log(f"Failed to index document for row {embedded_rows[position][0]}: {error}")
+
+    # Store the indexed rows in DynamoDB, reusing the document without its embeddings
+    indexed_rows = [(index, document) for index, document in rows if document['itemId'] in already_indexed]
+    indexed_rows += [row for position, row in enumerate(embedded_rows) if position not in index_errors]
+    with metrics.stage('dynamodb'):
+        stored = store_items(processing_queue, index_name, [document for _, document in indexed_rows], {*embedding_fields, CONTENT_HASH_FIELD})
+
+    return indexed + len(already_indexed), len(failed_rows) + len(index_errors), stored
+
+def upsert_chunk(client, index_name, chunk, column_plan, vector_columns, embedding_fields, processing_queue, key_field=None, seen_item_ids=None, recover_until=None, embedding_type='float', metrics=None, row_errors=None):
+    """
+    Upserts one chunk of rows into an index in upsert mode, returning (indexed rows, failed rows, stored items, unchanged rows).
+
+    Each row gets a deterministic item id from its key_field (or its content hash, see upsert.py) and the hash of
+    its content. Rows whose indexed document has the same hash are skipped without embedding or writing anything,
+    rows that changed update their document in place with only their changed vector fields embedded again, and
+    new rows are indexed. A key already seen in seen_item_ids (the rows of the file before this chunk in this
+    invocation) keeps its first row. Rows before recover_until belong to a chunk interrupted mid-write: they
+    are found unchanged and only their ProcessingQueue items are written again.
+    """
+    metrics = metrics or InvocationMetrics('ingestItems')
+    row_errors = row_errors or SampledLogger()
+    seen_item_ids = set() if seen_item_ids is None else seen_item_ids
+    vector_fields = [to_camel_case(column) for column in vector_columns]
+
+    failed = 0
+    rows = []
+    with metrics.stage('transform'):
+        for index, document in zip(chunk.index, build_documents(chunk, column_plan)):
+            document[CONTENT_HASH_FIELD] = content_hash(document)
+            item_id = upsert_item_id(index_name, document, key_field)
+            if item_id is None or item_id in seen_item_ids:
+                row_errors.log(f"Error processing row {index}: {'empty key ' + key_field if item_id is None else 'duplicate key, the first row with this key is kept'}")
+                failed += 1
+                continue
+            seen_item_ids.add(item_id)
+            document['itemId'] = item_id
+            rows.append((index, document))
+
+    with metrics.stage('lookup'):
+        indexed_documents = find_indexed_documents(client, index_name, [document['itemId'] for _, document in rows])
+
+    unchanged_rows = []
+    pending_rows = []
+    plans = []
+    for index, document in rows:
+        plan = plan_upsert(document, indexed_documents.get(document['itemId']), vector_fields)
+        if plan is None:
+            unchanged_rows.append((index, document))
+        else:
+            pending_rows.append((index, document))
+            plans.append(plan)
+
+    with metrics.stage('embed'):
+        failed_rows = embed_documents(pending_rows, vector_columns, embedding_type, [changed_fields for _, changed_fields, _ in plans])
+
+    written_rows = []
+    document_ids = []
+    duplicate_ids = []
+    for position, ((index, document), (document_id, _, duplicates)) in enumerate(zip(pending_rows, plans)):
+        if position in failed_rows:
+            values = {field: value for field, value in document.items() if field not in embedding_fields}
+            row_errors.log(f"Error processing row {index}: {failed_rows[position]} {values}")
+            continue
+        written_rows.append((index, document))
+        document_ids.append(document_id)
+        duplicate_ids += duplicates
+
+    with metrics.stage('index'):
+        indexed, index_errors = bulk_index_documents(client, index_name, [document for _, document in written_rows], document_ids=document_ids)
+        if duplicate_ids:
+            bulk_delete_documents(client, index_name, duplicate_ids)
+    for position, error in index_errors.items():
+        row_errors.log(f"Failed to index document for row {written_rows[position][0]}: {error}")
+
+    # unchanged rows already have their items, unless their chunk was interrupted before storing them
+    stored_rows = [row for position, row in enumerate(written_rows) if position not in index_errors]
+    if recover_until is not None:
+        stored_rows += [(index, document) for index, document in unchanged_rows if index < recover_until]
+    with metrics.stage('dynamodb'):
+        stored = store_items(processing_queue, index_name, [document for _, document in stored_rows], {*embedding_fields, CONTENT_HASH_FIELD})
+
+    return indexed, failed + len(failed_rows) + len(index_errors), stored, len(unchanged_rows)
+
+def delete_missing_items(client, index_name, file_path, column_plan, key_field, processing_queue_table, metrics):
+    """
+    Delete the documents of an index in upsert mode, and their ProcessingQueue items, whose item id is not one
+    of the rows of the file just ingested, e.g. titles dropped from a catalog. Returns the number deleted.
+    """
+    with metrics.stage('parse'):
+        item_ids = set()
+        _, chunks = read_row_chunks(file_path, INGEST_CHUNK_ROWS)
+        for chunk in chunks:
+            for document in build_documents(chunk, column_plan):
+                document[CONTENT_HASH_FIELD] = content_hash(document)
+                item_ids.add(upsert_item_id(index_name, document, key_field))
+        item_ids.discard(None)
+
+    with metrics.stage('lookup'):
+        missing = [(document_id, item_id) for document_id, item_id in iter_indexed_item_ids(client, index_name) if item_id not in item_ids]
+    if not missing:
+        return 0
+
+    # items go first: a document left behind by a failure is missing again from the next file, which deletes it
+    with metrics.stage('dynamodb'), processing_queue_table.batch_writer() as batch:
+        for item_id in {item_id for _, item_id in missing}:
+            batch.delete_item(Key={'indexName': index_name, 'id': item_id})
+    with metrics.stage('index'):
+        deleted, errors = bulk_delete_documents(client, index_name, [document_id for document_id, _ in missing])
+    print(f"Deleted {deleted} documents missing from the file, {len(errors)} failed")
+    return deleted
+
+def invoke_continuation(context, bucket, file_key):
+    """Continue the ingestion of a file in a new asynchronous invocation of this function"""
+    boto3.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({'ingestContinuation': {'bucket': bucket, 'fileKey': file_key}})
+    )
+
+def invoke_local_snapshot(context, index_name):
+    """Export the snapshot of an index searched in-process in a new asynchronous invocation of this function"""
+    boto3.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({'localSnapshot': {'indexName': index_name}})
+    )
+
+def build_local_snapshot(index_name, metrics):
+    """
+    Export an index searched by the local backend into a snapshot of its current generation, upload it to the
+    asset bucket and record it in the index config, see shared.local_search. findRelatedItems searches the
+    index with OpenSearch until then.
+    """
+    index_config = get_index_config(index_name)
+    index_config_table = dynamodb_resource.Table(get_parameter('INDEX_CONFIG_TABLE'))
+    generation, updated_at = get_index_generation(index_config_table, index_name)
+
+    # the last documents written only become searchable, and so exportable, some seconds after they are written
+    settle_seconds = RESULT_CACHE_SETTLE_SECONDS - (time.time() - updated_at)
+    if settle_seconds > 0:
+        time.sleep(settle_seconds)
+
+    directory = tempfile.mkdtemp()
+    try:
+        with metrics.stage('snapshot'):
+            try:
+                manifest = write_snapshot(
+                    get_opensearch_client(), index_name, directory, generation, get_embedding_type(index_config), get_space_type(index_config)
+                )
+            except ValueError as e:
+                # too large to be searched in-process: searches keep going to OpenSearch
+                print(f"No snapshot of {index_name}: {e}")
+                return {"statusCode": 200, "body": json.dumps({"message": str(e), "stagesMs": metrics.stage_totals()})}
+        with metrics.stage('upload'):
+            recorded = publish_snapshot(boto3.client('s3'), os.environ.get('ASSET_BUCKET_NAME'), index_config_table, directory, manifest)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    metrics.count('snapshotDocuments', manifest['documents'])
+
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({
+            "message": f"Snapshot of {index_name} generation {generation} {'recorded' if recorded else 'outdated, not recorded'}",
+            "documents": manifest['documents'],
+            "stagesMs": metrics.stage_totals()
+        })
+    }
 
 def lambda_handler(event, context):
     """    
     This function:
-    1. Processes the event when a file is uploaded to S3
-    2. Reads the excel file contents
-    3. Indexes the items into OpenSearch based on index configuration
+    1. Processes the event when a file is uploaded to S3, or a continuation event for a file that is partially ingested
+    2. Streams the file contents (.xlsx, .csv or .parquet) in chunks of rows, from the last committed checkpoint
+    3. Indexes the items into OpenSearch based on index configuration, or in upsert mode only writes the rows that
+       changed since the previous upload (optionally deleting the items it no longer has)
     4. Adds the items to the processing queue DynamoDB table
+    5. Commits a checkpoint after every chunk, and continues in a new invocation before running out of time
     
     Parameters:
-    - event: Lambda event containing S3 event
+    - event: Lambda event containing S3 event, or {'ingestContinuation': {'bucket': ..., 'fileKey': ...}}, or
+      {'localSnapshot': {'indexName': ...}} to export the snapshot of an index searched in-process, or
+      {'snapshotExport': {'indexName': ..., 'snapshotId': optional}} to export an index with its vectors, or
+      {'snapshotRestore': {'snapshot': 'snapshots/<index name>/<snapshot id>', 'indexName': ...}} to load such a
+      snapshot into another index without embedding again
     - context: Lambda context
-    
+
+    Logs one metrics record per invocation with the time spent in each stage (download, parse, transform,
+    embed, index, dynamodb, refresh, ...), see shared.metrics.
     """
+    cold = record_invocation()
+    metrics = InvocationMetrics('ingestItems')
+    metrics.set_property('coldStart', cold)
     try:
-        print(f"event: {event['Records'][0]}")
-        
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        file_key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
+        if 'localSnapshot' in event:
+            index_name = event['localSnapshot']['indexName']
+            metrics.set_property('indexName', index_name)
+            return build_local_snapshot(index_name, metrics)
+
+        # exports and restores of snapshots with their vectors, see snapshot_jobs.py
+        if 'snapshotExport' in event:
+            index_name = event['snapshotExport']['indexName']
+            metrics.set_property('indexName', index_name)
+            return export_index_snapshot(event['snapshotExport'], context, metrics, get_index_config(index_name))
+
+        if 'snapshotRestore' in event:
+            index_name = event['snapshotRestore']['indexName']
+            metrics.set_property('indexName', index_name)
+            return restore_index_snapshot(event['snapshotRestore'], context, metrics, get_index_config(index_name))
+
+        if 'ingestContinuation' in event:
+            print(f"continuation event: {event['ingestContinuation']}")
+            bucket = event['ingestContinuation']['bucket']
+            file_key = event['ingestContinuation']['fileKey']
+        else:
+            print(f"event: {event['Records'][0]}")
+            bucket = event['Records'][0]['s3']['bucket']['name']
+            file_key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
         
         # Extract indexName from file path (e.g., assets/identityId/indexName/unique-file-name.xlsx -> indexName)
         path_parts = file_key.split('/')
         index_name = path_parts[2]  # assets/identityId/indexName/unique-file-name.xlsx
+        metrics.set_property('indexName', index_name)
+        metrics.set_property('fileKey', file_key)
 
         # if bucket or file key is empty, return error
         if not bucket or not file_key:
@@ -86,6 +362,33 @@ def lambda_handler(event, context):
                 'error': 'Missing required parameters'
             }
 
+        # Take the lease on the ingestion job of this file and load its checkpoint. When another invocation holds
+        # the lease, LeaseUnavailableError fails this one so Lambda retries the event once the lease expires
+        checkpoint = IngestCheckpoint(
+            dynamodb_resource, get_parameter('INGEST_JOB_TABLE'), file_key, index_name,
+            owner=getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+        )
+        with metrics.stage('checkpoint'):
+            checkpoint.acquire(lease_seconds=lease_seconds(context))
+
+        if checkpoint.failed:
+            print(f"{file_key} could not be read by a previous invocation, skipping")
+            checkpoint.release()
+            return {
+                'statusCode': 400,
+                'error': f"Error loading file {file_key}"
+            }
+
+        if checkpoint.completed:
+            print(f"{file_key} was already ingested, skipping")
+            checkpoint.release()
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": "Already ingested", **checkpoint.counts})
+            }
+
+        print(f"Resuming {file_key} from row {checkpoint.next_row}" if checkpoint.next_row else f"Starting ingestion of {file_key}")
+
         # Initialize S3 client
         s3_client = boto3.client('s3')
         
@@ -93,9 +396,10 @@ def lambda_handler(event, context):
         # get the file extension from the file key
         file_suffix = "." + file_key.split('.')[-1]
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_suffix) as tmp_file:
+        with metrics.stage('download'), tempfile.NamedTemporaryFile(delete=False, suffix=file_suffix) as tmp_file:
             s3_client.download_file(bucket, file_key, tmp_file.name)
             file_path = tmp_file.name
+        metrics.count('downloadBytes', os.path.getsize(file_path))
 
         print(f"file path: {file_path}")
 
@@ -103,135 +407,176 @@ def lambda_handler(event, context):
         index_config = get_index_config(index_name)
         vector_fields = index_config.get('vectorFieldList', []) if index_config else []
         exact_fields = index_config.get('exactFieldList', []) if index_config else []
+        # compact indexes store int8 or binary vectors, in knn_vector fields of the matching data type
+        embedding_type = get_embedding_type(index_config)
+        # indexes in upsert mode key rows by their upsertKey column (or their content) and only write changed rows
+        upsert = get_ingest_mode(index_config) == 'upsert'
+        key_field = to_camel_case(index_config['upsertKey']) if upsert and index_config.get('upsertKey') else None
         
-        credentials = boto3.Session().get_credentials()
-        auth = AWSV4SignerAuth(credentials, os.environ.get('AWS_REGION'), 'aoss')
-        
-        # Get OpenSearch endpoint from SSM
-        opensearch_endpoint = params.get('OPENSEARCH_ENDPOINT')
-        host = opensearch_endpoint.replace('https://', '')
-
-        # create an opensearch client and use the request-signer
-        client = OpenSearch(
-            hosts=[{'host': host, 'port': 443}],
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-            pool_maxsize=20,
-        )
+        # OpenSearch client kept across warm invocations, reusing its pooled connections
+        client = get_opensearch_client()
 
         try:
-            df = pd.read_excel(file_path, na_filter = False)
-            print(f"Successfully loaded file")
+            with metrics.stage('parse'):
+                columns, chunks = read_row_chunks(file_path, INGEST_CHUNK_ROWS, start_row=checkpoint.next_row)
+            print(f"Successfully opened file")
         except Exception as e:
             print(f"Error loading file: {e}")
-            return
+            os.remove(file_path)
+            checkpoint.fail(str(e))
+            return {
+                'statusCode': 400,
+                'error': f"Error loading file: {e}"
+            }
+
+        ensure_item_id_mapping(client, index_name)
+        if embedding_type != 'float':
+            ensure_rescore_vector_mapping(client, index_name, [to_camel_case(column) for column in vector_fields])
+
+        # documents written by earlier invocations for this file are not searchable until a refresh in the bulk-load
+        # state (refresh_interval -1), even when the invocation that wrote them was killed before leaving it, so
+        # the index is refreshed before the recovery and upsert lookups search for them
+        if checkpoint.next_row or checkpoint.pending_chunk:
+            with metrics.stage('refresh'):
+                client.indices.refresh(index=index_name)
+
+        # the index stays in the bulk-load state across continuations, until the file is ingested or fails
+        if INGEST_BULK_LOAD and checkpoint.bulk_load_settings is None:
+            checkpoint.save_bulk_load_settings(enter_bulk_load(client, index_name))
         
-        # Process each row
-        successful_posts = 0
-        for index, row in df.iterrows():
-            try:
-                document = {}
-                
-                # Process each column dynamically
-                for column in df.columns:
-                    raw_value = row.get(column, '')
-                    camel_field = to_camel_case(column)
-                    
-                    # Apply special processing for certain fields
-                    if column.lower() in ['producers', 'directors', 'writers', 'actors']:
-                        field_value = remove_duplicate_names(str(raw_value))
-                    elif is_numeric_value(raw_value):
-                        field_value = safe_int_conversion(raw_value)
-                    else:
-                        field_value = str(raw_value)
-                    
-                    # Check if field is in vector configuration
-                    if column in vector_fields:
-                        # Generate embedding
-                        response = bedrock_runtime.invoke_model(
-                            modelId="cohere.embed-multilingual-v3",
-                            body=json.dumps({
-                                "input_type": "search_document",
-                                "texts": [field_value],
-                                "truncate": "NONE"
-                            })
-                        )
-                        embedding = json.loads(response['body'].read()).get('embeddings', [])[0]
-                        
-                        document[f"{camel_field}Embedding"] = embedding
-                        document[camel_field] = field_value
-                    
-                    # Check if field is in exact configuration
-                    # elif column in exact_fields:
-                    #     document[camel_field] = field_value
-                    # all other fields (even if not used), will be keyword fields
-                    else:
-                        document[camel_field] = field_value
-                
-                # Post to OpenSearch
-                response = client.index(
-                    index = index_name,
-                    body = document,
+        # Process rows in chunks so embeddings can be requested in full batches across rows and columns
+        start_time = time.perf_counter()
+        processed_rows = 0
+        slowest_chunk_seconds = 0
+        completed = True
+        column_plan = plan_columns(columns)
+        vector_columns = [column for column in columns if column in vector_fields]
+        embedding_fields = {f"{to_camel_case(column)}Embedding" for column in vector_columns}
+        embedding_fields |= {rescore_vector_field(field) for field in embedding_fields}
+        processing_queue = ProcessingQueueWriter(dynamodb_resource, get_parameter('PROCESSING_QUEUE_TABLE'))
+        index_config_table = dynamodb_resource.Table(get_parameter('INDEX_CONFIG_TABLE'))
+        row_errors = SampledLogger()
+        seen_item_ids = set()
+        deleted = 0
+        try:
+            # reading a chunk from the file is timed as parsing
+            for chunk in metrics.timed('parse', chunks):
+                # Hand over to a new invocation while there is still time to finish a chunk
+                if context and context.get_remaining_time_in_millis() / 1000 < INGEST_DEADLINE_RESERVE_SECONDS + 1.5 * slowest_chunk_seconds:
+                    completed = False
+                    break
+
+                chunk_start_time = time.perf_counter()
+                start_row = int(chunk.index[0])
+                end_row = int(chunk.index[-1]) + 1
+                pending_chunk = checkpoint.pending_chunk
+                recover_until = pending_chunk['end'] if pending_chunk and pending_chunk['start'] <= start_row < pending_chunk['end'] else None
+
+                with metrics.stage('checkpoint'):
+                    checkpoint.begin_chunk(start_row, end_row, lease_seconds(context, slowest_chunk_seconds or None))
+                if upsert:
+                    indexed, failed, stored, unchanged = upsert_chunk(
+                        client, index_name, chunk, column_plan, vector_columns, embedding_fields, processing_queue,
+                        key_field, seen_item_ids, recover_until, embedding_type, metrics, row_errors
+                    )
+                else:
+                    indexed, failed, stored = process_chunk(
+                        client, index_name, file_key, chunk, column_plan, vector_columns, embedding_fields, processing_queue,
+                        recover_until, embedding_type, metrics, row_errors
+                    )
+                    unchanged = 0
+                with metrics.stage('checkpoint'):
+                    checkpoint.commit_chunk(end_row, indexed, failed, stored, unchanged_rows=unchanged)
+
+                # related items cached by findRelatedItems for the previous generation of the index are no longer served
+                if indexed:
+                    with metrics.stage('dynamodb'):
+                        bump_index_generation(index_config_table, index_name)
+
+                print(f"Indexed {indexed} of {len(chunk)} rows {start_row} to {end_row - 1}, {unchanged} unchanged, {failed} failed")
+                metrics.count('rows', len(chunk))
+                metrics.count('indexedRows', indexed)
+                metrics.count('unchangedRows', unchanged)
+                metrics.count('failedRows', failed)
+                metrics.count('storedItems', stored)
+                processed_rows += len(chunk)
+                slowest_chunk_seconds = max(slowest_chunk_seconds, time.perf_counter() - chunk_start_time)
+
+            # documents indexed before this file whose rows it no longer has are deleted once all its rows are written
+            if completed and upsert and index_config.get('deleteMissing'):
+                checkpoint.renew_lease(lease_seconds(context))
+                deleted = delete_missing_items(
+                    client, index_name, file_path, column_plan, key_field, dynamodb_resource.Table(get_parameter('PROCESSING_QUEUE_TABLE')), metrics
                 )
+                metrics.count('deletedRows', deleted)
+                if deleted:
+                    with metrics.stage('dynamodb'):
+                        bump_index_generation(index_config_table, index_name)
+        except Exception:
+            # keep the pending chunk so the next invocation for this file recovers it, with the index back to normal
+            leave_bulk_load(client, index_name, checkpoint)
+            checkpoint.release()
+            raise
 
-                if response.get('result') in ['created']:
-                    print(f"Successfully indexed document for row {index}")
-                    successful_posts += 1
-                # else:
-                #     print(f"Failed to index document for row {index}: {response.text}")
-                #     print(f"Document content: {document}")
-
-                # Store the result in DynamoDB
-                try:
-                    processing_queue_table = dynamodb_resource.Table(processing_queue_table_name)
-                    item = {}
-                    
-                    # Build DynamoDB item dynamically from row data
-                    for column in df.columns:
-                        raw_value = row.get(column, '')
-                        camel_field = to_camel_case(column)
-                        
-                        if column.lower() in ['producers', 'directors', 'writers', 'actors']:
-                            item[camel_field] = remove_duplicate_names(str(raw_value))
-                        elif is_numeric_value(raw_value):
-                            item[camel_field] = safe_int_conversion(raw_value)
-                        else:
-                            item[camel_field] = str(raw_value)
-                    
-                    # Add unique ID and timestamps
-                    item['indexName'] = index_name
-                    item['id'] = str(uuid.uuid4())
-                    item['createdAt'] = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
-                    item['updatedAt'] = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
-
-                    processing_queue_table.put_item(Item=item)
-                except Exception as db_error:
-                    print(f"Error storing result in DynamoDB: {str(db_error)}")
-                    return
-            except Exception as e:
-                print(f"Error processing row {index}: {e}")
-                print(row)
-
-        client.indices.refresh(index=index_name)
-        print(f"Successfully indexed {successful_posts} out of {len(df)} documents to OpenSearch")        
+        if completed:
+            checkpoint.renew_lease(lease_seconds(context))
+            with metrics.stage('refresh'):
+                if checkpoint.bulk_load_settings is not None:
+                    leave_bulk_load(client, index_name, checkpoint)
+                else:
+                    client.indices.refresh(index=index_name)
+            with metrics.stage('warmup'):
+                warm_up_index(client, index_name)
+        with metrics.stage('checkpoint'):
+            checkpoint.release(completed=completed)
+        if not completed:
+            print(f"Continuing ingestion of {file_key} from row {checkpoint.next_row} in a new invocation")
+            invoke_continuation(context, bucket, file_key)
+        elif get_search_backend(index_config) == 'local':
+            print(f"Exporting the snapshot of {index_name} for local search in a new invocation")
+            invoke_local_snapshot(context, index_name)
+
+        elapsed_seconds = time.perf_counter() - start_time
+        rows_per_second = processed_rows / elapsed_seconds if elapsed_seconds > 0 else 0
+        peak_rss_mb = get_peak_rss_mb()
+        counts = checkpoint.counts
+        print(f"Successfully indexed {counts['indexedRows']} out of {checkpoint.next_row} documents to OpenSearch, {counts['unchangedRows']} unchanged, {counts['failedRows']} failed")
+        print(f"Stored {counts['storedItems']} items in DynamoDB, {processing_queue.failed} failed in this invocation")
+        print(f"Embedding cache: {get_embedding_cache().stats()}")
+        print(f"Embedding requests: {embedding_limiter.stats()}")
+        print(f"Processed {processed_rows} rows in {elapsed_seconds:.1f}s ({rows_per_second:.1f} rows/sec), peak RSS {peak_rss_mb:.1f} MB")
+        row_errors.print_summary('row errors')
+        metrics.set_property('peakRssMb', round(peak_rss_mb, 1))
 
         # Clean up temporary files
         os.remove(file_path)
 
         response = {
-            "statusCode": 200,
+            "statusCode": 200 if completed else 202,
             "headers": {
                 "Content-Type": "application/json",
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Headers": "*"
             },
-            "body": json.dumps({"message": "Success!"})
+            "body": json.dumps({
+                "message": "Success!" if completed else "In progress",
+                "totalRows": checkpoint.next_row,
+                "indexedRows": counts['indexedRows'],
+                "failedRows": counts['failedRows'],
+                "unchangedRows": counts['unchangedRows'],
+                "deletedRows": deleted,
+                "processedRows": processed_rows,
+                "rowsPerSecond": round(rows_per_second, 1),
+                "peakRssMb": round(peak_rss_mb, 1),
+                "stagesMs": metrics.stage_totals()
+            })
         }
         
         return response
         
+    except LeaseUnavailableError as e:
+        print(str(e))
+        raise
     except Exception as e:
         error_message = f"Error: {str(e)}"
         print(error_message)
@@ -239,42 +584,5 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'error': str(e)
         }
-
-def remove_duplicate_names(csv_string):
-    """
-    Removes duplicate names from a comma-separated string while preserving order.
-    """
-    if not csv_string or not csv_string.strip():
-        return csv_string
-    
-    names = [name.strip() for name in csv_string.split(',') if name.strip()]
-    seen = set()
-    unique_names = []
-    
-    for name in names:
-        if name not in seen:
-            seen.add(name)
-            unique_names.append(name)
-    
-    return ', '.join(unique_names)
-
-def safe_int_conversion(value):
-    """
-    Attempts to convert a value to an integer.
-    Returns the integer if successful, None if the input is empty,
-    or None if conversion fails for other reasons.
-    """
-    if isinstance(value, str) and not value.strip():  # Check for empty or whitespace-only strings
-        return None
-    try:
-        return int(value)
-    except (ValueError, TypeError):  # Catches errors for non-numeric strings or incompatible types
-        return None
-
-def is_numeric_value(value):
-    """Check if a value can be converted to an integer"""
-    try:
-        int(value)
-        return True
-    except (ValueError, TypeError):
-        return False
\ No newline at end of file
+    finally:
+        metrics.emit()
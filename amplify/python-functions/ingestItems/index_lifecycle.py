@@ -0,0 +1,102 @@
+import os
+from shared.rescoring import RESCORE_VECTOR_MAPPING, rescore_vector_field
+from upsert import CONTENT_HASH_FIELD
+
+# Switch the index into a bulk-load state (no refresh, no replicas, asynchronous translog) while a file is
+# ingested, restoring its settings once the file is ingested or the ingestion fails
+INGEST_BULK_LOAD = os.environ.get('INGEST_BULK_LOAD', 'false').lower() == 'true'
+
+# After a file is ingested: 'warmup' loads the knn graphs of the index into memory, 'force-merge' merges the
+# index into one segment (one graph per field) first, 'none' leaves the first searches to load them
+INGEST_WARMUP = os.environ.get('INGEST_WARMUP', 'none')
+
+# Longest wait for a force merge; the merge goes on in the cluster when the request times out
+INGEST_FORCE_MERGE_TIMEOUT_SECONDS = int(os.environ.get('INGEST_FORCE_MERGE_TIMEOUT_SECONDS', 300))
+
+# Settings of the bulk-load state. Each one is applied on its own, so settings the platform manages
+# itself (OpenSearch Serverless rejects most of them) are skipped without affecting the others.
+BULK_LOAD_SETTINGS = {
+    'index.refresh_interval': '-1',
+    'index.number_of_replicas': '0',
+    'index.translog.durability': 'async'
+}
+
+def enter_bulk_load(client, index_name):
+    """
+    Apply the bulk-load settings to an index, returning the previous value of every setting that was changed
+    (None for settings that were not set), to be restored by exit_bulk_load.
+    """
+    try:
+        response = client.indices.get_settings(index=index_name, flat_settings=True)
+        current = response.get(index_name, {}).get('settings', {})
+    except Exception as e:
+        print(f"Error reading settings of {index_name}, not entering bulk-load state: {e}")
+        return {}
+
+    previous = {}
+    for name, value in BULK_LOAD_SETTINGS.items():
+        # an index already in the bulk-load state, e.g. loaded by another file, goes back to the default value
+        original = current.get(name)
+        if original == value:
+            original = None
+        try:
+            client.indices.put_settings(index=index_name, body={name: value})
+            previous[name] = original
+        except Exception as e:
+            print(f"Setting {name} of {index_name} not changed for bulk load: {e}")
+
+    print(f"Index {index_name} in bulk-load state, changed {list(previous)}")
+    return previous
+
+def exit_bulk_load(client, index_name, previous):
+    """Restore the settings changed by enter_bulk_load and make the loaded documents searchable"""
+    for name, value in (previous or {}).items():
+        try:
+            client.indices.put_settings(index=index_name, body={name: value})
+        except Exception as e:
+            print(f"Error restoring setting {name} of {index_name}: {e}")
+    if previous:
+        print(f"Index {index_name} settings restored after bulk load")
+    client.indices.refresh(index=index_name)
+
+def warm_up_index(client, index_name, mode=INGEST_WARMUP):
+    """Optionally force merge the index and load its knn graphs, so the first searches after a load are not slow"""
+    if mode not in ['warmup', 'force-merge']:
+        return
+
+    if mode == 'force-merge':
+        try:
+            client.indices.forcemerge(index=index_name, max_num_segments=1, request_timeout=INGEST_FORCE_MERGE_TIMEOUT_SECONDS)
+            print(f"Index {index_name} merged into one segment")
+        except Exception as e:
+            print(f"Force merge of {index_name} not completed: {e}")
+
+    try:
+        response = client.transport.perform_request('GET', f'/_plugins/_knn/warmup/{index_name}')
+        print(f"knn graphs of {index_name} loaded: {response}")
+    except Exception as e:
+        print(f"Error warming up {index_name}: {e}")
+
+def leave_bulk_load(client, index_name, checkpoint):
+    """Restore the settings of an index in the bulk-load state for this file, never raising"""
+    if checkpoint.bulk_load_settings is None:
+        return
+    try:
+        exit_bulk_load(client, index_name, checkpoint.bulk_load_settings)
+        checkpoint.clear_bulk_load_settings()
+    except Exception as e:
+        print(f"Error leaving bulk-load state of {index_name}: {e}")
+
+def ensure_item_id_mapping(client, index_name):
+    """Map itemId and contentHash as keywords, for indexes created before documents carried them"""
+    try:
+        client.indices.put_mapping(index=index_name, body={"properties": {"itemId": {"type": "keyword"}, CONTENT_HASH_FIELD: {"type": "keyword"}}})
+    except Exception as e:
+        print(f"Error adding itemId mapping: {e}")
+
+def ensure_rescore_vector_mapping(client, index_name, vector_fields):
+    """Map the rescore vector fields of vector fields (e.g. title) of an index storing compact vectors, for indexes created before they were kept"""
+    try:
+        client.indices.put_mapping(index=index_name, body={"properties": {rescore_vector_field(field): dict(RESCORE_VECTOR_MAPPING) for field in vector_fields}})
+    except Exception as e:
+        print(f"Error adding rescore vector mapping: {e}")
@@ -0,0 +1,137 @@
+import itertools
+import pandas as pd
+
+# file formats read_row_chunks streams
+SUPPORTED_EXTENSIONS = ['xlsx', 'xlsm', 'csv', 'parquet']
+
+def read_row_chunks(file_path, chunk_rows, start_row=0):
+    """
+    Reads a spreadsheet in fixed-size chunks of rows, so memory use depends on the chunk size and not on the file size.
+    Supports .xlsx/.xlsm (openpyxl read-only mode), .csv and .parquet (fastparquet, one row group at a time, so
+    memory also depends on the row group size of the file). Other formats, e.g. .xls or .ods workbooks, have no
+    streaming reader and are rejected with a ValueError rather than loaded whole; they can be saved as .xlsx or .csv.
+    Empty cells (and Parquet nulls) are read as '' (the equivalent of pandas na_filter=False).
+    Rows before start_row are skipped, so an interrupted ingestion can resume from its checkpoint.
+
+    Returns a tuple (columns, chunks) where chunks is a generator of DataFrames indexed by row number.
+    """
+    extension = file_path.rsplit('.', 1)[-1].lower()
+
+    if extension in ['xlsx', 'xlsm']:
+        return _read_xlsx_chunks(file_path, chunk_rows, start_row)
+    if extension == 'csv':
+        frames = pd.read_csv(file_path, na_filter=False, chunksize=chunk_rows)
+        return _read_frame_chunks(frames, start_row)
+    if extension == 'parquet':
+        return _read_parquet_chunks(file_path, chunk_rows, start_row)
+
+    raise ValueError(f"Unsupported file format .{extension}, expected .{', .'.join(SUPPORTED_EXTENSIONS)}")
+
+def _read_xlsx_chunks(file_path, chunk_rows, start_row):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        # like pd.read_excel, only the first sheet is read and its first row is the header
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+    except Exception:
+        workbook.close()
+        raise
+
+    columns = _column_names(header)
+    width = len(columns)
+
+    def chunks():
+        try:
+            chunk = []
+            skipped = 0
+            row_number = start_row
+            for values in rows:
+                # skip rows without any value, e.g. formatted but empty rows at the end of the sheet
+                if all(value is None or value == '' for value in values):
+                    continue
+                if skipped < start_row:
+                    skipped += 1
+                    continue
+                chunk.append(tuple('' if value is None else value for value in itertools.islice(itertools.chain(values, itertools.repeat(None)), width)))
+                if len(chunk) >= chunk_rows:
+                    yield pd.DataFrame(chunk, columns=columns, index=range(row_number, row_number + len(chunk)))
+                    row_number += len(chunk)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame(chunk, columns=columns, index=range(row_number, row_number + len(chunk)))
+        finally:
+            workbook.close()
+
+    return columns, chunks()
+
+def _read_parquet_chunks(file_path, chunk_rows, start_row):
+    from fastparquet import ParquetFile
+
+    parquet_file = ParquetFile(file_path)
+    # the index pandas stored with a DataFrame is not part of its columns
+    index_columns = (parquet_file.pandas_metadata or {}).get('index_columns', [])
+    source_columns = [column for column in parquet_file.columns if column not in index_columns]
+    columns = [str(column) for column in source_columns]
+
+    def chunks():
+        row_number = 0
+        for position, row_group in enumerate(parquet_file.row_groups):
+            # row groups before the checkpoint are skipped without reading them
+            if row_number + row_group.num_rows <= start_row:
+                row_number += row_group.num_rows
+                continue
+
+            frame = parquet_file[position].to_pandas(columns=source_columns, index=False)
+            frame.columns = columns
+            frame.index = range(row_number, row_number + len(frame))
+            row_number += len(frame)
+
+            # nulls are read as '' and keep the original values of the column (e.g. ints instead of NaN floats)
+            for column in columns:
+                nulls = frame[column].isna()
+                if nulls.any():
+                    frame[column] = frame[column].astype(object).where(~nulls, '')
+
+            for start in range(0, len(frame), chunk_rows):
+                chunk = frame.iloc[start:start + chunk_rows]
+                if chunk.index[0] < start_row:
+                    chunk = chunk[chunk.index >= start_row]
+                if len(chunk):
+                    yield chunk
+
+    return columns, chunks()
+
+def _read_frame_chunks(frames, start_row):
+    """Read the first DataFrame chunk to get the columns, and yield the non-empty chunks from start_row"""
+    frames = iter(frames)
+    first_frame = next(frames, None)
+    if first_frame is None:
+        return [], iter(())
+
+    columns = [str(column) for column in first_frame.columns]
+
+    def chunks():
+        for frame in itertools.chain([first_frame], frames):
+            if len(frame) and frame.index[0] < start_row:
+                frame = frame[frame.index >= start_row]
+            if len(frame):
+                frame.columns = columns
+                yield frame
+
+    return columns, chunks()
+
+def _column_names(header):
+    """Name header cells the way pandas does: 'Unnamed: N' for empty cells and '.N' suffixes for duplicates"""
+    columns = []
+    seen = {}
+    for position, value in enumerate(header):
+        name = f"Unnamed: {position}" if value is None or str(value).strip() == '' else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
@@ -0,0 +1,304 @@
+import os
+import boto3
+import json
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from shared.clients import get_opensearch_client, get_parameter
+from shared.index_scan import count_documents_without_item_id
+from shared.local_search import get_vector_widths
+from shared.metrics import SampledLogger
+from shared.processing_queue import ProcessingQueueWriter, store_items
+from shared.rescoring import rescore_vector_field
+from shared.result_cache import bump_index_generation
+from shared.search_queries import get_embedding_type, get_ingest_mode, get_search_backend
+from bulk_indexing import bulk_index_documents, find_indexed_item_ids
+from checkpoint import INGEST_CHUNK_ROWS, INGEST_DEADLINE_RESERVE_SECONDS, IngestCheckpoint, lease_seconds
+from index_lifecycle import INGEST_BULK_LOAD, enter_bulk_load, ensure_item_id_mapping, ensure_rescore_vector_mapping, leave_bulk_load, warm_up_index
+from snapshots import (
+    check_restore_target, export_part, load_part, part_documents, part_key, publish_manifest,
+    read_manifest, snapshot_prefix, write_part
+)
+from transform import to_camel_case
+from upsert import CONTENT_HASH_FIELD, restored_item_id
+
+dynamodb_resource = boto3.resource('dynamodb')
+
+def invoke_function(context, event):
+    """Handle event (e.g. to continue an export or restore) in a new asynchronous invocation of this function"""
+    boto3.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(event)
+    )
+
+def acquire_snapshot_job(job_key, index_name, context):
+    """
+    Take the lease on a snapshot export or restore job, returning its checkpoint. Raises LeaseUnavailableError
+    when another invocation owns it, so Lambda retries an asynchronous invocation once the lease expires.
+    """
+    checkpoint = IngestCheckpoint(
+        dynamodb_resource, get_parameter('INGEST_JOB_TABLE'), job_key, index_name,
+        owner=getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+    )
+    checkpoint.acquire(lease_seconds=lease_seconds(context))
+    return checkpoint
+
+def export_index_snapshot(request, context, metrics, index_config=None):
+    """
+    Export every document of an index with its vectors into a snapshot in the asset bucket, to be restored into
+    another index by restore_index_snapshot without embedding anything again, see snapshots.py.
+
+    The index is read in parts of about SNAPSHOT_PART_DOCUMENTS documents, each uploaded and committed with its
+    item id cursor before the next one, so an export continues in new invocations before running out of
+    time and resumes from its last committed part when invoked again with the same snapshotId. index_config is
+    the config of the exported index, kept with the snapshot.
+    """
+    index_name = request['indexName']
+    snapshot_id = request.get('snapshotId') or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    prefix = snapshot_prefix(index_name, snapshot_id)
+    metrics.set_property('snapshot', prefix)
+
+    with metrics.stage('checkpoint'):
+        checkpoint = acquire_snapshot_job(prefix, index_name, context)
+    if checkpoint.completed:
+        checkpoint.release()
+        return {"statusCode": 200, "body": json.dumps({"message": "Already exported", "snapshot": prefix, "documents": checkpoint.next_row})}
+
+    client = get_opensearch_client()
+    # documents are exported item id by item id
+    missing = count_documents_without_item_id(client, index_name)
+    if missing:
+        print(f"Cannot export {index_name}: {missing} documents have no itemId")
+        checkpoint.release()
+        return {'statusCode': 400, 'error': f"Index {index_name} has {missing} documents without an itemId, they cannot be exported"}
+
+    print(f"Resuming export of {prefix} from document {checkpoint.next_row}" if checkpoint.next_row else f"Starting export of {prefix}")
+    embedding_type = get_embedding_type(index_config)
+    s3_client = boto3.client('s3')
+    bucket = os.environ.get('ASSET_BUCKET_NAME')
+
+    directory = tempfile.mkdtemp()
+    completed = False
+    slowest_part_seconds = 0
+    try:
+        vector_widths = get_vector_widths(client, index_name)
+        while True:
+            if context and context.get_remaining_time_in_millis() / 1000 < INGEST_DEADLINE_RESERVE_SECONDS + 1.5 * slowest_part_seconds:
+                break
+
+            part_start_time = time.perf_counter()
+            start = checkpoint.next_row
+            with metrics.stage('checkpoint'):
+                checkpoint.renew_lease(lease_seconds(context, slowest_part_seconds or None))
+            with metrics.stage('export'):
+                columns, documents, cursor, finished = export_part(client, index_name, vector_widths, embedding_type, checkpoint.cursor)
+            if documents:
+                path = os.path.join(directory, 'part.npz')
+                with metrics.stage('upload'):
+                    write_part(path, columns)
+                    s3_client.upload_file(path, bucket, part_key(prefix, start))
+                metrics.count('uploadBytes', os.path.getsize(path))
+                with metrics.stage('checkpoint'):
+                    checkpoint.commit_chunk(start + documents, documents, 0, 0, cursor=cursor)
+                metrics.count('snapshotDocuments', documents)
+                print(f"Exported documents {start} to {start + documents - 1} of {index_name}")
+            slowest_part_seconds = max(slowest_part_seconds, time.perf_counter() - part_start_time)
+
+            if finished:
+                with metrics.stage('upload'):
+                    manifest = publish_manifest(
+                        s3_client, bucket, prefix, index_name, snapshot_id, checkpoint.next_row, vector_widths, embedding_type, index_config, directory
+                    )
+                completed = True
+                break
+    except Exception:
+        checkpoint.release()
+        raise
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    with metrics.stage('checkpoint'):
+        checkpoint.release(completed=completed)
+    if completed:
+        print(f"Exported {manifest['documents']} documents of {index_name} in {len(manifest['parts'])} parts to {prefix}")
+    else:
+        print(f"Continuing export of {prefix} from document {checkpoint.next_row} in a new invocation")
+        invoke_function(context, {'snapshotExport': {'indexName': index_name, 'snapshotId': snapshot_id}})
+
+    return {
+        "statusCode": 200 if completed else 202,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({
+            "message": "Success!" if completed else "In progress",
+            "snapshot": prefix,
+            "documents": checkpoint.next_row,
+            "stagesMs": metrics.stage_totals()
+        })
+    }
+
+def restore_index_snapshot(request, context, metrics, index_config=None):
+    """
+    Bulk-load the documents of a snapshot exported by export_index_snapshot, vectors included, into another
+    index, created beforehand by createIndex with the same fields (its HNSW profile and shards may differ). Each
+    document gets a ProcessingQueue item like an ingested row. Documents keep their item id, except in an index
+    in upsert mode, where they get the item id and content hash of the row they were ingested from (see
+    upsert.restored_item_id) so that uploading the same file again only writes the rows that changed.
+
+    Documents are restored in chunks of INGEST_CHUNK_ROWS committed to the checkpoint of the restore, like the
+    rows of an ingested file: a restore continues in new invocations, resumes when invoked again and recovers
+    a chunk interrupted mid-write without indexing its documents twice. index_config is the config of the index
+    restored into, None when it was not created.
+    """
+    prefix = request['snapshot'].rstrip('/')
+    index_name = request['indexName']
+    job_key = f"{prefix}/restore/{index_name}"
+    metrics.set_property('snapshot', prefix)
+    s3_client = boto3.client('s3')
+    bucket = os.environ.get('ASSET_BUCKET_NAME')
+
+    with metrics.stage('checkpoint'):
+        checkpoint = acquire_snapshot_job(job_key, index_name, context)
+    if checkpoint.completed:
+        checkpoint.release()
+        return {"statusCode": 200, "body": json.dumps({"message": "Already restored", **checkpoint.counts})}
+
+    directory = tempfile.mkdtemp()
+    client = get_opensearch_client()
+    completed = True
+    try:
+        with metrics.stage('download'):
+            manifest = read_manifest(s3_client, bucket, prefix, directory)
+        if not index_config:
+            raise ValueError(f"Index {index_name} has no index config, create it with createIndex first")
+        check_restore_target(manifest, index_name, get_embedding_type(index_config), get_vector_widths(client, index_name))
+    except ValueError as e:
+        print(f"Cannot restore {prefix} into {index_name}: {e}")
+        checkpoint.release()
+        shutil.rmtree(directory, ignore_errors=True)
+        return {'statusCode': 400, 'error': str(e)}
+
+    print(f"Resuming restore of {prefix} into {index_name} from document {checkpoint.next_row}" if checkpoint.next_row else f"Starting restore of {prefix} into {index_name}")
+    ensure_item_id_mapping(client, index_name)
+    if get_embedding_type(index_config) != 'float':
+        ensure_rescore_vector_mapping(client, index_name, manifest['vectorFields'])
+    # documents restored by earlier invocations are searched for by the recovery of an interrupted chunk
+    if checkpoint.next_row or checkpoint.pending_chunk:
+        with metrics.stage('refresh'):
+            client.indices.refresh(index=index_name)
+    if INGEST_BULK_LOAD and checkpoint.bulk_load_settings is None:
+        checkpoint.save_bulk_load_settings(enter_bulk_load(client, index_name))
+
+    embedding_fields = set(manifest['vectorFields'])
+    embedding_fields |= {rescore_vector_field(field) for field in embedding_fields}
+    upsert = get_ingest_mode(index_config) == 'upsert'
+    key_field = to_camel_case(index_config['upsertKey']) if upsert and index_config.get('upsertKey') else None
+    processing_queue = ProcessingQueueWriter(dynamodb_resource, get_parameter('PROCESSING_QUEUE_TABLE'))
+    index_config_table = dynamodb_resource.Table(get_parameter('INDEX_CONFIG_TABLE'))
+    row_errors = SampledLogger()
+    slowest_chunk_seconds = 0
+    try:
+        for part in manifest['parts']:
+            part_end = part['start'] + part['documents']
+            if part_end <= checkpoint.next_row:
+                continue
+            path = os.path.join(directory, 'part.npz')
+            with metrics.stage('download'):
+                s3_client.download_file(bucket, part['key'], path)
+                columns = load_part(path)
+            metrics.count('downloadBytes', os.path.getsize(path))
+
+            for start in range(max(checkpoint.next_row, part['start']), part_end, INGEST_CHUNK_ROWS):
+                if context and context.get_remaining_time_in_millis() / 1000 < INGEST_DEADLINE_RESERVE_SECONDS + 1.5 * slowest_chunk_seconds:
+                    completed = False
+                    break
+
+                chunk_start_time = time.perf_counter()
+                end = min(start + INGEST_CHUNK_ROWS, part_end)
+                pending_chunk = checkpoint.pending_chunk
+                interrupted = pending_chunk is not None and pending_chunk['start'] <= start < pending_chunk['end']
+
+                with metrics.stage('checkpoint'):
+                    checkpoint.begin_chunk(start, end, lease_seconds(context, slowest_chunk_seconds or None))
+                key_errors = 0
+                with metrics.stage('transform'):
+                    documents = part_documents(columns, start - part['start'], end - part['start'])
+                    if upsert:
+                        for document in documents:
+                            document['itemId'] = restored_item_id(index_name, document, embedding_fields, key_field)
+                            if document['itemId'] is None:
+                                row_errors.log(f"Error restoring document: empty key {key_field} {document.get(CONTENT_HASH_FIELD)}")
+                                key_errors += 1
+                        documents = [document for document in documents if document['itemId'] is not None]
+
+                already_indexed = set()
+                if interrupted:
+                    with metrics.stage('recover'):
+                        already_indexed = find_indexed_item_ids(client, index_name, [document['itemId'] for document in documents])
+                    print(f"Recovering interrupted documents {start} to {end - 1}, {len(already_indexed)} already indexed")
+
+                pending_documents = [document for document in documents if document['itemId'] not in already_indexed]
+                with metrics.stage('index'):
+                    indexed, index_errors = bulk_index_documents(client, index_name, pending_documents)
+                for position, error in index_errors.items():
+                    row_errors.log(f"Failed to index restored document {pending_documents[position]['itemId']}: {error}")
+
+                indexed_documents = [document for document in documents if document['itemId'] in already_indexed]
+                indexed_documents += [document for position, document in enumerate(pending_documents) if position not in index_errors]
+                with metrics.stage('dynamodb'):
+                    stored = store_items(processing_queue, index_name, indexed_documents, {*embedding_fields, CONTENT_HASH_FIELD})
+                with metrics.stage('checkpoint'):
+                    checkpoint.commit_chunk(end, indexed + len(already_indexed), len(index_errors) + key_errors, stored)
+                if indexed:
+                    with metrics.stage('dynamodb'):
+                        bump_index_generation(index_config_table, index_name)
+
+                print(f"Restored {indexed + len(already_indexed)} of {end - start} documents {start} to {end - 1}, {len(index_errors) + key_errors} failed")
+                metrics.count('indexedRows', indexed + len(already_indexed))
+                metrics.count('failedRows', len(index_errors) + key_errors)
+                metrics.count('storedItems', stored)
+                slowest_chunk_seconds = max(slowest_chunk_seconds, time.perf_counter() - chunk_start_time)
+            if not completed:
+                break
+    except Exception:
+        leave_bulk_load(client, index_name, checkpoint)
+        checkpoint.release()
+        raise
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if completed:
+        checkpoint.renew_lease(lease_seconds(context))
+        with metrics.stage('refresh'):
+            if checkpoint.bulk_load_settings is not None:
+                leave_bulk_load(client, index_name, checkpoint)
+            else:
+                client.indices.refresh(index=index_name)
+        with metrics.stage('warmup'):
+            warm_up_index(client, index_name)
+    with metrics.stage('checkpoint'):
+        checkpoint.release(completed=completed)
+    if not completed:
+        print(f"Continuing restore of {prefix} into {index_name} from document {checkpoint.next_row} in a new invocation")
+        invoke_function(context, {'snapshotRestore': {'snapshot': prefix, 'indexName': index_name}})
+    elif get_search_backend(index_config) == 'local':
+        print(f"Exporting the snapshot of {index_name} for local search in a new invocation")
+        invoke_function(context, {'localSnapshot': {'indexName': index_name}})
+    row_errors.print_summary('restore errors')
+
+    counts = checkpoint.counts
+    return {
+        "statusCode": 200 if completed else 202,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({
+            "message": "Success!" if completed else "In progress",
+            "snapshot": prefix,
+            "totalRows": checkpoint.next_row,
+            "indexedRows": counts['indexedRows'],
+            "failedRows": counts['failedRows'],
+            "storedItems": counts['storedItems'],
+            "stagesMs": metrics.stage_totals()
+        })
+    }
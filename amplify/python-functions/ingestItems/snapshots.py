@@ -0,0 +1,173 @@
+import json
+import os
+import time
+import numpy as np
+from shared.index_scan import iter_item_documents
+from shared.local_search import SNAPSHOT_VECTOR_DTYPES
+
+# Snapshots exported to be restored into other indexes are stored in the asset bucket under <prefix>/<index name>/<snapshot id>/,
+# outside of the assets/ prefix whose uploads are ingested
+SNAPSHOT_PREFIX = os.environ.get('SNAPSHOT_PREFIX', 'snapshots')
+
+# Documents per part file of a snapshot: a part is exported, uploaded and committed at once
+SNAPSHOT_PART_DOCUMENTS = int(os.environ.get('SNAPSHOT_PART_DOCUMENTS', 5000))
+
+# Documents read per search when exporting a part
+SNAPSHOT_PAGE_SIZE = int(os.environ.get('SNAPSHOT_PAGE_SIZE', 200))
+
+SNAPSHOT_MANIFEST_FILE = 'manifest.json'
+
+# Index config attributes kept with a snapshot, to check the index it is restored into
+SNAPSHOT_CONFIG_ATTRIBUTES = ['fileName', 'vectorFieldList', 'exactFieldList', 'identifierFieldList', 'indexProfile', 'embeddingType', 'searchConfig']
+
+def snapshot_prefix(index_name, snapshot_id):
+    """Key prefix of a snapshot in the asset bucket"""
+    return f"{SNAPSHOT_PREFIX}/{index_name}/{snapshot_id}"
+
+def part_key(prefix, start):
+    """Key of the part of a snapshot starting at document start, the same however often the part is exported"""
+    return f"{prefix}/part-{start:09d}.npz"
+
+def export_part(client, index_name, vector_widths, embedding_type='float', search_after=None, documents=SNAPSHOT_PART_DOCUMENTS, page_size=SNAPSHOT_PAGE_SIZE):
+    """
+    Read the documents of the next item ids of an index after the search_after cursor, in itemId order, into the
+    columns of a part: a matrix of vectors per vector field (float16, or int8 for int8 and binary vectors) with
+    the positions of the documents having a vector, and the documents without their vectors as JSON lines with
+    their offsets. A part ends after the item id that brings it to documents documents, so the documents of an
+    item id are never split between parts (see shared.index_scan).
+
+    Returns a tuple (columns, number of documents, cursor after the last item id, whether the index was read to its end).
+    """
+    dtype = SNAPSHOT_VECTOR_DTYPES[embedding_type]
+    matrices = {field: np.empty((documents, width), dtype=dtype) for field, width in vector_widths.items()}
+    vector_rows = {field: [] for field in vector_widths}
+    lines = []
+    offsets = [0]
+
+    finished = True
+    for item_id, hits in iter_item_documents(client, index_name, True, search_after, page_size):
+        for hit in hits:
+            source = hit['_source']
+            for field in vector_widths:
+                vector = source.pop(field, None)
+                if isinstance(vector, list):
+                    if len(vector_rows[field]) == len(matrices[field]):
+                        # the last item id of the part has more documents than the part has room for
+                        matrices[field] = np.concatenate([matrices[field], np.empty_like(matrices[field])])
+                    matrices[field][len(vector_rows[field])] = vector
+                    vector_rows[field].append(len(lines))
+            line = json.dumps(source, default=str).encode('utf-8') + b'\n'
+            lines.append(line)
+            offsets.append(offsets[-1] + len(line))
+        search_after = [item_id]
+        if len(lines) >= documents:
+            finished = False
+            break
+
+    columns = {
+        'sources': np.frombuffer(b''.join(lines), dtype=np.uint8),
+        'offsets': np.asarray(offsets, dtype=np.int64)
+    }
+    for field, matrix in matrices.items():
+        columns[f"vectors.{field}"] = matrix[:len(vector_rows[field])]
+        columns[f"rows.{field}"] = np.asarray(vector_rows[field], dtype=np.int32)
+    return columns, len(lines), search_after, finished
+
+def write_part(path, columns):
+    """Write the columns of a part to a compressed .npz file"""
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **columns)
+
+def load_part(path):
+    """Columns of a part file, read once for all its documents"""
+    with np.load(path) as part:
+        return {name: part[name] for name in part.files}
+
+def part_documents(columns, start=0, end=None):
+    """
+    Documents [start, end) of a part loaded by load_part, with their vectors as lists of the type they are indexed
+    with (float vectors come back from float16, within 1e-3 of the exported values).
+    """
+    offsets = columns['offsets']
+    sources = columns['sources']
+    end = len(offsets) - 1 if end is None else end
+    documents = [json.loads(sources[offsets[position]:offsets[position + 1]].tobytes()) for position in range(start, end)]
+
+    for name, matrix in columns.items():
+        if not name.startswith('vectors.'):
+            continue
+        field = name[len('vectors.'):]
+        rows = columns[f"rows.{field}"]
+        selected = np.flatnonzero((rows >= start) & (rows < end))
+        vectors = matrix[selected]
+        if vectors.dtype == np.float16:
+            vectors = vectors.astype(np.float32)
+        for position, vector in zip(rows[selected].tolist(), vectors.tolist()):
+            documents[position - start][field] = vector
+    return documents
+
+def list_parts(s3_client, bucket, prefix):
+    """(key, start) of the part files of a snapshot, in document order"""
+    parts = []
+    request = {'Bucket': bucket, 'Prefix': f"{prefix}/part-"}
+    while True:
+        response = s3_client.list_objects_v2(**request)
+        for entry in response.get('Contents', []):
+            key = entry['Key']
+            parts.append((key, int(key.rsplit('-', 1)[-1].split('.')[0])))
+        if not response.get('IsTruncated'):
+            break
+        request['ContinuationToken'] = response['NextContinuationToken']
+    return sorted(parts, key=lambda part: part[1])
+
+def publish_manifest(s3_client, bucket, prefix, index_name, snapshot_id, documents, vector_widths, embedding_type, index_config, directory):
+    """
+    Upload the manifest of an exported snapshot, listing its parts: a snapshot can only be restored once its
+    manifest exists. Returns the manifest.
+    """
+    starts = list_parts(s3_client, bucket, prefix)
+    parts = []
+    for position, (key, start) in enumerate(starts):
+        end = starts[position + 1][1] if position + 1 < len(starts) else documents
+        if start < documents:
+            parts.append({'key': key, 'start': start, 'documents': min(end, documents) - start})
+
+    manifest = {
+        'indexName': index_name,
+        'snapshotId': snapshot_id,
+        'documents': documents,
+        'embeddingType': embedding_type,
+        'vectorFields': vector_widths,
+        'indexConfig': {name: (index_config or {}).get(name) for name in SNAPSHOT_CONFIG_ATTRIBUTES if (index_config or {}).get(name) is not None},
+        'parts': parts,
+        'createdAt': int(time.time())
+    }
+    path = os.path.join(directory, SNAPSHOT_MANIFEST_FILE)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, default=str)
+    s3_client.upload_file(path, bucket, f"{prefix}/{SNAPSHOT_MANIFEST_FILE}")
+    return manifest
+
+def read_manifest(s3_client, bucket, prefix, directory):
+    """Download the manifest of a snapshot, raising ValueError when the snapshot has none (yet)"""
+    path = os.path.join(directory, SNAPSHOT_MANIFEST_FILE)
+    try:
+        s3_client.download_file(bucket, f"{prefix}/{SNAPSHOT_MANIFEST_FILE}", path)
+    except Exception as e:
+        raise ValueError(f"No complete snapshot at {prefix}: {e}")
+    with open(path) as f:
+        return json.load(f)
+
+def check_restore_target(manifest, index_name, embedding_type, vector_widths):
+    """
+    Raise ValueError unless an index can take the documents of a snapshot: it must store vectors of the same
+    embedding type with the same widths in every vector field of the snapshot. Its HNSW profile, space type and
+    shards may differ, which is what restoring into another index is for.
+    """
+    if embedding_type != manifest['embeddingType']:
+        raise ValueError(f"Index {index_name} stores {embedding_type} vectors, the snapshot has {manifest['embeddingType']} vectors")
+    for field, width in manifest['vectorFields'].items():
+        if field not in vector_widths:
+            raise ValueError(f"Index {index_name} has no vector field {field}")
+        if vector_widths[field] != width:
+            raise ValueError(f"Vector field {field} of index {index_name} has {vector_widths[field]} values, the snapshot has {width}")
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+# Columns holding comma-separated lists of names, which are deduplicated before indexing and embedding
+PEOPLE_COLUMNS = ['producers', 'directors', 'writers', 'actors']
+
+# Strings accepted by int(), e.g. ' 42', '-7' or '1_000'
+INTEGER_PATTERN = r'\s*[+-]?\d+(?:_\d+)*\s*'
+
+NUMBER_TYPES = (int, float, bool, np.integer, np.floating, np.bool_)
+
+def to_camel_case(snake_str):
+    """Convert snake_case to camelCase"""
+    components = snake_str.replace('_', ' ').split(' ')
+    components = [comp for comp in components if comp]
+    if not components:
+        return snake_str.lower()
+    return components[0].lower() + ''.join(word.capitalize() for word in components[1:])
+
+def plan_columns(columns):
+    """Resolve the field name and conversion of each column once per file, as (column, camel_field, is_people_column)"""
+    return [(column, to_camel_case(column), column.lower() in PEOPLE_COLUMNS) for column in columns]
+
+def build_documents(frame, column_plan):
+    """
+    Build the OpenSearch documents (without embeddings) for a chunk of rows, one column at a time.
+    People columns are deduplicated, values that int() accepts become integers and everything else becomes a string.
+
+    Returns one document per row of the frame, in order.
+    """
+    fields = []
+    columns = []
+    for column, camel_field, is_people_column in column_plan:
+        series = frame[column]
+        fields.append(camel_field)
+        columns.append(dedupe_people_column(series) if is_people_column else coerce_column(series))
+
+    # later columns win when two columns map to the same field name
+    return [dict(zip(fields, values)) for values in zip(*columns)]
+
+def dedupe_people_column(series):
+    """Remove duplicate names from every value of a column, deduplicating each distinct value only once"""
+    codes, uniques = pd.factorize(to_text(series), use_na_sentinel=False)
+    deduped = np.array([remove_duplicate_names(value) for value in uniques], dtype=object)
+    return deduped[codes].tolist()
+
+def to_text(series):
+    """str() of every value of a column, as an object array (missing values become 'nan' like str() does)"""
+    return series.to_numpy(dtype=object).astype(str).astype(object)
+
+def coerce_column(series):
+    """Convert a column to integers where int() accepts the value, and to strings everywhere else"""
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return series.astype('int64').tolist()
+
+    values = series.to_numpy(dtype=object)
+    result = to_text(series)
+
+    if pd.api.types.is_float_dtype(series):
+        numbers = series.to_numpy(dtype='float64')
+        convertible = np.isfinite(numbers) & (np.abs(numbers) < 2 ** 63)
+        result[convertible] = np.trunc(numbers[convertible]).astype('int64')
+        return result.tolist()
+
+    # mixed columns: classify values by type once, then convert each group in bulk
+    kinds = series.map(type)
+    number_kinds = [kind for kind in kinds.unique() if issubclass(kind, NUMBER_TYPES)]
+    is_string = (kinds == str).to_numpy()
+    is_number = kinds.isin(number_kinds).to_numpy()
+
+    # strings that int() accepts
+    integer_strings = is_string & pd.Series(result, dtype=object).str.fullmatch(INTEGER_PATTERN).fillna(False).to_numpy(dtype=bool)
+    if integer_strings.any():
+        result[integer_strings] = [int(value) for value in values[integer_strings]]
+
+    # numbers are truncated, except for NaN and infinity which int() rejects
+    if is_number.any():
+        number_positions = np.flatnonzero(is_number)
+        number_positions = number_positions[np.isfinite(values[number_positions].astype('float64'))]
+        result[number_positions] = [int(value) for value in values[number_positions]]
+
+    return result.tolist()
+
+def remove_duplicate_names(csv_string):
+    """
+    Removes duplicate names from a comma-separated string while preserving order.
+    """
+    if not csv_string or not csv_string.strip():
+        return csv_string
+
+    names = [name.strip() for name in csv_string.split(',') if name.strip()]
+    seen = set()
+    unique_names = []
+
+    for name in names:
+        if name not in seen:
+            seen.add(name)
+            unique_names.append(name)
+
+    return ', '.join(unique_names)
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import uuid
+from checkpoint import ITEM_ID_NAMESPACE
+from shared.index_scan import iter_item_documents
+from shared.rescoring import rescore_vector_field
+from shared.search_queries import EMBEDDING_SOURCE_EXCLUDES
+
+# Keyword field holding the hash of the row a document was written from, to skip rows uploaded again unchanged
+CONTENT_HASH_FIELD = 'contentHash'
+
+# Documents read per search when listing the item ids of an index
+ITEM_ID_PAGE_SIZE = 1000
+
+# Values of an empty key cell: the readers read empty cells as '', and missing values converted by str() become 'nan'
+EMPTY_VALUES = {'', 'nan', 'None'}
+
+def content_hash(document):
+    """Hash of the fields of a row document (without embeddings), the same for the same values whatever their order"""
+    return hashlib.sha256(json.dumps(document, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def upsert_item_id(index_name, document, key_field=None):
+    """
+    Deterministic item id of a row in an index in upsert mode: from the value of its key field when the index
+    has one, so a corrected row replaces its previous version, otherwise from its content hash. Rows with an
+    empty key have no item id (None).
+    """
+    if key_field:
+        value = document.get(key_field)
+        if value is None or str(value).strip() in EMPTY_VALUES:
+            return None
+        return str(uuid.uuid5(ITEM_ID_NAMESPACE, f"{index_name}:key:{value}"))
+    return str(uuid.uuid5(ITEM_ID_NAMESPACE, f"{index_name}:hash:{document[CONTENT_HASH_FIELD]}"))
+
+def restored_item_id(index_name, document, embedding_fields, key_field=None):
+    """
+    Item id of a document restored from a snapshot into an index in upsert mode: the one upsert_chunk gives the
+    row it was ingested from, so uploading that row again finds it unchanged. The document keeps the content
+    hash it was exported with, or gets the hash of its fields when its index was not in upsert mode.
+    """
+    if not document.get(CONTENT_HASH_FIELD):
+        row = {field: value for field, value in document.items() if field not in embedding_fields and field not in ['itemId', CONTENT_HASH_FIELD]}
+        document[CONTENT_HASH_FIELD] = content_hash(row)
+    return upsert_item_id(index_name, document, key_field)
+
+def find_indexed_documents(client, index_name, item_ids):
+    """
+    The documents of the index having these item ids, without their embeddings.
+    Returns {item id: [(document id, source), ...]}, usually one document per item id.
+    """
+    if not item_ids:
+        return {}
+    response = client.search(
+        index=index_name,
+        body={
+            # an item id may have been indexed more than once, e.g. in append mode before the index used upserts
+            "size": min(2 * len(item_ids), 10000),
+            "_source": {"excludes": list(EMBEDDING_SOURCE_EXCLUDES)},
+            "query": {"terms": {"itemId": item_ids}}
+        }
+    )
+    documents = {}
+    for hit in response['hits']['hits']:
+        documents.setdefault(hit['_source'].get('itemId'), []).append((hit['_id'], hit['_source']))
+    return documents
+
+def plan_upsert(document, indexed, vector_fields):
+    """
+    Compare a row document with the documents indexed for its item id (from find_indexed_documents).
+
+    Returns a tuple (document id to update or None to index a new document, vector fields to embed, document ids
+    to delete), or None when the row is unchanged. Fields of the indexed document the row no longer has are set
+    to null in the document, so the update removes them.
+    """
+    if not indexed:
+        return None, list(vector_fields), []
+
+    document_id, source = indexed[0]
+    duplicates = [duplicate_id for duplicate_id, _ in indexed[1:]]
+    if not duplicates and source.get(CONTENT_HASH_FIELD) == document[CONTENT_HASH_FIELD]:
+        return None
+
+    changed_fields = [field for field in vector_fields if document.get(field) != source.get(field)]
+    for field in source:
+        if field not in document:
+            document[field] = None
+    for field in changed_fields:
+        # a vector field emptied by the new row (an empty cell is read as '') loses its embedding (and rescore
+        # vector), as embed_documents does not embed blank values and the partial update would keep the previous one
+        value = document.get(field)
+        if value is None or not str(value).strip():
+            document[f"{field}Embedding"] = None
+            document[rescore_vector_field(field)] = None
+    return document_id, changed_fields, duplicates
+
+def iter_indexed_item_ids(client, index_name, page_size=ITEM_ID_PAGE_SIZE):
+    """
+    (document id, item id) of every document of an index with an itemId, in item id order, including every
+    document of an item id indexed more than once (see shared.index_scan)
+    """
+    for item_id, hits in iter_item_documents(client, index_name, ['itemId'], page_size=page_size):
+        for hit in hits:
+            yield hit['_id'], item_id
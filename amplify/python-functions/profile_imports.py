@@ -0,0 +1,116 @@
+"""
+Import-time profile of the Python functions, to keep an eye on their cold starts.
+
+Every function's index module is imported in a fresh interpreter with `python -X importtime`, the way Lambda
+imports the handler during a cold start (with the shared package next to it, like LambdaPythonBundler lays it out).
+Handlers must not call AWS at import time, so no credentials or network are needed.
+
+Usage:
+    python profile_imports.py                        # report of every function
+    python profile_imports.py findRelatedItems -n 10 # one function, top 10 modules
+    python profile_imports.py --output profile.json  # also save the totals
+    python profile_imports.py --baseline profile.json --max-regression-ms 100  # fail on regressions
+
+Install each function's requirements.txt first, or the report fails on the missing modules.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def list_functions():
+    return sorted(
+        name for name in os.listdir(FUNCTIONS_DIR)
+        if name != 'shared' and os.path.isfile(os.path.join(FUNCTIONS_DIR, name, 'index.py'))
+    )
+
+def profile_import(function_name):
+    """
+    Import the function's index module once in a new interpreter.
+    Returns (total import time in ms, {module: (self ms, cumulative ms)}).
+    """
+    function_dir = os.path.join(FUNCTIONS_DIR, function_name)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([function_dir, FUNCTIONS_DIR])
+    env.setdefault('AWS_REGION', 'us-east-1')
+    env.setdefault('AWS_DEFAULT_REGION', env['AWS_REGION'])
+    env.setdefault('AWS_BRANCH', 'profile')
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import index'],
+        cwd=function_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {function_name}/index.py failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    modules = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip())
+        name = name.strip()
+        modules[name] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+        # top-level imports are printed with a single space of indentation
+        if depth == 1:
+            total_us += int(cumulative_us)
+    return total_us / 1000, modules
+
+def profile_function(function_name, repeat):
+    """Median total import time over repeat runs, with the module breakdown of the median run"""
+    runs = sorted((profile_import(function_name) for _ in range(repeat)), key=lambda run: run[0])
+    return runs[len(runs) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('functions', nargs='*', help='functions to profile (default: all)')
+    parser.add_argument('-n', '--top', type=int, default=15, help='number of slowest modules listed per function')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='imports per function, the median is reported')
+    parser.add_argument('--output', help='write the total import time of each function to this JSON file')
+    parser.add_argument('--baseline', help='JSON file written by --output to compare against')
+    parser.add_argument('--max-regression-ms', type=float, default=100, help='allowed increase over the baseline')
+    args = parser.parse_args()
+
+    functions = args.functions or list_functions()
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    totals = {}
+    regressions = []
+    for function_name in functions:
+        total_ms, modules = profile_function(function_name, args.repeat)
+        totals[function_name] = round(total_ms, 1)
+
+        print(f"\n{function_name}: {total_ms:.1f} ms")
+        if function_name in baseline:
+            difference = total_ms - baseline[function_name]
+            print(f"  baseline {baseline[function_name]:.1f} ms ({difference:+.1f} ms)")
+            if difference > args.max_regression_ms:
+                regressions.append(function_name)
+
+        # packages are ranked by cumulative time, which includes their submodules
+        top_level = {name: times for name, times in modules.items() if '.' not in name}
+        print(f"  {'cumulative ms':>13}  {'self ms':>8}  module")
+        for name, (self_ms, cumulative_ms) in sorted(top_level.items(), key=lambda item: -item[1][1])[:args.top]:
+            print(f"  {cumulative_ms:13.1f}  {self_ms:8.1f}  {name}")
+
+    if len(functions) > 1:
+        print(f"\nmedian of {args.repeat} runs, python {sys.version.split()[0]}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(totals, output_file, indent=2)
+
+    if regressions:
+        print(f"\nImport time regressed by more than {args.max_regression_ms:.0f} ms: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -38,7 +38,9 @@ class LambdaPythonBundler implements ILocalBundling {
       // see: https://docs.aws.amazon.com/lambda/latest/dg/python-layers.html and https://repost.aws/knowledge-center/lambda-python-package-compatible
       !this.isCompiledPackage ? `pip3 install -r requirements.txt -t ${outputDir}` 
       : `pip3 install -r requirements.txt --platform manylinux2014_x86_64 --only-binary=:all: -t ${outputDir}`,
-      `cp -a . ${outputDir}`
+      `cp -a . ${outputDir}`,
+      // modules shared by all functions are imported as the "shared" package
+      `cp -a ../shared ${outputDir}/shared`
     ];
 
     execSync(commands.join(' && '));
@@ -75,7 +77,8 @@ export class CustomLambdaStack extends Stack {
       functionName: CommonUtils.getUniqueResourceNameForEnv('find-related-items'),
       description: 'Receives item metadata for a single item, and returns related items by searching Amazon OpenSearch',
       timeout: Duration.seconds(900),
-      memorySize: 256,
+      // indexes using the local search backend are held in memory, see shared/local_search.py
+      memorySize: 1024,
       environment: {
         "ASSET_BUCKET_NAME": assetBucketName || '',
         "AWS_BRANCH": process.env.AWS_BRANCH || '',
@@ -88,6 +91,25 @@ export class CustomLambdaStack extends Stack {
       }),
     });
 
+    new lambda.Function(this, 'groupItemsFunction', {
+      runtime: lambda.Runtime.PYTHON_3_9,
+      handler: 'index.lambda_handler',
+      functionName: CommonUtils.getUniqueResourceNameForEnv('group-items'),
+      description: 'Groups the related items of a whole index, continuing in new invocations until every item has a group id',
+      timeout: Duration.seconds(900),
+      memorySize: 1024,
+      environment: {
+        "ASSET_BUCKET_NAME": assetBucketName || '',
+        "AWS_BRANCH": process.env.AWS_BRANCH || '',
+      },
+      code: lambda.Code.fromAsset(functionDir, {
+        bundling: {
+          image: lambda.Runtime.PYTHON_3_9.bundlingImage,
+          local: new LambdaPythonBundler(`${functionDir}/groupItems`, false)
+        },
+      }),
+    });
+
     new lambda.Function(this, 'createIndexFunction', {
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: 'index.lambda_handler',
@@ -0,0 +1 @@
+"""Modules shared by all python functions, copied into each function bundle by LambdaPythonBundler"""
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+import boto3
+from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from .embedding_cache import create_embedding_cache
+
+# SSM parameters are read again once they are older than this
+PARAMETERS_TTL_SECONDS = int(os.environ.get('PARAMETERS_TTL_SECONDS', 300))
+
+# State kept for the lifetime of the execution environment, reused by warm invocations
+_cold_start = True
+_parameters = None
+_parameters_loaded_at = 0
+_opensearch_clients = {}
+_embedding_cache = None
+_lock = threading.Lock()
+
+def record_invocation():
+    """
+    Log whether this invocation is the first one of the execution environment (cold) or reuses it (warm).
+    Call once at the start of the handler; returns True for a cold invocation.
+    """
+    global _cold_start
+    cold = _cold_start
+    _cold_start = False
+    print(f"{'Cold' if cold else 'Warm'} invocation")
+    return cold
+
+def get_parameters(max_age_seconds=PARAMETERS_TTL_SECONDS):
+    """Get the parameters of this branch from AWS Parameter Store, cached for max_age_seconds"""
+    global _parameters, _parameters_loaded_at
+    with _lock:
+        if _parameters is None or time.time() - _parameters_loaded_at > max_age_seconds:
+            ssm = boto3.client('ssm')
+            parameters = {}
+            request = {'Path': '/' + os.environ.get('AWS_BRANCH') + '/', 'WithDecryption': True}
+            while True:
+                response = ssm.get_parameters_by_path(**request)
+                for param in response['Parameters']:
+                    # Extract parameter name after the path prefix
+                    name = param['Name'].split('/')[-1]
+                    parameters[name] = param['Value']
+                if not response.get('NextToken'):
+                    break
+                request['NextToken'] = response['NextToken']
+            _parameters = parameters
+            _parameters_loaded_at = time.time()
+        return _parameters
+
+def get_parameter(name):
+    return get_parameters().get(name)
+
+def get_opensearch_client(pool_maxsize=20, **options):
+    """
+    OpenSearch Serverless client shared by all invocations of the execution environment, so its pooled
+    keep-alive connections are reused. Requests are signed with the refreshable credentials of the session,
+    so the client never holds expired credentials. Clients with different options are kept separately.
+    """
+    key = (pool_maxsize, tuple(sorted(options.items())))
+    with _lock:
+        client = _opensearch_clients.get(key)
+    if client is not None:
+        return client
+
+    host = get_parameter('OPENSEARCH_ENDPOINT').replace('https://', '')
+    credentials = boto3.Session().get_credentials()
+    auth = AWSV4SignerAuth(credentials, os.environ.get('AWS_REGION'), 'aoss')
+
+    client = OpenSearch(
+        hosts=[{'host': host, 'port': 443}],
+        http_auth=auth,
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=RequestsHttpConnection,
+        pool_maxsize=pool_maxsize,
+        **options
+    )
+    with _lock:
+        return _opensearch_clients.setdefault(key, client)
+
+def get_embedding_cache():
+    """Embedding cache shared by all functions that embed text, created on first use and kept across warm invocations"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = create_embedding_cache(boto3.resource('dynamodb'), get_parameter('EMBEDDING_CACHE_TABLE'))
+    return _embedding_cache
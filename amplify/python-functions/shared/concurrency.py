@@ -0,0 +1,68 @@
+import threading
+import time
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD (additive increase, multiplicative decrease) limit on the number of concurrent requests to a throttled service.
+    The limit grows by one after every increase_after consecutive successes and is halved on every throttle,
+    so it converges on the highest concurrency the account quota allows.
+
+    Usage: acquire() before a request, then release(throttled) once it completes.
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=16, increase_after=4):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.increase_after = increase_after
+        self.in_flight = 0
+        self.successes_since_change = 0
+        self.condition = threading.Condition()
+
+        self.requests = 0
+        self.throttles = 0
+        self.peak_limit = self.limit
+        self.busy_seconds = 0.0
+        self.busy_since = None
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            if self.in_flight == 0:
+                self.busy_since = time.perf_counter()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if self.in_flight == 0 and self.busy_since is not None:
+                self.busy_seconds += time.perf_counter() - self.busy_since
+                self.busy_since = None
+
+            if throttled:
+                self.throttles += 1
+                self.limit = max(self.minimum, self.limit // 2)
+                self.successes_since_change = 0
+            else:
+                self.successes_since_change += 1
+                if self.successes_since_change >= self.increase_after and self.limit < self.maximum:
+                    self.limit += 1
+                    self.peak_limit = max(self.peak_limit, self.limit)
+                    self.successes_since_change = 0
+
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            busy_seconds = self.busy_seconds
+            if self.busy_since is not None:
+                busy_seconds += time.perf_counter() - self.busy_since
+            return {
+                'requests': self.requests,
+                'throttles': self.throttles,
+                'requestsPerSecond': round(self.requests / busy_seconds, 2) if busy_seconds > 0 else 0,
+                'concurrencyLimit': self.limit,
+                'peakConcurrencyLimit': self.peak_limit,
+            }
@@ -0,0 +1,228 @@
+import hashlib
+import os
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+# Number of vectors kept in memory; a 1024-dim vector takes roughly 32 KB as a list of floats
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MEMORY_ENTRIES', 1000))
+
+# Persistent entries expire after this many days (DynamoDB TTL)
+EMBEDDING_CACHE_TTL_DAYS = int(os.environ.get('EMBEDDING_CACHE_TTL_DAYS', 90))
+
+# Maximum number of entries kept by the SQLite store before the least recently used are evicted
+EMBEDDING_CACHE_SQLITE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_SQLITE_MAX_ENTRIES', 100000))
+
+def normalize_text(text):
+    """Normalize text before embedding so trivially different strings share a cache entry"""
+    return ' '.join(unicodedata.normalize('NFC', str(text)).split())
+
+def cache_key(model_id, input_type, text, embedding_type='float'):
+    """Content-addressed cache key for an embedding; float vectors keep the keys of before embedding types"""
+    if embedding_type != 'float':
+        model_id = f"{model_id}\n{embedding_type}"
+    return hashlib.sha256(f"{model_id}\n{input_type}\n{text}".encode('utf-8')).hexdigest()
+
+def encode_vector(vector):
+    """Encode a vector as float32 bytes for the persistent stores"""
+    return array('f', vector).tobytes()
+
+def decode_vector(data):
+    vector = array('f')
+    vector.frombytes(bytes(data))
+    return vector.tolist()
+
+class LRUCache:
+    """Least recently used cache holding at most max_entries values"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class EmbeddingStore:
+    """
+    Persistent tier of the embedding cache.
+    Implementations map cache keys to vectors and must never raise for a cache failure.
+    """
+
+    def get_many(self, keys):
+        """Return a dict of key -> vector for the keys that are stored"""
+        raise NotImplementedError
+
+    def put_many(self, vectors):
+        """Store a dict of key -> vector"""
+        raise NotImplementedError
+
+class DynamoDBEmbeddingStore(EmbeddingStore):
+    """Embedding store backed by a DynamoDB table with a 'cacheKey' partition key and an 'expiresAt' TTL attribute"""
+
+    # BatchGetItem accepts at most 100 keys
+    MAX_KEYS_PER_GET = 100
+    MAX_GET_RETRIES = 3
+
+    def __init__(self, dynamodb_resource, table_name, ttl_days=EMBEDDING_CACHE_TTL_DAYS):
+        self.client = dynamodb_resource.meta.client
+        self.table = dynamodb_resource.Table(table_name)
+        self.table_name = table_name
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+
+    def get_many(self, keys):
+        vectors = {}
+        try:
+            for start in range(0, len(keys), self.MAX_KEYS_PER_GET):
+                request = {self.table_name: {'Keys': [{'cacheKey': key} for key in keys[start:start + self.MAX_KEYS_PER_GET]]}}
+                for attempt in range(self.MAX_GET_RETRIES):
+                    response = self.client.batch_get_item(RequestItems=request)
+                    for item in response.get('Responses', {}).get(self.table_name, []):
+                        vectors[item['cacheKey']] = decode_vector(item['vector'].value)
+                    request = response.get('UnprocessedKeys')
+                    if not request:
+                        break
+                    time.sleep(0.05 * 2 ** attempt)
+        except Exception as e:
+            print(f"Error reading embedding cache: {e}")
+        return vectors
+
+    def put_many(self, vectors):
+        expires_at = int(time.time()) + self.ttl_seconds
+        try:
+            with self.table.batch_writer() as batch:
+                for key, vector in vectors.items():
+                    batch.put_item(Item={'cacheKey': key, 'vector': encode_vector(vector), 'expiresAt': expires_at})
+        except Exception as e:
+            print(f"Error writing embedding cache: {e}")
+
+class SQLiteEmbeddingStore(EmbeddingStore):
+    """Embedding store backed by a local SQLite file, for local runs and tests"""
+
+    def __init__(self, path, max_entries=EMBEDDING_CACHE_SQLITE_MAX_ENTRIES):
+        # only imported when a local store is configured, it is never used in Lambda
+        import sqlite3
+
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (cache_key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def get_many(self, keys):
+        vectors = {}
+        try:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT cache_key, vector FROM embeddings WHERE cache_key IN ({placeholders})", batch
+                ).fetchall()
+                for key, data in rows:
+                    vectors[key] = decode_vector(data)
+                self.connection.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE cache_key IN ({placeholders})", [time.time()] + batch
+                )
+            self.connection.commit()
+        except Exception as e:
+            print(f"Error reading embedding cache: {e}")
+        return vectors
+
+    def put_many(self, vectors):
+        try:
+            now = time.time()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (cache_key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, encode_vector(vector), now) for key, vector in vectors.items()]
+            )
+            # evict the least recently used entries over the size bound
+            self.connection.execute(
+                "DELETE FROM embeddings WHERE cache_key IN "
+                "(SELECT cache_key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.connection.commit()
+        except Exception as e:
+            print(f"Error writing embedding cache: {e}")
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: an in-process LRU in front of an optional persistent EmbeddingStore.
+    Vectors found in the persistent tier are promoted to the LRU.
+    """
+
+    def __init__(self, store=None, max_memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES):
+        self.memory = LRUCache(max_memory_entries)
+        self.store = store
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """Return a dict of key -> vector for the cached keys"""
+        vectors = {}
+        missing = []
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                vectors[key] = vector
+        self.memory_hits += len(vectors)
+
+        if missing and self.store is not None:
+            stored = self.store.get_many(missing)
+            for key, vector in stored.items():
+                self.memory.put(key, vector)
+            vectors.update(stored)
+            self.store_hits += len(stored)
+
+        self.misses += len(keys) - len(vectors)
+        return vectors
+
+    def put_many(self, vectors):
+        for key, vector in vectors.items():
+            self.memory.put(key, vector)
+        if vectors and self.store is not None:
+            self.store.put_many(vectors)
+
+    def stats(self):
+        lookups = self.memory_hits + self.store_hits + self.misses
+        return {
+            'memoryHits': self.memory_hits,
+            'storeHits': self.store_hits,
+            'misses': self.misses,
+            'hitRate': round((self.memory_hits + self.store_hits) / lookups, 3) if lookups else 0,
+            'memoryEntries': len(self.memory),
+        }
+
+def create_embedding_cache(dynamodb_resource=None, table_name=None):
+    """
+    Create the embedding cache for a function.
+    The persistent tier is the DynamoDB table when a table name is given, or a SQLite file
+    when EMBEDDING_CACHE_SQLITE_PATH is set (local runs), otherwise only the in-process LRU is used.
+    """
+    sqlite_path = os.environ.get('EMBEDDING_CACHE_SQLITE_PATH')
+    if sqlite_path:
+        store = SQLiteEmbeddingStore(sqlite_path)
+    elif table_name and dynamodb_resource is not None:
+        store = DynamoDBEmbeddingStore(dynamodb_resource, table_name)
+    else:
+        store = None
+    return EmbeddingCache(store)
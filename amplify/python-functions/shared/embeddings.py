@@ -0,0 +1,204 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from .embedding_cache import cache_key, normalize_text
+
+EMBEDDING_MODEL_ID = "cohere.embed-multilingual-v3"
+
+# Cohere embed v3 accepts at most 96 texts per request
+MAX_TEXTS_PER_REQUEST = 96
+
+# Vector types an index can store: float vectors, or the compact int8 (one signed byte per dimension) and
+# binary (one bit per dimension, packed in signed bytes) embeddings of Cohere embed v3
+EMBEDDING_TYPES = ['float', 'int8', 'binary']
+
+# Throttled requests are retried with exponential backoff and full jitter
+THROTTLING_ERROR_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException'}
+MAX_THROTTLE_RETRIES = 8
+THROTTLE_INITIAL_BACKOFF_SECONDS = 0.5
+THROTTLE_MAX_BACKOFF_SECONDS = 20
+
+class EmbeddingThrottledError(Exception):
+    """Bedrock kept throttling a request after all retries"""
+
+def invoke_embedding_model(bedrock_runtime, texts, input_type="search_document", embedding_types=None):
+    """
+    Embed a list of texts with a single Bedrock call, returning one float vector per text.
+    With embedding_types, e.g. ['int8', 'float'], returns a dict of embedding type -> one vector per text instead.
+    """
+    body = {
+        "input_type": input_type,
+        "texts": texts,
+        "truncate": "NONE"
+    }
+    if embedding_types:
+        body["embedding_types"] = list(embedding_types)
+
+    response = bedrock_runtime.invoke_model(
+        modelId=EMBEDDING_MODEL_ID,
+        body=json.dumps(body)
+    )
+    embeddings = json.loads(response['body'].read()).get('embeddings', [])
+
+    if embedding_types:
+        for embedding_type in embedding_types:
+            if len(embeddings.get(embedding_type) or []) != len(texts):
+                raise ValueError(f"Expected {len(texts)} {embedding_type} embeddings, received {len(embeddings.get(embedding_type) or [])}")
+    elif len(embeddings) != len(texts):
+        raise ValueError(f"Expected {len(texts)} embeddings, received {len(embeddings)}")
+
+    return embeddings
+
+def is_throttling_error(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+def invoke_with_throttle_retry(bedrock_runtime, texts, input_type="search_document", limiter=None, embedding_types=None):
+    """
+    Invoke the embedding model, retrying throttled requests with jittered backoff.
+    When an AdaptiveConcurrencyLimiter is given, the request takes one of its slots and reports throttles to it.
+    """
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        if limiter is not None:
+            limiter.acquire()
+        throttled = False
+        try:
+            return invoke_embedding_model(bedrock_runtime, texts, input_type, embedding_types)
+        except Exception as e:
+            if not is_throttling_error(e):
+                raise
+            throttled = True
+        finally:
+            if limiter is not None:
+                limiter.release(throttled=throttled)
+
+        time.sleep(random.uniform(0, min(THROTTLE_INITIAL_BACKOFF_SECONDS * 2 ** attempt, THROTTLE_MAX_BACKOFF_SECONDS)))
+
+    raise EmbeddingThrottledError(f"Embedding request still throttled after {MAX_THROTTLE_RETRIES} retries")
+
+def embed_texts(bedrock_runtime, texts, input_type="search_document", batch_size=MAX_TEXTS_PER_REQUEST, cache=None, limiter=None, embedding_type='float', float_embeddings=None):
+    """
+    Embeds a list of texts using as few Bedrock calls as possible.
+    Texts are normalized and identical texts are only embedded once. When an EmbeddingCache is given,
+    cached vectors are reused and only the remaining texts are sent, in full batches of up to batch_size.
+    If a batch is rejected, it is split in half and retried until the failing texts are isolated,
+    so a single bad value does not fail the whole batch. Throttled batches are retried as they are.
+    When an AdaptiveConcurrencyLimiter is given, batches are sent concurrently within its limit.
+
+    embedding_type selects the vectors returned (see EMBEDDING_TYPES). Compact vectors are requested together
+    with the float vectors of the same texts when there is a cache, and both are cached, so float vectors
+    are at hand without another Bedrock call, e.g. to rescore search results. When a float_embeddings list is
+    given, it is filled with the float vector of each text (or None) along with compact vectors, e.g. for ingest
+    to store them with the documents.
+
+    Returns a tuple (embeddings, errors) where embeddings[i] is the vector for texts[i] (or None if
+    it could not be embedded) and errors maps the position of each failed text to its error message.
+    """
+    normalized_texts = [normalize_text(text) for text in texts]
+
+    # Deduplicate texts while preserving first-seen order
+    unique_texts = list(dict.fromkeys(normalized_texts))
+
+    if embedding_type not in EMBEDDING_TYPES:
+        raise ValueError(f"Unknown embedding type {embedding_type}, expected one of {', '.join(EMBEDDING_TYPES)}")
+
+    # float vectors keep the request format of before embedding types, and their cache entries
+    if embedding_type == 'float':
+        embedding_types = None
+    elif cache is not None or float_embeddings is not None:
+        embedding_types = [embedding_type, 'float']
+    else:
+        embedding_types = [embedding_type]
+    with_floats = float_embeddings is not None and embedding_type != 'float'
+
+    vectors = {}
+    floats = {}
+    if cache is not None:
+        keys = {text: cache_key(EMBEDDING_MODEL_ID, input_type, text, embedding_type) for text in unique_texts}
+        float_keys = {text: cache_key(EMBEDDING_MODEL_ID, input_type, text) for text in unique_texts} if with_floats else {}
+        cached = cache.get_many(list(keys.values()) + list(float_keys.values()))
+        vectors = {text: cached[key] for text, key in keys.items() if key in cached}
+        floats = {text: cached[key] for text, key in float_keys.items() if key in cached}
+        if embedding_type != 'float':
+            # compact vectors are stored as floats by the cache
+            vectors = {text: [int(value) for value in vector] for text, vector in vectors.items()}
+        unique_texts = [text for text in unique_texts if text not in vectors or (with_floats and text not in floats)]
+
+    embedded = {}
+    failures = {}
+    batches = [unique_texts[start:start + batch_size] for start in range(0, len(unique_texts), batch_size)]
+    if limiter is not None and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=min(limiter.maximum, len(batches))) as executor:
+            futures = [executor.submit(_embed_batch_with_split, bedrock_runtime, batch, input_type, embedded, failures, limiter, embedding_types) for batch in batches]
+            for future in futures:
+                future.result()
+    else:
+        for batch in batches:
+            _embed_batch_with_split(bedrock_runtime, batch, input_type, embedded, failures, limiter, embedding_types)
+
+    if embedding_types:
+        if cache is not None and embedded:
+            cache.put_many({
+                cache_key(EMBEDDING_MODEL_ID, input_type, text, vector_type): vector
+                for text, vectors_by_type in embedded.items()
+                for vector_type, vector in vectors_by_type.items()
+            })
+        floats.update({text: vectors_by_type['float'] for text, vectors_by_type in embedded.items() if 'float' in vectors_by_type})
+        embedded = {text: vectors_by_type[embedding_type] for text, vectors_by_type in embedded.items()}
+    elif cache is not None and embedded:
+        cache.put_many({keys[text]: vector for text, vector in embedded.items()})
+    vectors.update(embedded)
+
+    embeddings = [vectors.get(text) for text in normalized_texts]
+    if float_embeddings is not None:
+        float_embeddings[:] = [(floats if with_floats else vectors).get(text) for text in normalized_texts]
+    errors = {position: failures[text] for position, text in enumerate(normalized_texts) if text in failures}
+    return embeddings, errors
+
+def embed_slots(bedrock_runtime, slots, input_type="search_document", batch_size=MAX_TEXTS_PER_REQUEST, cache=None, limiter=None, embedding_type='float', float_embeddings=None):
+    """
+    Embeds (key, text) pairs, e.g. ((row, field), value), batching across all of them.
+    When a float_embeddings dict is given, it is filled with the float vectors of the slots (see embed_texts).
+
+    Returns a tuple (embeddings, errors) of dicts keyed by the slot key.
+    """
+    keys = [key for key, _ in slots]
+    texts = [text for _, text in slots]
+    floats = [] if float_embeddings is not None else None
+    vectors, failures = embed_texts(bedrock_runtime, texts, input_type, batch_size, cache, limiter, embedding_type, floats)
+
+    embeddings = {key: vector for key, vector in zip(keys, vectors) if vector is not None}
+    if float_embeddings is not None:
+        float_embeddings.update({key: vector for key, vector in zip(keys, floats) if vector is not None})
+    errors = {keys[position]: message for position, message in failures.items()}
+    return embeddings, errors
+
+def _embed_batch_with_split(bedrock_runtime, texts, input_type, vectors, failures, limiter=None, embedding_types=None):
+    """
+    Embed a batch, bisecting it on failure to isolate the texts that cannot be embedded.
+    With embedding_types, vectors[text] is a dict of embedding type -> vector.
+    """
+    try:
+        embeddings = invoke_with_throttle_retry(bedrock_runtime, texts, input_type, limiter, embedding_types)
+    except EmbeddingThrottledError as e:
+        # splitting a throttled batch would only add load
+        for text in texts:
+            failures[text] = str(e)
+        return
+    except Exception as e:
+        if len(texts) == 1:
+            failures[texts[0]] = str(e)
+            return
+        middle = len(texts) // 2
+        _embed_batch_with_split(bedrock_runtime, texts[:middle], input_type, vectors, failures, limiter, embedding_types)
+        _embed_batch_with_split(bedrock_runtime, texts[middle:], input_type, vectors, failures, limiter, embedding_types)
+        return
+
+    if embedding_types:
+        for position, text in enumerate(texts):
+            vectors[text] = {embedding_type: embeddings[embedding_type][position] for embedding_type in embedding_types}
+        return
+
+    for text, embedding in zip(texts, embeddings):
+        vectors[text] = embedding
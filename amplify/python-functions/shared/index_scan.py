@@ -0,0 +1,55 @@
+import os
+
+# Documents read per search when scanning an index
+INDEX_SCAN_PAGE_SIZE = int(os.environ.get('INDEX_SCAN_PAGE_SIZE', 1000))
+
+# Most documents one item id can have, read in one search when they straddle two pages of a scan
+ITEM_MAX_DOCUMENTS = int(os.environ.get('ITEM_MAX_DOCUMENTS', 10000))
+
+def count_documents_without_item_id(client, index_name):
+    """Number of documents of an index without an itemId, which a scan in itemId order cannot reach"""
+    return client.count(index=index_name, body={'query': {'bool': {'must_not': [{'exists': {'field': 'itemId'}}]}}})['count']
+
+def read_item_documents(client, index_name, item_id, source=True):
+    """Hits of every document of an item id, raising ValueError when it has more than ITEM_MAX_DOCUMENTS"""
+    hits = client.search(
+        index=index_name,
+        body={'size': ITEM_MAX_DOCUMENTS, 'query': {'term': {'itemId': item_id}}, 'sort': [{'itemId': 'asc'}], '_source': source}
+    )['hits']['hits']
+    if len(hits) >= ITEM_MAX_DOCUMENTS:
+        raise ValueError(f"Item {item_id} of {index_name} has more than ITEM_MAX_DOCUMENTS={ITEM_MAX_DOCUMENTS} documents")
+    return hits
+
+def iter_item_documents(client, index_name, source=True, search_after=None, page_size=INDEX_SCAN_PAGE_SIZE):
+    """
+    (item id, hits) of every item id of an index after the search_after cursor, in itemId order, with all the
+    documents of an item id at once. The index is paged with search_after on itemId, where the documents of an
+    item id have the same sort value: the next page starts after all of them, so the documents of the last item
+    id of a full page are read again with their own search, in case some did not fit the page.
+
+    Documents without an itemId are not scanned (see count_documents_without_item_id). The cursor after an
+    item id is [item id].
+    """
+    while True:
+        body = {'size': page_size, 'query': {'exists': {'field': 'itemId'}}, 'sort': [{'itemId': 'asc'}], '_source': source}
+        if search_after is not None:
+            body['search_after'] = search_after
+        hits = client.search(index=index_name, body=body)['hits']['hits']
+        if not hits:
+            return
+
+        groups = []
+        for hit in hits:
+            item_id = hit['sort'][0]
+            if groups and groups[-1][0] == item_id:
+                groups[-1][1].append(hit)
+            else:
+                groups.append((item_id, [hit]))
+        if len(hits) == page_size:
+            groups[-1] = (groups[-1][0], read_item_documents(client, index_name, groups[-1][0], source))
+
+        for item_id, item_hits in groups:
+            yield item_id, item_hits
+        if len(hits) < page_size:
+            return
+        search_after = [groups[-1][0]]
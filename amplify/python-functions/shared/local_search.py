@@ -0,0 +1,463 @@
+import fnmatch
+import json
+import math
+import os
+import shutil
+import time
+from .index_scan import count_documents_without_item_id, iter_item_documents
+from .reranking import knn_scores
+
+# Snapshots of the indexes searched in-process are stored in the asset bucket under <prefix>/<index name>/<generation>/
+LOCAL_SNAPSHOT_PREFIX = os.environ.get('LOCAL_SNAPSHOT_PREFIX', 'local-search')
+
+# Where findRelatedItems keeps the snapshots it loads, in the function's ephemeral storage
+LOCAL_SNAPSHOT_DIRECTORY = os.environ.get('LOCAL_SNAPSHOT_DIRECTORY', '/tmp/local-search')
+
+# Indexes with more documents are left to OpenSearch: their snapshot would not fit the memory of the function
+# (a float vector field takes 2 KB per document in a snapshot, and 4 KB once loaded)
+LOCAL_SEARCH_MAX_ITEMS = int(os.environ.get('LOCAL_SEARCH_MAX_ITEMS', 30000))
+
+# Documents read per search when exporting an index
+LOCAL_SNAPSHOT_PAGE_SIZE = int(os.environ.get('LOCAL_SNAPSHOT_PAGE_SIZE', 200))
+
+# opensearch searches an index in its collection; local searches the snapshot of the index in-process
+SEARCH_BACKENDS = ['opensearch', 'local']
+
+# Float vectors are stored as float16 in snapshots, int8 and binary vectors as they are indexed
+SNAPSHOT_VECTOR_DTYPES = {'float': 'float16', 'int8': 'int8', 'binary': 'int8'}
+
+# BM25 parameters of OpenSearch, which scores term queries on keyword fields with them
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MANIFEST_FILE = 'manifest.json'
+SOURCES_FILE = 'sources.jsonl'
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("Local search requires numpy, add it to the function requirements")
+    return numpy
+
+def get_vector_widths(client, index_name):
+    """Number of values of the vectors of each knn_vector field of an index, from its mapping"""
+    properties = client.indices.get_mapping(index=index_name)[index_name]['mappings'].get('properties', {})
+    return {
+        # binary vectors are indexed as int8 values of 8 bits each
+        field: int(mapping['dimension']) // (8 if mapping.get('data_type') == 'binary' else 1)
+        for field, mapping in properties.items() if mapping.get('type') == 'knn_vector'
+    }
+
+def write_snapshot(client, index_name, directory, generation=0, embedding_type='float', space_type='l2', page_size=LOCAL_SNAPSHOT_PAGE_SIZE):
+    """
+    Export every document of an index into a snapshot directory, in itemId order (see shared.index_scan).
+    Each vector field is written as a .npy matrix with the positions of the documents having a
+    vector, each keyword field as (position, term) pairs with the list of its terms, and the documents without
+    their vectors as JSON lines with their offsets.
+
+    Raises ValueError for indexes of more than LOCAL_SEARCH_MAX_ITEMS documents, or with documents without an
+    itemId, which the export would leave out. Returns the manifest of the snapshot.
+    """
+    np = _numpy()
+    count = client.count(index=index_name)['count']
+    if count > LOCAL_SEARCH_MAX_ITEMS:
+        raise ValueError(f"Index {index_name} has {count} documents, more than LOCAL_SEARCH_MAX_ITEMS={LOCAL_SEARCH_MAX_ITEMS}")
+    missing = count_documents_without_item_id(client, index_name)
+    if missing:
+        raise ValueError(f"Index {index_name} has {missing} documents without an itemId, they cannot be exported")
+
+    vector_widths = get_vector_widths(client, index_name)
+
+    os.makedirs(directory, exist_ok=True)
+    dtype = SNAPSHOT_VECTOR_DTYPES[embedding_type]
+    matrices = {
+        field: np.lib.format.open_memmap(os.path.join(directory, f"vectors.{field}.npy"), mode='w+', dtype=dtype, shape=(max(count, 1), width))
+        for field, width in vector_widths.items()
+    }
+    vector_rows = {field: [] for field in vector_widths}
+    terms = {}
+    postings = {}
+    offsets = [0]
+
+    position = 0
+    with open(os.path.join(directory, SOURCES_FILE), 'wb') as sources:
+        for _, hits in iter_item_documents(client, index_name, page_size=page_size):
+            for hit in hits:
+                if position >= count:
+                    raise RuntimeError(f"Documents were added to {index_name} while it was exported, export it again")
+                source = hit['_source']
+                for field in vector_widths:
+                    vector = source.pop(field, None)
+                    if isinstance(vector, list):
+                        matrices[field][len(vector_rows[field])] = vector
+                        vector_rows[field].append(position)
+                for field, value in source.items():
+                    field_terms = terms.setdefault(field, {})
+                    for element in value if isinstance(value, list) else [value]:
+                        if element is not None:
+                            postings.setdefault(field, []).append((position, field_terms.setdefault(str(element), len(field_terms))))
+                line = json.dumps(source, default=str).encode('utf-8') + b'\n'
+                sources.write(line)
+                offsets.append(offsets[-1] + len(line))
+                position += 1
+
+    for field, matrix in matrices.items():
+        matrix.flush()
+        np.save(os.path.join(directory, f"rows.{field}.npy"), np.asarray(vector_rows[field], dtype=np.int32))
+    for field, field_terms in terms.items():
+        np.save(os.path.join(directory, f"terms.{field}.npy"), np.asarray(postings.get(field, []), dtype=np.int32).reshape(-1, 2))
+        with open(os.path.join(directory, f"terms.{field}.json"), 'w') as f:
+            json.dump(list(field_terms), f)
+    np.save(os.path.join(directory, 'offsets.npy'), np.asarray(offsets, dtype=np.int64))
+
+    manifest = {
+        'indexName': index_name,
+        'generation': int(generation),
+        'documents': position,
+        'embeddingType': embedding_type,
+        'spaceType': space_type,
+        'vectorFields': {field: {'vectors': len(vector_rows[field]), 'width': width} for field, width in vector_widths.items()},
+        'termFields': sorted(terms),
+        'createdAt': int(time.time())
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    manifest['files'] = sorted(os.listdir(directory))
+    return manifest
+
+def publish_snapshot(s3_client, bucket, index_config_table, directory, manifest):
+    """
+    Upload a snapshot to the asset bucket and record it as the localSnapshot of its index config, unless the
+    index moved to another generation since it was exported. Returns whether the snapshot was recorded.
+    """
+    index_name = manifest['indexName']
+    prefix = f"{LOCAL_SNAPSHOT_PREFIX}/{index_name}/{manifest['generation']}"
+    # the manifest goes last, so a snapshot is only complete once its manifest exists
+    for file_name in sorted(manifest['files'], key=lambda name: name == MANIFEST_FILE):
+        s3_client.upload_file(os.path.join(directory, file_name), bucket, f"{prefix}/{file_name}")
+
+    snapshot = {
+        'generation': manifest['generation'],
+        'prefix': prefix,
+        'documents': manifest['documents'],
+        'files': manifest['files'],
+        'createdAt': manifest['createdAt']
+    }
+    # indexes that were never written to have no generation yet, which is generation 0
+    condition = 'indexGeneration = :generation'
+    if not manifest['generation']:
+        condition = f"attribute_not_exists(indexGeneration) OR {condition}"
+    try:
+        index_config_table.update_item(
+            Key={'indexName': index_name},
+            UpdateExpression='SET localSnapshot = :snapshot',
+            ConditionExpression=condition,
+            ExpressionAttributeValues={':snapshot': snapshot, ':generation': manifest['generation']}
+        )
+    except index_config_table.meta.client.exceptions.ConditionalCheckFailedException:
+        print(f"Index {index_name} changed while its snapshot of generation {manifest['generation']} was exported, not recording it")
+        return False
+    print(f"Recorded snapshot of {index_name} generation {manifest['generation']}: {manifest['documents']} documents")
+    return True
+
+class LocalSearchIndex:
+    """
+    Snapshot of an index written by write_snapshot, memory-mapped and searched in-process with NumPy.
+
+    search and msearch answer like the OpenSearch client for the queries built by build_query and
+    build_identifier_query (bool, function_score, knn, term, terms and match_all), scoring every vector exactly
+    instead of through HNSW graphs, and term queries with BM25 like an index of one shard. Named clauses report their scores in matched_queries, and _source never
+    includes vectors.
+    """
+
+    def __init__(self, directory):
+        np = _numpy()
+        self.np = np
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.index_name = self.manifest['indexName']
+        self.generation = self.manifest['generation']
+        self.count = self.manifest['documents']
+        self.space_type = self.manifest['spaceType']
+
+        # float16 vectors are converted once, as converting them for every search would cost more than scoring them
+        self.vectors = {}
+        self.vector_rows = {}
+        self.squared_norms = {}
+        for field, settings in self.manifest['vectorFields'].items():
+            matrix = np.load(os.path.join(directory, f"vectors.{field}.npy"), mmap_mode='r')[:settings['vectors']]
+            if self.space_type != 'hamming':
+                matrix = np.asarray(matrix, dtype=np.float32)
+                self.squared_norms[field] = (matrix * matrix).sum(axis=1)
+            self.vectors[field] = matrix
+            self.vector_rows[field] = np.load(os.path.join(directory, f"rows.{field}.npy"))
+
+        # term scores need the number of documents having each term, of documents having the field and the
+        # average number of terms of those documents, as in the statistics of an OpenSearch shard
+        self.terms = {}
+        self.postings = {}
+        self.term_statistics = {}
+        for field in self.manifest['termFields']:
+            with open(os.path.join(directory, f"terms.{field}.json")) as f:
+                self.terms[field] = {term: code for code, term in enumerate(json.load(f))}
+            self.postings[field] = np.load(os.path.join(directory, f"terms.{field}.npy"), mmap_mode='r')
+            pairs = np.unique(np.asarray(self.postings[field]), axis=0)
+            documents = len(np.unique(pairs[:, 0]))
+            self.term_statistics[field] = (np.bincount(pairs[:, 1], minlength=len(self.terms[field])), documents, len(pairs) / max(documents, 1))
+
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        self.sources = np.memmap(os.path.join(directory, SOURCES_FILE), dtype=np.uint8, mode='r') if self.offsets[-1] else None
+
+    def source(self, position):
+        return json.loads(self.sources[self.offsets[position]:self.offsets[position + 1]].tobytes())
+
+    def search(self, body=None, index=None, **params):
+        """Run a search, returning a response shaped like the one of OpenSearch"""
+        np = self.np
+        body = body or {}
+        matches, scores, named = self._evaluate(body.get('query', {'match_all': {}}))
+        if body.get('min_score') is not None:
+            matches &= scores >= float(body['min_score'])
+
+        candidates = np.flatnonzero(matches)
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        offset = int(body.get('from', params.get('from', 0)))
+        size = int(body.get('size', params.get('size', 10)))
+
+        hits = []
+        for position in order[offset:offset + size].tolist():
+            source = self.source(position)
+            hit = {'_index': self.index_name, '_id': source.get('itemId'), '_score': float(scores[position])}
+            selected = _select_source(source, body.get('_source', True))
+            if selected is not None:
+                hit['_source'] = selected
+            matched = {name: float(clause_scores[position]) for name, clause_matches, clause_scores in named if clause_matches[position]}
+            if matched:
+                hit['matched_queries'] = matched
+            hits.append(hit)
+
+        return {
+            'hits': {
+                'total': {'value': len(candidates), 'relation': 'eq'},
+                'max_score': float(scores[order[0]]) if len(order) else None,
+                'hits': hits
+            }
+        }
+
+    def msearch(self, body=None, index=None, **params):
+        """Run the searches of an _msearch body given as a list of header and query dicts"""
+        responses = []
+        for header, query in zip(body[0::2], body[1::2]):
+            try:
+                responses.append({**self.search(query), 'status': 200})
+            except ValueError as e:
+                responses.append({'error': {'type': 'illegal_argument_exception', 'reason': str(e)}, 'status': 400})
+        return {'responses': responses}
+
+    def _evaluate(self, clause):
+        """Evaluate a query clause on every document, returning (matches, scores, [(name, matches, scores)])"""
+        np = self.np
+        query_type, query = next(iter(clause.items()))
+
+        if query_type == 'match_all':
+            return np.ones(self.count, dtype=bool), np.ones(self.count), []
+
+        if query_type in ['term', 'terms']:
+            field, value = next(iter(query.items()))
+            values = value if query_type == 'terms' else [value.get('value') if isinstance(value, dict) else value]
+            matches = np.zeros(self.count, dtype=bool)
+            postings = self.postings.get(field)
+            for term in values:
+                code = self.terms.get(field, {}).get(str(term))
+                if code is not None:
+                    matches[postings[postings[:, 1] == code, 0]] = True
+            boost = float(value.get('boost', 1.0)) if isinstance(value, dict) else 1.0
+            if query_type == 'term' and matches.any():
+                # a terms query is constant score, a term query is scored by how rare its term is
+                doc_freqs, documents, average_terms = self.term_statistics[field]
+                boost *= _term_score(doc_freqs[self.terms[field][str(values[0])]], documents, average_terms)
+            return matches, np.where(matches, boost, 0.0), []
+
+        if query_type == 'knn':
+            return self._knn(query)
+
+        if query_type == 'function_score':
+            matches, scores, named = self._evaluate(query.get('query', {'match_all': {}}))
+            scores = scores * float(query.get('weight', 1.0))
+            if query.get('_name'):
+                named = named + [(query['_name'], matches, scores)]
+            return matches, scores, named
+
+        if query_type == 'bool':
+            return self._bool(query)
+
+        raise ValueError(f"Query type {query_type} is not supported by the local search backend")
+
+    def _bool(self, query):
+        np = self.np
+        matches = np.ones(self.count, dtype=bool)
+        scores = np.zeros(self.count)
+        named = []
+        for clause in query.get('must', []):
+            clause_matches, clause_scores, clause_named = self._evaluate(clause)
+            matches &= clause_matches
+            scores += np.where(clause_matches, clause_scores, 0)
+            named += clause_named
+        for clause in query.get('filter', []):
+            clause_matches, _, clause_named = self._evaluate(clause)
+            matches &= clause_matches
+            named += clause_named
+        for clause in query.get('must_not', []):
+            matches &= ~self._evaluate(clause)[0]
+
+        should = query.get('should', [])
+        if should:
+            should_matched = np.zeros(self.count, dtype=np.int64)
+            for clause in should:
+                clause_matches, clause_scores, clause_named = self._evaluate(clause)
+                should_matched += clause_matches
+                scores += np.where(clause_matches, clause_scores, 0)
+                named += clause_named
+            default = 0 if query.get('must') or query.get('filter') else 1
+            minimum = _minimum_should_match(query.get('minimum_should_match', default), len(should))
+            # without must or filter clauses, a document matches at least one should clause whatever the minimum
+            matches &= should_matched >= (minimum if query.get('must') or query.get('filter') else max(minimum, 1))
+        elif not query.get('must') and not query.get('filter'):
+            scores += 1.0
+        return matches, np.where(matches, scores, 0), [(name, clause_matches & matches, clause_scores) for name, clause_matches, clause_scores in named]
+
+    def _knn(self, query):
+        np = self.np
+        field, options = next(iter(query.items()))
+        matches, scores = np.zeros(self.count, dtype=bool), np.zeros(self.count)
+        if field not in self.vectors:
+            raise ValueError(f"Field '{field}' is not a vector field of the snapshot of {self.index_name}")
+        if not len(self.vectors[field]):
+            return matches, scores, []
+
+        query_vector = np.asarray(options['vector'], dtype=np.int8 if self.space_type == 'hamming' else np.float32)
+        field_scores = knn_scores(np, self.vectors[field], query_vector, self.space_type, self.squared_norms.get(field))
+
+        if 'min_score' in options:
+            keep = field_scores >= float(options['min_score'])
+        elif 'max_distance' in options:
+            keep = field_scores >= _max_distance_score(float(options['max_distance']), self.space_type)
+        else:
+            keep = np.zeros(len(field_scores), dtype=bool)
+            keep[np.argsort(-field_scores, kind='stable')[:int(options.get('k', 10))]] = True
+        positions = self.vector_rows[field]
+        matches[positions[keep]] = True
+        scores[positions[keep]] = field_scores[keep] * float(options.get('boost', 1.0))
+        return matches, scores, []
+
+def _select_source(source, source_filter):
+    """The fields of a source selected by the _source of a search"""
+    if source_filter is False:
+        return None
+    includes, excludes = [], []
+    if isinstance(source_filter, (list, str)):
+        includes = [source_filter] if isinstance(source_filter, str) else source_filter
+    elif isinstance(source_filter, dict):
+        includes = source_filter.get('includes') or []
+        excludes = source_filter.get('excludes') or []
+    return {
+        field: value for field, value in source.items()
+        if (not includes or any(fnmatch.fnmatchcase(field, pattern) for pattern in includes))
+        and not any(fnmatch.fnmatchcase(field, pattern) for pattern in excludes)
+    }
+
+def _minimum_should_match(value, clauses):
+    value = str(value).strip()
+    if value.endswith('%'):
+        return int(clauses * float(value[:-1]) / 100)
+    minimum = int(value)
+    return clauses + minimum if minimum < 0 else minimum
+
+def _term_score(doc_freq, documents, average_terms):
+    """
+    BM25 score of a term query on a keyword field, as OpenSearch computes it: keyword fields index neither term
+    frequencies nor lengths, so every matching document scores the same, higher for rarer terms
+    """
+    idf = math.log(1 + (documents - doc_freq + 0.5) / (doc_freq + 0.5))
+    return idf / (1 + BM25_K1 * (1 - BM25_B + BM25_B / average_terms))
+
+def _max_distance_score(max_distance, space_type):
+    """Score of a knn match at max_distance"""
+    if space_type == 'l2':
+        return 1 / (1 + max_distance)
+    if space_type == 'cosinesimil':
+        return 1 - max_distance / 2
+    return float('-inf')
+
+class LocalIndexStore:
+    """
+    Snapshots loaded by an execution environment, one per index, downloaded from the asset bucket to
+    LOCAL_SNAPSHOT_DIRECTORY. A snapshot is only used for the generation of the index it was exported at.
+    """
+
+    def __init__(self, bucket, s3_client=None, directory=LOCAL_SNAPSHOT_DIRECTORY):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.directory = directory
+        self.indexes = {}
+
+    def get(self, index_name, generation, snapshot):
+        """
+        Loaded snapshot of an index for its current generation, given the localSnapshot of its index config,
+        or None when the index has no snapshot of that generation.
+        """
+        if not snapshot or int(snapshot.get('generation', -1)) != int(generation):
+            return None
+        local_index = self.indexes.get(index_name)
+        if local_index is not None and local_index.generation == int(generation):
+            return local_index
+
+        # snapshots of earlier generations are removed before the new one is downloaded
+        self.indexes.pop(index_name, None)
+        index_directory = os.path.join(self.directory, index_name)
+        shutil.rmtree(index_directory, ignore_errors=True)
+        directory = os.path.join(index_directory, str(int(generation)))
+        os.makedirs(directory)
+        if self.s3_client is None:
+            import boto3
+            self.s3_client = boto3.client('s3')
+        for file_name in snapshot['files']:
+            self.s3_client.download_file(self.bucket, f"{snapshot['prefix']}/{file_name}", os.path.join(directory, file_name))
+        local_index = LocalSearchIndex(directory)
+        self.indexes[index_name] = local_index
+        print(f"Loaded snapshot of {index_name} generation {generation}: {local_index.count} documents")
+        return local_index
+
+def compare_with_opensearch(client, local_index, queries, size=10, tolerance=1e-3):
+    """
+    Parity check of a snapshot with its index: run the same queries (built by build_query, with their vectors)
+    on both and compare the results. Documents scoring the same can come in any order, so results are compared
+    by score: recall is the mean share of the OpenSearch results found locally, counting the results tied
+    (within tolerance) with the last one as found when the local results reach their score, and
+    maxScoreDifference the largest difference between the scores at the same rank.
+    """
+    recalls = []
+    max_score_difference = 0.0
+    for query in queries:
+        query = {**query, 'size': size}
+        expected = client.search(body=query, index=local_index.index_name)['hits']['hits']
+        found = local_index.search(body=query)['hits']['hits']
+        found_ids = {(hit.get('_source') or {}).get('itemId') for hit in found}
+        last_found_score = found[-1]['_score'] if found else float('inf')
+        matched = sum(
+            (hit.get('_source') or {}).get('itemId') in found_ids
+            or (abs(hit['_score'] - expected[-1]['_score']) <= tolerance and last_found_score >= hit['_score'] - tolerance)
+            for hit in expected
+        )
+        recalls.append(matched / len(expected) if expected else float(not found))
+        for expected_hit, found_hit in zip(expected, found):
+            max_score_difference = max(max_score_difference, abs(expected_hit['_score'] - found_hit['_score']))
+        if len(expected) != len(found):
+            max_score_difference = float('inf')
+    return {
+        'queries': len(queries),
+        'recall': round(sum(recalls) / len(recalls), 4) if recalls else None,
+        'maxScoreDifference': round(max_score_difference, 6)
+    }
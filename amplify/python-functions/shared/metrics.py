@@ -0,0 +1,136 @@
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+
+# CloudWatch namespace of the metrics extracted from the record every invocation logs
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ItemMatching')
+
+# Repetitive per-item log lines (e.g. rows that could not be indexed): the first ones of an invocation are
+# always printed, then only this fraction of them
+LOG_SAMPLE_FIRST = int(os.environ.get('LOG_SAMPLE_FIRST', 5))
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+
+# Upper bounds of the buckets of the stage latency histograms, in ms
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+class InvocationMetrics:
+    """
+    Timings of the stages of one invocation (e.g. embed, search), with counts and sizes, logged as a single
+    CloudWatch embedded metric format (EMF) record by emit(). CloudWatch extracts the total time of each stage,
+    the counts and the sizes as metrics with the function name as dimension; the latency histogram of each stage
+    and the other properties stay in the record, for Logs Insights.
+    """
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+        self.properties = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as one occurrence of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.stages.setdefault(name, []).append(seconds * 1000)
+
+    def timed(self, name, iterable):
+        """Iterate over iterable, timing the production of every element (e.g. reading a chunk) as a stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    element = next(iterator)
+                except StopIteration:
+                    return
+            yield element
+
+    def count(self, name, value=1):
+        """Add to a count; names ending in Bytes are reported as sizes"""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def stage_totals(self):
+        """Total time of each stage in ms, in the order the stages first ran"""
+        return {name: round(sum(durations), 1) for name, durations in self.stages.items()}
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        """Server-Timing header value of the stages so far, e.g. 'embed;dur=84.2, search;dur=31.0, total;dur=120.5'"""
+        timings = [f"{name};dur={total}" for name, total in self.stage_totals().items()]
+        return ', '.join(timings + [f"total;dur={self.elapsed_ms():.1f}"])
+
+    def histograms(self):
+        """Number of occurrences of each stage per latency bucket, only listing non-empty buckets"""
+        histograms = {}
+        for name, durations in self.stages.items():
+            buckets = {}
+            for duration in durations:
+                bound = next((str(bound) for bound in LATENCY_BUCKETS_MS if duration <= bound), '+Inf')
+                buckets[bound] = buckets.get(bound, 0) + 1
+            histograms[name] = buckets
+        return histograms
+
+    def to_record(self):
+        """The EMF record of the invocation"""
+        metrics = [{'Name': 'durationMs', 'Unit': 'Milliseconds'}]
+        record = {'FunctionName': self.function_name, 'durationMs': round(self.elapsed_ms(), 1)}
+        for name, total in self.stage_totals().items():
+            metrics.append({'Name': f"{name}Ms", 'Unit': 'Milliseconds'})
+            record[f"{name}Ms"] = total
+        for name, value in self.counts.items():
+            metrics.append({'Name': name, 'Unit': 'Bytes' if name.endswith('Bytes') else 'Count'})
+            record[name] = value
+
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['FunctionName']],
+                'Metrics': metrics
+            }]
+        }
+        record['stageCounts'] = {name: len(durations) for name, durations in self.stages.items()}
+        record['stageHistogramsMs'] = self.histograms()
+        record.update(self.properties)
+        return record
+
+    def emit(self):
+        """Log the EMF record of the invocation, never raising"""
+        try:
+            print(json.dumps(self.to_record(), default=str))
+        except Exception as e:
+            print(f"Error emitting metrics: {e}")
+
+class SampledLogger:
+    """Prints the first messages of a kind, then a random sample of them, keeping count of the ones left out"""
+
+    def __init__(self, first=LOG_SAMPLE_FIRST, rate=LOG_SAMPLE_RATE):
+        self.first = first
+        self.rate = rate
+        self.seen = 0
+        self.suppressed = 0
+
+    def log(self, message):
+        self.seen += 1
+        if self.seen <= self.first or random.random() < self.rate:
+            print(message)
+        else:
+            self.suppressed += 1
+
+    def print_summary(self, description):
+        """Print how many messages were left out, if any"""
+        if self.suppressed:
+            print(f"{self.suppressed} of {self.seen} {description} not logged (LOG_SAMPLE_RATE={self.rate})")
@@ -0,0 +1,141 @@
+import random
+import time
+from datetime import datetime, timezone
+
+# BatchWriteItem accepts at most 25 put requests, BatchGetItem at most 100 keys
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_GET_MAX_KEYS = 100
+
+# Attributes of an item kept when it is written again: its first creation time and the group assigned by groupItems
+PRESERVED_ATTRIBUTES = ['createdAt', 'groupId']
+
+BATCH_WRITE_MAX_RETRIES = 5
+BATCH_WRITE_INITIAL_BACKOFF_SECONDS = 0.1
+BATCH_WRITE_MAX_BACKOFF_SECONDS = 5
+
+class ProcessingQueueWriter:
+    """
+    Buffers items for the ProcessingQueue table and writes them with BatchWriteItem, 25 items per request.
+    Unprocessed items are retried with exponential backoff and jitter. If a batch is rejected outright
+    (e.g. one invalid item), its items are written one by one so only the invalid ones are lost.
+
+    Use as a context manager so the remaining buffered items are flushed on exit.
+    """
+
+    def __init__(self, dynamodb_resource, table_name, max_retries=BATCH_WRITE_MAX_RETRIES):
+        self.client = dynamodb_resource.meta.client
+        self.table = dynamodb_resource.Table(table_name)
+        self.table_name = table_name
+        self.max_retries = max_retries
+        self.buffer = []
+        self.written = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
+    def put(self, item):
+        self.buffer.append(item)
+        if len(self.buffer) >= BATCH_WRITE_MAX_ITEMS:
+            self.flush()
+
+    def flush(self):
+        while self.buffer:
+            batch = self.buffer[:BATCH_WRITE_MAX_ITEMS]
+            self.buffer = self.buffer[BATCH_WRITE_MAX_ITEMS:]
+            self._write_batch(batch)
+
+    def get_items(self, keys, attributes):
+        """
+        Read the given attributes of the existing items among keys with BatchGetItem, 100 keys per request,
+        retrying unprocessed keys with backoff. Returns a list of the items found, with their key attributes.
+        """
+        names = {f"#a{position}": name for position, name in enumerate(['indexName', 'id', *attributes])}
+        items = []
+        for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+            request = {self.table_name: {
+                'Keys': keys[start:start + BATCH_GET_MAX_KEYS],
+                'ProjectionExpression': ', '.join(names),
+                'ExpressionAttributeNames': names
+            }}
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    time.sleep(_backoff(attempt))
+                response = self.client.batch_get_item(RequestItems=request)
+                items.extend(response.get('Responses', {}).get(self.table_name, []))
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+            if request:
+                raise RuntimeError(f"Error reading items from DynamoDB: keys still unprocessed after {self.max_retries} retries")
+        return items
+
+    def _write_batch(self, items):
+        requests = [{'PutRequest': {'Item': item}} for item in items]
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(_backoff(attempt))
+
+            try:
+                response = self.client.batch_write_item(RequestItems={self.table_name: requests})
+            except Exception as e:
+                print(f"Error writing batch to DynamoDB, writing items individually: {e}")
+                self._write_items_individually([request['PutRequest']['Item'] for request in requests])
+                return
+
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            self.written += len(requests) - len(unprocessed)
+            if not unprocessed:
+                return
+            requests = unprocessed
+
+        self.failed += len(requests)
+        print(f"Error storing {len(requests)} items in DynamoDB: still unprocessed after {self.max_retries} retries")
+
+    def _write_items_individually(self, items):
+        for item in items:
+            try:
+                self.table.put_item(Item=item)
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error storing result in DynamoDB: {str(e)}")
+
+def store_items(processing_queue, index_name, documents, excluded_fields=()):
+    """
+    Store indexed documents as ProcessingQueue items keyed by their itemId, without the excluded fields (e.g.
+    embeddings) and null values, returning the number stored. An item written again (e.g. a row changed by an
+    upsert, or a chunk written twice) replaces the previous one but keeps its createdAt and groupId.
+    """
+    timestamp = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+    keys = [{'indexName': index_name, 'id': item_id} for item_id in dict.fromkeys(document['itemId'] for document in documents)]
+    existing = {item['id']: item for item in processing_queue.get_items(keys, PRESERVED_ATTRIBUTES)} if keys else {}
+    stored_before = processing_queue.written
+    for document in documents:
+        item = {
+            field: value for field, value in document.items()
+            if field not in excluded_fields and field != 'itemId' and value is not None
+        }
+
+        # Add deterministic ID and timestamps, so a chunk written twice overwrites the same items
+        item['indexName'] = index_name
+        item['id'] = document['itemId']
+        previous = existing.get(item['id'], {})
+        item['createdAt'] = previous.get('createdAt', timestamp)
+        item['updatedAt'] = timestamp
+        # a groupId column of the row itself takes precedence over the stored group
+        if 'groupId' in previous:
+            item.setdefault('groupId', previous['groupId'])
+
+        processing_queue.put(item)
+    processing_queue.flush()
+    return processing_queue.written - stored_before
+
+def _backoff(attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BATCH_WRITE_INITIAL_BACKOFF_SECONDS * 2 ** attempt, BATCH_WRITE_MAX_BACKOFF_SECONDS))
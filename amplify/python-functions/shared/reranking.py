@@ -0,0 +1,211 @@
+import copy
+import os
+from .rescoring import RESCORE_VECTOR_SOURCE_EXCLUDES
+
+# Nearest neighbours fetched per vector field for local reranking, and the most a request may ask for
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', 100))
+RERANK_MAX_CANDIDATES = int(os.environ.get('RERANK_MAX_CANDIDATES', 1000))
+
+# OpenSearch returns at most this many hits per search (index.max_result_window)
+MAX_RESULT_WINDOW = 10000
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("Local reranking requires numpy, add it to the function requirements")
+    return numpy
+
+def _clauses(query):
+    """(query type, function_score object) of the function_score clauses of a query built by build_query"""
+    for query_type in ['must', 'should']:
+        for subquery in query['query']['bool'].get(query_type, []):
+            if isinstance(subquery, dict) and 'function_score' in subquery:
+                yield query_type, subquery['function_score']
+
+def build_candidate_query(query, candidates=RERANK_CANDIDATES):
+    """
+    Derive the candidate search of a query built by build_query (with its vectors filled): every knn clause
+    returns its candidates nearest neighbours whatever their score, all clauses weigh 1, and the documents come
+    with their vectors. Thresholds and weights are applied by rerank_candidates, so the same candidates can be
+    reranked for other weights and thresholds.
+
+    Returns a tuple (candidate query, vector fields searched).
+    """
+    candidate_query = copy.deepcopy(query)
+    vector_fields = []
+    for _, function_score in _clauses(candidate_query):
+        function_score['weight'] = 1.0
+        knn_obj = function_score['query'].get('knn')
+        if isinstance(knn_obj, dict):
+            vector_field = next(iter(knn_obj))
+            options = knn_obj[vector_field]
+            options.pop('min_score', None)
+            options.pop('max_distance', None)
+            options['k'] = candidates
+            vector_fields.append(vector_field)
+
+    candidate_query.pop('explain', None)
+    # candidates are ranked on the vectors of the index, the float vectors kept for rescoring are not needed
+    candidate_query['_source'] = {'excludes': list(RESCORE_VECTOR_SOURCE_EXCLUDES)}
+    candidate_query['size'] = min(candidates * max(1, len(vector_fields)), MAX_RESULT_WINDOW)
+    return candidate_query, vector_fields
+
+def knn_scores(np, vectors, query_vector, space_type, squared_norms=None):
+    """
+    Scores of a query vector against a matrix of vectors, as the OpenSearch knn engines compute them.
+    squared_norms of the vectors can be given when they are known, e.g. computed once for many queries.
+    """
+    if space_type == 'hamming':
+        differing = np.bitwise_xor(vectors.astype(np.int8).view(np.uint8), query_vector.astype(np.int8).view(np.uint8))
+        return 1 / (1 + np.unpackbits(differing, axis=1).sum(axis=1))
+
+    products = vectors @ query_vector
+    if squared_norms is None:
+        squared_norms = (vectors * vectors).sum(axis=1)
+    if space_type == 'cosinesimil':
+        norms = np.sqrt(squared_norms) * np.linalg.norm(query_vector)
+        cosines = np.divide(products, norms, out=np.zeros_like(products), where=norms > 0)
+        return (1 + cosines) / 2
+    if space_type == 'innerproduct':
+        return np.where(products >= 0, 1 + products, 1 / (1 - np.minimum(products, 0)))
+    squared_distances = np.maximum(squared_norms - 2 * products + query_vector @ query_vector, 0)
+    return 1 / (1 + squared_distances)
+
+def score_candidates(response, query, space_type='l2'):
+    """
+    Compute the knn score of every candidate of a candidate search for every vector field of the query, from
+    the vectors returned with the candidates, all candidates of a field at once.
+
+    The BM25 score of every term clause is kept from the named query scores of the search (where clauses weigh 1),
+    by field and value, so it does not depend on the clause names of the query.
+
+    Returns {'hits': candidates without their vectors, 'fieldScores': {vector field: [score or None per hit]},
+    'termScores': {field:value: [score or None per hit]}}, the candidates to keep for rerank_candidates.
+    """
+    np = _numpy()
+    hits = response['hits']['hits']
+    field_scores = {}
+    term_scores = {}
+    for _, function_score in _clauses(query):
+        term = function_score['query'].get('term')
+        if isinstance(term, dict):
+            field, value = _term_clause(term)
+            name = function_score.get('_name')
+            term_scores[_term_key(field, value)] = [
+                hit['matched_queries'].get(name) if name and isinstance(hit.get('matched_queries'), dict) else None for hit in hits
+            ]
+            continue
+
+        knn_obj = function_score['query'].get('knn')
+        if not isinstance(knn_obj, dict):
+            continue
+        vector_field = next(iter(knn_obj))
+        query_vector = knn_obj[vector_field].get('vector')
+        if not isinstance(query_vector, list):
+            continue
+
+        present = [position for position, hit in enumerate(hits) if isinstance((hit.get('_source') or {}).get(vector_field), list)]
+        scores = [None] * len(hits)
+        if present:
+            vectors = np.asarray([hits[position]['_source'][vector_field] for position in present], dtype=np.float32)
+            for position, score in zip(present, knn_scores(np, vectors, np.asarray(query_vector, dtype=np.float32), space_type).tolist()):
+                scores[position] = score
+        field_scores[vector_field] = scores
+
+    candidates = []
+    for hit in hits:
+        source = {field: value for field, value in (hit.get('_source') or {}).items() if not field.endswith('Embedding')}
+        candidates.append({'_index': hit.get('_index'), '_id': hit.get('_id'), '_source': source})
+    return {'hits': candidates, 'fieldScores': field_scores, 'termScores': term_scores}
+
+def _term_clause(term):
+    """(field, value) of a term query"""
+    field, value = next(iter(term.items()))
+    if isinstance(value, dict):
+        value = value.get('value')
+    return field, value
+
+def _term_key(field, value):
+    return f"{field}:{value}"
+
+def _term_matches(document_value, value):
+    """Whether a term query on value matches a document value, a list matching when any of its elements does"""
+    values = document_value if isinstance(document_value, list) else [document_value]
+    return any(element is not None and str(element) == str(value) for element in values)
+
+def rerank_candidates(candidates, query, size):
+    """
+    Score candidates from score_candidates with the clauses of a query built by build_query, the way the search
+    would: a knn clause adds weight * its knn score when the score reaches its min_score, a term clause adds
+    weight * its BM25 score when the candidate has the value. BM25 scores are those OpenSearch gave the candidate
+    search; a term clause without one (e.g. candidates cached before they were kept) adds its weight, as a
+    constant score. Candidates failing a must clause or matching no clause are dropped.
+
+    Returns a search response of the first size candidates, with the score of each named clause in matched_queries.
+    The candidates are not modified, so they can be reranked again.
+    """
+    np = _numpy()
+    hits = candidates['hits']
+    count = len(hits)
+    totals = np.zeros(count)
+    matched = np.zeros(count, dtype=bool)
+    required = np.ones(count, dtype=bool)
+    named = []
+
+    for query_type, function_score in _clauses(query):
+        weight = float(function_score.get('weight', 1.0))
+        clause = function_score['query']
+        if isinstance(clause.get('knn'), dict):
+            vector_field = next(iter(clause['knn']))
+            scores = np.asarray([np.nan if score is None else score for score in candidates['fieldScores'].get(vector_field, [None] * count)], dtype=float)
+            min_score = clause['knn'][vector_field].get('min_score')
+            passes = ~np.isnan(scores) & (scores >= (float(min_score) if min_score is not None else -np.inf))
+            contributions = np.where(passes, weight * np.nan_to_num(scores), 0.0)
+        elif isinstance(clause.get('term'), dict):
+            field, value = _term_clause(clause['term'])
+            passes = np.asarray([_term_matches(hit['_source'].get(field), value) for hit in hits], dtype=bool)
+            term_scores = (candidates.get('termScores') or {}).get(_term_key(field, value)) or [None] * count
+            scores = np.asarray([1.0 if score is None else score for score in term_scores], dtype=float)
+            contributions = np.where(passes, weight * scores, 0.0)
+        else:
+            continue
+
+        if query_type == 'must':
+            required &= passes
+        matched |= passes
+        totals += contributions
+        named.append((function_score.get('_name'), passes, contributions))
+
+    kept = np.flatnonzero(required & matched)
+    order = kept[np.argsort(-totals[kept], kind='stable')][:size]
+
+    ranked = []
+    for position in order.tolist():
+        hit = hits[position]
+        ranked.append({
+            '_index': hit['_index'],
+            '_id': hit['_id'],
+            '_score': float(totals[position]),
+            '_source': dict(hit['_source']),
+            'matched_queries': {name: float(contributions[position]) for name, passes, contributions in named if name and passes[position]}
+        })
+    return {
+        'hits': {
+            'total': {'value': len(kept), 'relation': 'eq'},
+            'max_score': ranked[0]['_score'] if ranked else None,
+            'hits': ranked
+        }
+    }
+
+def candidate_fingerprint_query(query):
+    """Copy of a query built by build_query without its weights and thresholds, for the cache key of its candidates"""
+    stripped = copy.deepcopy(query)
+    for _, function_score in _clauses(stripped):
+        function_score.pop('weight', None)
+        function_score.pop('_name', None)
+        knn_obj = function_score['query'].get('knn')
+        if isinstance(knn_obj, dict):
+            knn_obj[next(iter(knn_obj))].pop('min_score', None)
+    stripped.pop('size', None)
+    return stripped
@@ -0,0 +1,96 @@
+import base64
+import math
+import operator
+import os
+import struct
+from .embeddings import embed_texts
+
+# Searches of indexes storing compact vectors fetch this many times the requested number of results,
+# which are then reordered with float vectors and cut back to the requested number
+RESCORE_OVERSAMPLE = int(os.environ.get('RESCORE_OVERSAMPLE', 3))
+
+# Documents of indexes storing compact vectors keep the float vector of each vector field, as float16 in a
+# binary field (stored in _source, not indexed) named after the field, e.g. titleRescoreVector
+RESCORE_VECTOR_SUFFIX = 'RescoreVector'
+RESCORE_VECTOR_SOURCE_EXCLUDES = [f'*{RESCORE_VECTOR_SUFFIX}']
+RESCORE_VECTOR_MAPPING = {"type": "binary"}
+
+def rescore_vector_field(field):
+    """Field of the float vector of a vector field (e.g. title or titleEmbedding) kept for rescoring"""
+    return f"{field.removesuffix('Embedding')}{RESCORE_VECTOR_SUFFIX}"
+
+def encode_rescore_vector(vector):
+    """Encode a float vector as base64 float16, the value of its rescore vector field"""
+    return base64.b64encode(struct.pack(f'<{len(vector)}e', *vector)).decode('ascii')
+
+def decode_rescore_vector(value):
+    data = base64.b64decode(value)
+    return list(struct.unpack(f'<{len(data) // 2}e', data))
+
+def cosine_similarity(a, b):
+    norms = math.sqrt(sum(x * x for x in a) * sum(y * y for y in b))
+    return sum(map(operator.mul, a, b)) / norms if norms else 0.0
+
+def include_rescore_vectors(query):
+    """Have a search lean query (see make_lean_query) return the rescore vectors of its hits. Updates the query in place."""
+    source = query.get('_source')
+    if isinstance(source, dict) and 'excludes' in source:
+        source['excludes'] = [field for field in source['excludes'] if field not in RESCORE_VECTOR_SOURCE_EXCLUDES]
+    return query
+
+def get_knn_clauses(query):
+    """Name and weight of the knn clauses of a query built by build_query, by vector field"""
+    clauses = {}
+    for query_type in ['must', 'should']:
+        for subquery in query['query']['bool'].get(query_type, []):
+            if not isinstance(subquery, dict) or 'function_score' not in subquery:
+                continue
+            knn_obj = subquery['function_score']['query'].get('knn')
+            if isinstance(knn_obj, dict):
+                clauses[next(iter(knn_obj))] = (subquery['function_score'].get('_name'), subquery['function_score'].get('weight', 1))
+    return clauses
+
+def rescore_search_response(bedrock_runtime, response, query, pending_vectors, size, cache=None):
+    """
+    Reorder the hits of a search on compact (int8 or binary) vectors with float vectors, and keep the first size.
+
+    The score each knn clause contributed to a hit, known from the named query scores of the search, is replaced
+    by weight * (1 + cos) / 2 (the cosinesimil score) of the float vectors of the query texts and of the document,
+    read from the rescore vector fields the search returned (see include_rescore_vectors). Query vectors come
+    from the embedding cache, where embedding the compact query vectors stored them; documents are never embedded
+    here. Hits without a rescore vector for a clause (e.g. indexed before they were stored) or without named query
+    scores (e.g. from _msearch) keep the score of that clause. The rescore vectors are removed from the hits.
+    Updates the response in place and returns it.
+    """
+    hits = response['hits']['hits']
+    clauses = get_knn_clauses(query)
+    stored_vectors = []
+    for hit in hits:
+        source = hit.get('_source') or {}
+        stored_vectors.append({field: source.pop(field) for field in list(source) if field.endswith(RESCORE_VECTOR_SUFFIX)})
+    if not hits or not clauses:
+        del hits[size:]
+        return response
+
+    # float vectors of the query texts, cached when their compact vectors were embedded
+    query_texts = {vector_field: str(value) for _, vector_field, value in pending_vectors}
+    fields = list(query_texts)
+    query_embeddings, _ = embed_texts(bedrock_runtime, [query_texts[field] for field in fields], cache=cache)
+    query_vectors = {field: vector for field, vector in zip(fields, query_embeddings) if vector is not None}
+
+    for hit, vectors in zip(hits, stored_vectors):
+        matched_queries = hit.get('matched_queries')
+        if not isinstance(matched_queries, dict):
+            continue
+        for vector_field, (name, weight) in clauses.items():
+            value = vectors.get(rescore_vector_field(vector_field))
+            if name not in matched_queries or vector_field not in query_vectors or not value:
+                continue
+            score = float(weight) * (1 + cosine_similarity(query_vectors[vector_field], decode_rescore_vector(value))) / 2
+            hit['_score'] += score - matched_queries[name]
+            matched_queries[name] = score
+
+    hits.sort(key=lambda hit: hit['_score'] or 0, reverse=True)
+    del hits[size:]
+    response['hits']['max_score'] = hits[0]['_score'] if hits else None
+    return response
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import time
+from .embedding_cache import LRUCache, normalize_text
+
+# Number of search results kept in memory by each execution environment
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 500))
+
+# Cached results are served for at most this long, even when the index generation is unchanged
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', 600))
+
+# OpenSearch Serverless makes new documents searchable some seconds after they are written, so results
+# are not cached for this long after the index generation changed
+RESULT_CACHE_SETTLE_SECONDS = int(os.environ.get('RESULT_CACHE_SETTLE_SECONDS', 60))
+
+def query_fingerprint(query, pending_vectors=(), **options):
+    """
+    Fingerprint of a query built by build_query, before its vectors are filled: the query with the texts waiting
+    to be embedded (normalized the same way as for the embedding cache) and any other option changing the answer.
+    Identical lookups share a fingerprint whatever the key order of the search config.
+    """
+    texts = [[vector_field, normalize_text(value)] for _, vector_field, value in pending_vectors]
+    canonical = json.dumps({'query': query, 'texts': texts, 'options': options}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def get_index_generation(table, index_name):
+    """
+    Current generation of an index and the time it was last bumped, from its IndexConfig item.
+    Returns (0, 0) for indexes that have never been bumped.
+    """
+    response = table.get_item(
+        Key={'indexName': index_name},
+        ProjectionExpression='indexGeneration, indexGenerationUpdatedAt',
+        ConsistentRead=True
+    )
+    item = response.get('Item') or {}
+    return int(item.get('indexGeneration', 0)), float(item.get('indexGenerationUpdatedAt', 0))
+
+def bump_index_generation(table, index_name):
+    """
+    Move an index to its next generation after writing to it, so results cached for the previous generation
+    are no longer served. Indexes without an IndexConfig item are left alone. Never raises.
+    """
+    try:
+        table.update_item(
+            Key={'indexName': index_name},
+            UpdateExpression='ADD indexGeneration :one SET indexGenerationUpdatedAt = :now',
+            ConditionExpression='attribute_exists(indexName)',
+            ExpressionAttributeValues={':one': 1, ':now': int(time.time())}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        print(f"No index config for {index_name}, its generation is not tracked")
+    except Exception as e:
+        print(f"Error bumping index generation of {index_name}: {e}")
+
+class QueryResultCache:
+    """
+    In-process cache of search results keyed by (index name, index generation, query fingerprint),
+    with a TTL and least recently used eviction.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl_seconds=RESULT_CACHE_TTL_SECONDS):
+        self.entries = LRUCache(max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, index_name, generation, fingerprint):
+        entry = self.entries.get((index_name, generation, fingerprint))
+        if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, index_name, generation, fingerprint, result):
+        self.entries.put((index_name, generation, fingerprint), (time.time(), result))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'hitRate': round(self.hits / lookups, 3) if lookups else 0,
+            'entries': len(self.entries),
+        }
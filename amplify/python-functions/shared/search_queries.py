@@ -0,0 +1,230 @@
+import copy
+import json
+from .embeddings import embed_texts
+from .rescoring import RESCORE_VECTOR_SOURCE_EXCLUDES
+
+# Fields holding comma-separated lists of names, indexed and embedded with duplicate names removed
+PEOPLE_FIELDS = ['producers', 'directors', 'writers', 'actors']
+
+# Vector fields (and the float vectors kept for rescoring) are only used by the search itself and are never
+# returned to the caller
+EMBEDDING_SOURCE_EXCLUDES = ['*Embedding', *RESCORE_VECTOR_SOURCE_EXCLUDES]
+
+# append indexes every row of an uploaded file as a new item; upsert keys rows by a key column (or their
+# content) so uploading a file again only writes the rows that changed
+INGEST_MODES = ['append', 'upsert']
+
+def parse_search_config(opensearch_query):
+    """Get the search config of an index config, parsing it when it is stored as a JSON string"""
+    query = opensearch_query.get("searchConfig")
+
+    # If searchConfig is a string, parse it as JSON
+    if isinstance(query, str):
+        try:
+            query = json.loads(query)
+        except json.JSONDecodeError as e:
+            print(f"Failed to parse searchConfig JSON string: {e}")
+            raise ValueError(f"Invalid JSON in searchConfig: {e}")
+    return query
+
+def to_camel_case(snake_str):
+    """Convert snake_case to camelCase"""
+    components = snake_str.replace('_', ' ').split(' ')
+    components = [comp for comp in components if comp]
+    if not components:
+        return snake_str.lower()
+    return components[0].lower() + ''.join(word.capitalize() for word in components[1:])
+
+def get_embedding_type(index_config):
+    """Type of the vectors stored by an index, float for indexes created before compact embeddings"""
+    return (index_config or {}).get('embeddingType') or 'float'
+
+def get_search_backend(index_config):
+    """Backend answering the searches of an index: opensearch, or local for in-process search of its snapshot"""
+    return (index_config or {}).get('searchBackend') or 'opensearch'
+
+def get_ingest_mode(index_config):
+    """How ingestItems writes the rows of a file into an index, append for indexes created before upserts"""
+    return (index_config or {}).get('ingestMode') or 'append'
+
+def get_space_type(index_config):
+    """Space type of the vector fields of an index, l2 for indexes created before index profiles"""
+    return ((index_config or {}).get('indexProfile') or {}).get('spaceType') or 'l2'
+
+def get_identifier_fields(index_config):
+    """Document fields of the EXACT fields of an index config marked as identifiers (e.g. EIDR or IMDb ids)"""
+    return [to_camel_case(field) for field in (index_config or {}).get('identifierFieldList') or []]
+
+def build_query(search_config, source_item):
+    """
+    Fill a copy of the search config with the values of a source item. Clauses on fields the item has
+    no value for are removed.
+
+    Returns a tuple (query, pending_vectors) where pending_vectors lists the knn clauses still waiting
+    for their query vector, as (knn_obj, vector field, text to embed), to be filled by fill_query_vectors.
+    """
+    query = copy.deepcopy(search_config)
+
+    # knn clauses waiting for their query vector, as (knn_obj, vector field, text to embed)
+    pending_vectors = []
+
+    for query_type in ['must', 'should']:
+        if query_type not in query['query']['bool']:
+            continue
+
+        queries = query['query']['bool'][query_type]
+
+        for i in range(len(queries) - 1, -1, -1):
+            subquery = queries[i]
+            if not isinstance(subquery, dict) or 'function_score' not in subquery:
+                continue
+
+            function_score_query = subquery['function_score']['query']
+
+            if 'knn' in function_score_query:
+                # Handle KNN queries
+                knn_obj = function_score_query['knn']
+                if not isinstance(knn_obj, dict):
+                    continue
+
+                first_key = next(iter(knn_obj)) # e.g. actorsEmbedding
+                first_key_without_embedding = first_key.replace('Embedding', '') # e.g. actors
+
+                # Get the value and apply deduplication if needed
+                value = source_item.get(first_key_without_embedding)
+
+                if value == '' or value is None:
+                    queries.pop(i)
+                    continue
+
+                # some of these fields include a lot of duplicate names and are indexed and embedded with duplicates removed, so we need to remove here also
+                if first_key_without_embedding in PEOPLE_FIELDS:
+                    value = remove_duplicate_names(value)
+
+                # the vector is filled in once the values of all knn clauses are collected
+                pending_vectors.append((knn_obj, first_key, value))
+
+                # Add _name field for vector queries
+                if '_name' not in subquery['function_score']:
+                    subquery['function_score']['_name'] = f"{first_key}_function"
+
+            elif 'term' in function_score_query:
+                # Handle term queries
+                term_obj = function_score_query['term']
+                if not isinstance(term_obj, dict):
+                    continue
+
+                first_key = next(iter(term_obj))
+                field_value = source_item.get(first_key)
+
+                # Don't try to look for similarity if the source record doesn't have a value
+                if field_value == '' or field_value is None:
+                    queries.pop(i)
+                    continue
+
+                term_obj[first_key] = field_value
+
+                # Add _name field for exact queries
+                if '_name' not in subquery['function_score']:
+                    subquery['function_score']['_name'] = f"{first_key}_function"
+
+    return query, pending_vectors
+
+def build_identifier_query(query, identifier_fields, source_item_id=None):
+    """
+    Derive an exact identifier lookup from a query built by build_query: only its term clauses on identifier
+    fields are kept, so the lookup is answered from the keyword index without embeddings or knn search.
+    The source item itself is excluded, as it always matches its own identifiers.
+
+    Returns None when the source item has no value for any identifier field.
+    """
+    identifier_clauses = []
+    for query_type in ['must', 'should']:
+        for subquery in query['query']['bool'].get(query_type, []):
+            if not isinstance(subquery, dict) or 'function_score' not in subquery:
+                continue
+            term_obj = subquery['function_score']['query'].get('term')
+            if isinstance(term_obj, dict) and next(iter(term_obj), None) in identifier_fields:
+                identifier_clauses.append(subquery)
+
+    if not identifier_clauses:
+        return None
+
+    bool_query = {
+        "should": identifier_clauses,
+        "minimum_should_match": 1
+    }
+    if source_item_id:
+        bool_query["must_not"] = [{"term": {"itemId": source_item_id}}]
+
+    identifier_query = {key: value for key, value in query.items() if key not in ['query', 'explain']}
+    identifier_query['query'] = {"bool": bool_query}
+    return identifier_query
+
+def make_lean_query(query, explain=False):
+    """
+    Trim what a query asks OpenSearch to send back: the explain tree is dropped unless explain is set, and the
+    embedding fields are excluded from _source so their vectors are neither fetched nor transferred. Queries
+    already selecting their _source fields are left as they are. Updates the query in place and returns it.
+    """
+    if explain:
+        query['explain'] = True
+    else:
+        query.pop('explain', None)
+
+    source = query.get('_source', True)
+    if source is True:
+        query['_source'] = {'excludes': list(EMBEDDING_SOURCE_EXCLUDES)}
+    elif isinstance(source, dict) and 'includes' not in source:
+        excludes = source.get('excludes') or []
+        source['excludes'] = list(excludes) + [field for field in EMBEDDING_SOURCE_EXCLUDES if field not in excludes]
+    return query
+
+def get_score_breakdown(hit):
+    """
+    Compact per-clause view of a hit's score, from the named clauses it matched: {field: score}, e.g.
+    {'title': 0.93, 'eidr': 1.0}. Scores are None when the search was not asked for named query scores.
+    """
+    matched_queries = hit.get('matched_queries') or {}
+    if isinstance(matched_queries, list):
+        matched_queries = dict.fromkeys(matched_queries)
+    return {
+        name.removesuffix('_function').removesuffix('Embedding'): score
+        for name, score in matched_queries.items()
+    }
+
+def fill_query_vectors(bedrock_runtime, pending_vectors, cache=None, limiter=None, embedding_type='float'):
+    """
+    Embed the values of all pending knn clauses with as few batched calls as possible, from the cache or Bedrock,
+    embedded the same way as at ingest so cached vectors are shared. embedding_type is the one of the index.
+
+    Returns a dict of position in pending_vectors -> error message for the clauses that could not be embedded.
+    """
+    if not pending_vectors:
+        return {}
+
+    embeddings, errors = embed_texts(
+        bedrock_runtime, [str(value) for _, _, value in pending_vectors], cache=cache, limiter=limiter, embedding_type=embedding_type
+    )
+    for (knn_obj, vector_field, _), embedding in zip(pending_vectors, embeddings):
+        if embedding is not None:
+            knn_obj[vector_field]['vector'] = embedding
+    return errors
+
+def remove_duplicate_names(csv_string):
+    """
+    Removes duplicate names from a comma-separated string while preserving order.
+    """
+    if not csv_string or not csv_string.strip():
+        return csv_string
+
+    names = [name.strip() for name in csv_string.split(',') if name.strip()]
+    seen = set()
+    unique_names = []
+
+    for name in names:
+        if name not in seen:
+            seen.add(name)
+            unique_names.append(name)
+
+    return ', '.join(unique_names)
@@ -0,0 +1,102 @@
+"""
+AdaptiveConcurrencyLimiter: the limit grows by one after increase_after consecutive successes, up to maximum,
+is halved on every throttle, down to minimum, and acquire() waits while the limit is reached.
+
+Run from amplify/python-functions with: python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.concurrency import AdaptiveConcurrencyLimiter
+
+def complete(limiter, throttled=False):
+    limiter.acquire()
+    limiter.release(throttled=throttled)
+
+class AdaptiveConcurrencyLimiterTest(unittest.TestCase):
+
+    def test_initial_limit_is_clamped(self):
+        self.assertEqual(AdaptiveConcurrencyLimiter(initial=0, minimum=1, maximum=4).limit, 1)
+        self.assertEqual(AdaptiveConcurrencyLimiter(initial=10, minimum=1, maximum=4).limit, 4)
+
+    def test_additive_increase(self):
+        limiter = AdaptiveConcurrencyLimiter(initial=2, maximum=4, increase_after=3)
+        for _ in range(2):
+            complete(limiter)
+        self.assertEqual(limiter.limit, 2)
+        complete(limiter)
+        self.assertEqual(limiter.limit, 3)
+        for _ in range(30):
+            complete(limiter)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.peak_limit, 4)
+
+    def test_multiplicative_decrease(self):
+        limiter = AdaptiveConcurrencyLimiter(initial=8, minimum=2, maximum=16, increase_after=2)
+        complete(limiter)
+        complete(limiter, throttled=True)
+        self.assertEqual(limiter.limit, 4)
+        # a throttle resets the successes counted towards the next increase
+        complete(limiter)
+        self.assertEqual(limiter.limit, 4)
+        complete(limiter)
+        self.assertEqual(limiter.limit, 5)
+        for _ in range(3):
+            complete(limiter, throttled=True)
+        self.assertEqual(limiter.limit, 2)
+
+        stats = limiter.stats()
+        self.assertEqual(stats['requests'], 7)
+        self.assertEqual(stats['throttles'], 4)
+        self.assertEqual(stats['concurrencyLimit'], 2)
+        self.assertEqual(stats['peakConcurrencyLimit'], 8)
+
+    def test_acquire_waits_for_a_slot(self):
+        limiter = AdaptiveConcurrencyLimiter(initial=2, maximum=2)
+        limiter.acquire()
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release()
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+        self.assertEqual(limiter.in_flight, 2)
+
+    def test_in_flight_never_exceeds_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial=3, maximum=3)
+        lock = threading.Lock()
+        counts = {'in_flight': 0, 'peak': 0}
+
+        def request():
+            limiter.acquire()
+            with lock:
+                counts['in_flight'] += 1
+                counts['peak'] = max(counts['peak'], counts['in_flight'])
+            time.sleep(0.005)
+            with lock:
+                counts['in_flight'] -= 1
+            limiter.release()
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(counts['peak'], 3)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.stats()['requests'], 20)
+
+if __name__ == '__main__':
+    unittest.main()
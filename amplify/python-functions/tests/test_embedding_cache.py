@@ -0,0 +1,127 @@
+"""
+Embedding cache keys and tiers: texts differing only by whitespace or Unicode composition share a key, float
+vectors keep the keys of before embedding types, the LRU evicts the least recently used vectors, and vectors
+found in the persistent store are promoted to memory. embed_texts embeds each normalized text once and only
+sends the texts the cache does not have.
+
+Run from amplify/python-functions with: python -m unittest discover tests
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.embedding_cache import (
+    EmbeddingCache, LRUCache, SQLiteEmbeddingStore, cache_key, decode_vector, encode_vector, normalize_text
+)
+from shared.embeddings import EMBEDDING_MODEL_ID, embed_texts
+
+class FakeBedrockRuntime:
+    """Embeds a text as [len(text), number of spaces], recording the texts of every request"""
+
+    def __init__(self):
+        self.requests = []
+
+    def invoke_model(self, modelId, body):
+        texts = json.loads(body)['texts']
+        self.requests.append(texts)
+        embeddings = [[float(len(text)), float(text.count(' '))] for text in texts]
+        return {'body': io.BytesIO(json.dumps({'embeddings': embeddings}).encode('utf-8'))}
+
+class KeyTest(unittest.TestCase):
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text('  The\tLong \n Goodbye '), 'The Long Goodbye')
+        # decomposed and composed forms of the same characters
+        self.assertEqual(normalize_text('Cafe\u0301'), normalize_text('Caf\u00e9'))
+        self.assertEqual(normalize_text(1984), '1984')
+
+    def test_float_keys_are_unchanged(self):
+        expected = hashlib.sha256(f"{EMBEDDING_MODEL_ID}\nsearch_document\nAmélie".encode('utf-8')).hexdigest()
+        self.assertEqual(cache_key(EMBEDDING_MODEL_ID, 'search_document', 'Amélie'), expected)
+        self.assertEqual(cache_key(EMBEDDING_MODEL_ID, 'search_document', 'Amélie', 'float'), expected)
+
+    def test_keys_differ_by_input_and_embedding_type(self):
+        keys = {
+            cache_key(EMBEDDING_MODEL_ID, input_type, 'Heat', embedding_type)
+            for input_type in ['search_document', 'search_query']
+            for embedding_type in ['float', 'int8', 'binary']
+        }
+        self.assertEqual(len(keys), 6)
+
+    def test_vector_encoding(self):
+        vector = [0.5, -1.25, 3.0]
+        self.assertEqual(decode_vector(encode_vector(vector)), vector)
+        self.assertEqual(len(encode_vector(vector)), 12)
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_lru_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', [1.0])
+        cache.put('b', [2.0])
+        cache.get('a')
+        cache.put('c', [3.0])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), [1.0])
+        self.assertEqual(len(cache), 2)
+
+        disabled = LRUCache(0)
+        disabled.put('a', [1.0])
+        self.assertEqual(len(disabled), 0)
+
+    def test_store_hits_are_promoted_to_memory(self):
+        store = SQLiteEmbeddingStore(os.path.join(self.directory, 'cache.db'))
+        EmbeddingCache(store).put_many({'a': [1.0, 2.0], 'b': [3.0, 4.0]})
+
+        cache = EmbeddingCache(store)
+        self.assertEqual(cache.get_many(['a', 'c']), {'a': [1.0, 2.0]})
+        self.assertEqual(cache.get_many(['a']), {'a': [1.0, 2.0]})
+        stats = cache.stats()
+        self.assertEqual((stats['storeHits'], stats['memoryHits'], stats['misses']), (1, 1, 1))
+        self.assertEqual(stats['memoryEntries'], 1)
+
+    def test_sqlite_store_evicts_least_recently_used(self):
+        store = SQLiteEmbeddingStore(os.path.join(self.directory, 'cache.db'), max_entries=2)
+        store.put_many({'a': [1.0]})
+        store.put_many({'b': [2.0]})
+        store.get_many(['a'])
+        store.put_many({'c': [3.0]})
+        self.assertEqual(set(store.get_many(['a', 'b', 'c'])), {'a', 'c'})
+
+class EmbedTextsTest(unittest.TestCase):
+
+    def test_identical_texts_are_embedded_once(self):
+        bedrock_runtime = FakeBedrockRuntime()
+        embeddings, errors = embed_texts(bedrock_runtime, ['Heat', ' Heat ', 'Ronin', 'Heat'])
+        self.assertEqual(errors, {})
+        self.assertEqual(bedrock_runtime.requests, [['Heat', 'Ronin']])
+        self.assertEqual(embeddings, [[4.0, 0.0], [4.0, 0.0], [5.0, 0.0], [4.0, 0.0]])
+
+    def test_cached_texts_are_not_sent(self):
+        bedrock_runtime = FakeBedrockRuntime()
+        cache = EmbeddingCache()
+        embed_texts(bedrock_runtime, ['Heat', 'Ronin'], cache=cache)
+        embeddings, _ = embed_texts(bedrock_runtime, ['Ronin', 'The  Thing', 'Heat'], cache=cache)
+        self.assertEqual(bedrock_runtime.requests, [['Heat', 'Ronin'], ['The Thing']])
+        self.assertEqual(embeddings, [[5.0, 0.0], [9.0, 1.0], [4.0, 0.0]])
+
+    def test_batches_are_full(self):
+        bedrock_runtime = FakeBedrockRuntime()
+        embed_texts(bedrock_runtime, [f"title {position}" for position in range(10)], batch_size=4)
+        self.assertEqual([len(texts) for texts in bedrock_runtime.requests], [4, 4, 2])
+
+if __name__ == '__main__':
+    unittest.main()
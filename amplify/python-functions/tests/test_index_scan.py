@@ -0,0 +1,102 @@
+"""
+iter_item_documents pages an index with search_after on itemId, where all the documents of an item id share one
+sort value. Every item id must be yielded once with all its documents, also when they straddle a page boundary
+or fill whole pages, and documents without an itemId are skipped.
+
+Run from amplify/python-functions with: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.index_scan import count_documents_without_item_id, iter_item_documents
+
+class SortedIndexClient:
+    """
+    OpenSearch client of one index answering the searches of index_scan the way OpenSearch does: hits in itemId
+    order, search_after skipping every document with a sort value up to the cursor, and at most size hits.
+    Documents of the same item id come back in the order they were added.
+    """
+
+    def __init__(self, documents):
+        self.documents = [(f"doc{position}", document) for position, document in enumerate(documents)]
+        self.searches = []
+
+    def count(self, index, body):
+        return {'count': sum(1 for _, document in self.documents if 'itemId' not in document)}
+
+    def search(self, index, body):
+        self.searches.append(body)
+        query = body['query']
+        documents = [(document_id, document) for document_id, document in self.documents if 'itemId' in document]
+        if 'term' in query:
+            documents = [(document_id, document) for document_id, document in documents if document['itemId'] == query['term']['itemId']]
+        documents.sort(key=lambda entry: entry[1]['itemId'])
+        if body.get('search_after'):
+            documents = [(document_id, document) for document_id, document in documents if document['itemId'] > body['search_after'][0]]
+        hits = [
+            {'_id': document_id, '_source': dict(document) if body['_source'] else {}, 'sort': [document['itemId']]}
+            for document_id, document in documents[:body['size']]
+        ]
+        return {'hits': {'hits': hits}}
+
+def scan(client, page_size, search_after=None):
+    return [
+        (item_id, sorted(hit['_id'] for hit in hits))
+        for item_id, hits in iter_item_documents(client, 'items', search_after=search_after, page_size=page_size)
+    ]
+
+def expected_scan(documents, after=None):
+    item_documents = {}
+    for position, document in enumerate(documents):
+        if 'itemId' in document and (after is None or document['itemId'] > after):
+            item_documents.setdefault(document['itemId'], []).append(f"doc{position}")
+    return [(item_id, sorted(document_ids)) for item_id, document_ids in sorted(item_documents.items())]
+
+# item ids with 1 to 4 documents each, and two documents without an itemId
+DOCUMENTS = (
+    [{'itemId': f"item{position:02d}", 'title': f"Title {position}"} for position in range(12) for _ in range(position % 4 + 1)]
+    + [{'title': 'Untitled'}, {'title': 'Untitled too'}]
+)
+
+class IterItemDocumentsTest(unittest.TestCase):
+
+    def test_every_page_size(self):
+        client = SortedIndexClient(DOCUMENTS)
+        expected = expected_scan(DOCUMENTS)
+        for page_size in range(1, len(DOCUMENTS) + 2):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(scan(client, page_size), expected)
+
+    def test_item_filling_whole_pages(self):
+        # one item id with more documents than a page, between items on both sides
+        documents = [{'itemId': 'a'}, *[{'itemId': 'b'}] * 7, {'itemId': 'c'}]
+        client = SortedIndexClient(documents)
+        for page_size in [2, 3, 4]:
+            with self.subTest(page_size=page_size):
+                self.assertEqual(scan(client, page_size), expected_scan(documents))
+
+    def test_resumes_after_cursor(self):
+        client = SortedIndexClient(DOCUMENTS)
+        self.assertEqual(scan(client, 4, search_after=['item05']), expected_scan(DOCUMENTS, after='item05'))
+
+    def test_empty_index(self):
+        client = SortedIndexClient([{'title': 'Untitled'}])
+        self.assertEqual(scan(client, 10), [])
+        self.assertEqual(count_documents_without_item_id(client, 'items'), 1)
+
+    def test_last_page_is_not_read_twice(self):
+        # a page shorter than page_size ends the scan without another search
+        client = SortedIndexClient([{'itemId': 'a'}, {'itemId': 'b'}, {'itemId': 'c'}])
+        scan(client, 5)
+        self.assertEqual(len(client.searches), 1)
+
+    def test_source_fields(self):
+        client = SortedIndexClient(DOCUMENTS)
+        for _, hits in iter_item_documents(client, 'items', source=False, page_size=5):
+            self.assertTrue(all(hit['_source'] == {} for hit in hits))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+Parity of the local search backend with OpenSearch, on a fixed index searched with the kind of queries
+build_query fills in (function_score clauses of knn with min_score and of term, with weights).
+
+The expected results are those OpenSearch returns for this index with one shard (l2 knn scores of
+1 / (1 + squared distance), BM25 scores for terms of keyword fields, times the clause weights, summed over the
+matching clauses), so the snapshot is checked against OpenSearch and not against the benchmark stand-in.
+
+Run from amplify/python-functions with: python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.local_search import LocalSearchIndex, compare_with_opensearch, write_snapshot
+
+INDEX_NAME = 'parity'
+
+# vectors exactly representable as float16, the type snapshots store float vectors as
+DOCUMENTS = [
+    {'itemId': 'a', 'studio': 'Acme', 'titleEmbedding': [0.0, 0.0]},
+    {'itemId': 'b', 'studio': 'Acme', 'titleEmbedding': [1.0, 0.0]},
+    {'itemId': 'c', 'studio': 'Bolt', 'titleEmbedding': [0.0, 2.0]},
+    {'itemId': 'd', 'studio': 'Bolt', 'titleEmbedding': [3.0, 0.0]},
+    {'itemId': 'e', 'studio': 'Crane', 'titleEmbedding': [1.0, 1.0]},
+    {'itemId': 'f', 'studio': 'Acme'},
+    {'itemId': 'g', 'titleEmbedding': [0.0, 1.0]},
+]
+
+MAPPING = {
+    'itemId': {'type': 'keyword'},
+    'studio': {'type': 'keyword'},
+    'titleEmbedding': {'type': 'knn_vector', 'dimension': 2, 'method': {'name': 'hnsw', 'space_type': 'l2', 'engine': 'faiss'}},
+}
+
+# BM25 scores of the studio terms: ln(1 + (6 - n + 0.5) / (n + 0.5)) / 2.2 for a term in n of the 6 documents with a studio
+ACME = 0.315067
+BOLT = 0.468009
+CRANE = 0.700202
+
+def knn_clause(vector, min_score, weight):
+    return {'function_score': {
+        'query': {'knn': {'titleEmbedding': {'vector': vector, 'min_score': min_score}}},
+        'weight': weight,
+        '_name': 'titleEmbedding_function'
+    }}
+
+def term_clause(value, weight):
+    return {'function_score': {'query': {'term': {'studio': value}}, 'weight': weight, '_name': 'studio_function'}}
+
+def search_query(should, must=()):
+    return {'query': {'bool': {'minimum_should_match': '0', 'must': list(must), 'should': list(should)}}}
+
+# (query, OpenSearch hits as (itemId, score) in score order)
+CASES = [
+    # knn scores from [0, 0]: a 1, b 0.5, g 0.5, e 1/3, c 0.2 and d 0.1 under min_score; f has no vector
+    (
+        search_query([knn_clause([0.0, 0.0], 0.3, 2.0), term_clause('Acme', 1.0)]),
+        [('a', 2 + ACME), ('b', 1 + ACME), ('g', 1.0), ('e', 2 / 3), ('f', ACME)]
+    ),
+    # knn scores from [1, 0]: b 1, a 0.5, e 0.5 reach min_score, c 1/6, d 0.2 and g 1/3 do not
+    (
+        search_query([knn_clause([1.0, 0.0], 0.4, 1.5), term_clause('Bolt', 2.0)]),
+        [('b', 1.5), ('c', 2 * BOLT), ('d', 2 * BOLT), ('a', 0.75), ('e', 0.75)]
+    ),
+    # a must clause restricts the matches, should clauses only add to their scores
+    (
+        search_query([knn_clause([0.0, 0.0], 0.2, 1.0)], must=[term_clause('Crane', 1.0)]),
+        [('e', CRANE + 1 / 3)]
+    ),
+    # no document reaches min_score and none has the term
+    (
+        search_query([knn_clause([10.0, 10.0], 0.5, 1.0), term_clause('Delta', 1.0)]),
+        []
+    ),
+]
+
+def query_key(query):
+    return repr(query['query'])
+
+class FixedIndexClient:
+    """
+    OpenSearch client of an index holding DOCUMENTS: answers the searches of write_snapshot (itemId order with
+    search_after), and the searches of the cases with their expected OpenSearch results.
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.indices = self
+
+    def get_mapping(self, index):
+        return {index: {'mappings': {'properties': MAPPING}}}
+
+    def count(self, index, body=None):
+        if body is not None:
+            # documents without an itemId
+            return {'count': 0}
+        return {'count': len(DOCUMENTS)}
+
+    def search(self, index, body):
+        if 'sort' in body:
+            documents = sorted(DOCUMENTS, key=lambda document: document['itemId'])
+            if 'term' in body['query']:
+                documents = [document for document in documents if document['itemId'] == body['query']['term']['itemId']]
+            if body.get('search_after'):
+                documents = [document for document in documents if document['itemId'] > body['search_after'][0]]
+            hits = [{'_id': document['itemId'], '_source': dict(document), 'sort': [document['itemId']]} for document in documents]
+            return {'hits': {'hits': hits[:body['size']]}}
+
+        hits = [{'_id': item_id, '_score': score, '_source': {'itemId': item_id}} for item_id, score in self.expected[query_key(body)]]
+        return {'hits': {'hits': hits[:body.get('size', 10)]}}
+
+class LocalSearchParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.client = FixedIndexClient({query_key(query): hits for query, hits in CASES})
+        write_snapshot(cls.client, INDEX_NAME, cls.directory, page_size=3)
+        cls.local_index = LocalSearchIndex(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def test_scores_match_opensearch(self):
+        for query, expected in CASES:
+            with self.subTest(query=query):
+                hits = self.local_index.search(body={**query, 'size': 10})['hits']['hits']
+                scores = {hit['_source']['itemId']: hit['_score'] for hit in hits}
+                self.assertEqual(set(scores), {item_id for item_id, _ in expected})
+                for item_id, score in expected:
+                    self.assertAlmostEqual(scores[item_id], score, delta=1e-3, msg=item_id)
+
+    def test_named_clause_scores(self):
+        query, _ = CASES[0]
+        hits = self.local_index.search(body={**query, 'size': 10})['hits']['hits']
+        matched = {hit['_source']['itemId']: hit.get('matched_queries', {}) for hit in hits}
+        self.assertAlmostEqual(matched['a']['titleEmbedding_function'], 2.0, delta=1e-3)
+        self.assertAlmostEqual(matched['a']['studio_function'], ACME, delta=1e-3)
+        self.assertEqual(set(matched['g']), {'titleEmbedding_function'})
+
+    def test_parity_report(self):
+        for size in [10, 3]:
+            with self.subTest(size=size):
+                report = compare_with_opensearch(self.client, self.local_index, [query for query, _ in CASES], size=size)
+                self.assertEqual(report['queries'], len(CASES))
+                self.assertEqual(report['recall'], 1.0)
+                self.assertLessEqual(report['maxScoreDifference'], 1e-3)
+
+    def test_parity_report_detects_differences(self):
+        query, expected = CASES[0]
+        # OpenSearch scoring the term clause with its weight only, as if it were a constant score query
+        constant_term = [(item_id, score - ACME + 1.0 if item_id in ('a', 'b', 'f') else score) for item_id, score in expected]
+        client = FixedIndexClient({query_key(query): sorted(constant_term, key=lambda hit: -hit[1])})
+        report = compare_with_opensearch(client, self.local_index, [query], size=10)
+        self.assertGreater(report['maxScoreDifference'], 1e-3)
+
+        # OpenSearch finding a document the snapshot does not
+        client = FixedIndexClient({query_key(query): expected[:1] + [('z', 1.5)] + expected[1:]})
+        report = compare_with_opensearch(client, self.local_index, [query], size=10)
+        self.assertLess(report['recall'], 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
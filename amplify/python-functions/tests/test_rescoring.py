@@ -0,0 +1,140 @@
+"""
+Rescoring of searches on compact vectors: the score of each knn clause of a hit is replaced by the cosinesimil
+score of the float vectors of the query text and of the document, the float vector stored with the document as
+float16 in its rescore vector field. Only query texts are embedded (from the cache), hits without a stored
+vector or without named query scores keep their scores, and the rescore vectors never reach the results.
+
+Run from amplify/python-functions with: python -m unittest discover tests
+"""
+import base64
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.embedding_cache import EmbeddingCache, cache_key
+from shared.embeddings import EMBEDDING_MODEL_ID
+from shared.rescoring import (
+    decode_rescore_vector, encode_rescore_vector, get_knn_clauses, include_rescore_vectors, rescore_search_response,
+    rescore_vector_field
+)
+from shared.search_queries import EMBEDDING_SOURCE_EXCLUDES
+
+class RecordingBedrockRuntime:
+    """Embeds every text as [1, 0], recording the texts of every request"""
+
+    def __init__(self):
+        self.requests = []
+
+    def invoke_model(self, modelId, body):
+        texts = json.loads(body)['texts']
+        self.requests.append(texts)
+        return {'body': io.BytesIO(json.dumps({'embeddings': [[1.0, 0.0] for _ in texts]}).encode('utf-8'))}
+
+def search_query():
+    knn = {'titleEmbedding': {'vector': [1, 0], 'k': 10}}
+    query = {
+        'size': 9,
+        '_source': {'excludes': list(EMBEDDING_SOURCE_EXCLUDES)},
+        'query': {'bool': {'should': [
+            {'function_score': {'query': {'knn': knn}, 'weight': 2.0, '_name': 'titleEmbedding_function'}},
+            {'function_score': {'query': {'term': {'studio': 'Acme'}}, 'weight': 1.0, '_name': 'studio_function'}},
+        ]}}
+    }
+    return query, [(knn['titleEmbedding'], 'titleEmbedding', 'Heat')]
+
+def hit(item_id, knn_score, vector=None, term_score=0.3):
+    source = {'itemId': item_id}
+    if vector is not None:
+        source['titleRescoreVector'] = encode_rescore_vector(vector)
+    return {
+        '_id': item_id,
+        '_score': knn_score + term_score,
+        '_source': source,
+        'matched_queries': {'titleEmbedding_function': knn_score, 'studio_function': term_score},
+    }
+
+def search_response():
+    return {'hits': {'max_score': 2.1, 'hits': [
+        # compact scores favour a, the float vectors favour b
+        hit('a', 1.8, [0.0, 1.0]),
+        hit('b', 1.5, [1.0, 0.0]),
+        # indexed before rescore vectors were stored
+        hit('c', 1.4),
+        # from _msearch, without named query scores
+        {'_id': 'd', '_score': 1.0, '_source': {'itemId': 'd', 'titleRescoreVector': encode_rescore_vector([1.0, 0.0])}},
+    ]}}
+
+def cached_query_vectors():
+    cache = EmbeddingCache()
+    cache.put_many({cache_key(EMBEDDING_MODEL_ID, 'search_document', 'Heat'): [1.0, 0.0]})
+    return cache
+
+class RescoreVectorTest(unittest.TestCase):
+
+    def test_field_names(self):
+        self.assertEqual(rescore_vector_field('titleEmbedding'), 'titleRescoreVector')
+        self.assertEqual(rescore_vector_field('title'), 'titleRescoreVector')
+
+    def test_float16_encoding(self):
+        self.assertEqual(decode_rescore_vector(encode_rescore_vector([0.5, -1.25, 3.0, 0.0])), [0.5, -1.25, 3.0, 0.0])
+        decoded = decode_rescore_vector(encode_rescore_vector([0.1, -0.333]))
+        self.assertAlmostEqual(decoded[0], 0.1, delta=1e-3)
+        self.assertAlmostEqual(decoded[1], -0.333, delta=1e-3)
+        # 2 bytes per dimension
+        self.assertEqual(len(base64.b64decode(encode_rescore_vector([0.0] * 1024))), 2048)
+
+    def test_include_rescore_vectors(self):
+        query, _ = search_query()
+        include_rescore_vectors(query)
+        self.assertIn('*Embedding', query['_source']['excludes'])
+        self.assertFalse(any(field.endswith('RescoreVector') for field in query['_source']['excludes']))
+
+    def test_knn_clauses(self):
+        query, _ = search_query()
+        self.assertEqual(get_knn_clauses(query), {'titleEmbedding': ('titleEmbedding_function', 2.0)})
+
+class RescoreSearchResponseTest(unittest.TestCase):
+
+    def test_rescored_order(self):
+        bedrock_runtime = RecordingBedrockRuntime()
+        query, pending_vectors = search_query()
+        response = rescore_search_response(bedrock_runtime, search_response(), query, pending_vectors, 3, cache=cached_query_vectors())
+        hits = response['hits']['hits']
+
+        # a: 2 * (1 + 0) / 2 + 0.3, b: 2 * (1 + 1) / 2 + 0.3, c keeps its score, d is cut by size
+        self.assertEqual([search_hit['_id'] for search_hit in hits], ['b', 'c', 'a'])
+        self.assertAlmostEqual(hits[0]['_score'], 2.3)
+        self.assertAlmostEqual(hits[1]['_score'], 1.7)
+        self.assertAlmostEqual(hits[2]['_score'], 1.3)
+        self.assertAlmostEqual(hits[0]['matched_queries']['titleEmbedding_function'], 2.0)
+        self.assertAlmostEqual(hits[0]['matched_queries']['studio_function'], 0.3)
+        self.assertEqual(response['hits']['max_score'], hits[0]['_score'])
+        self.assertEqual(bedrock_runtime.requests, [])
+
+    def test_rescore_vectors_are_removed(self):
+        query, pending_vectors = search_query()
+        response = search_response()
+        rescore_search_response(RecordingBedrockRuntime(), response, query, pending_vectors, 10, cache=cached_query_vectors())
+        self.assertEqual(len(response['hits']['hits']), 4)
+        for search_hit in response['hits']['hits']:
+            self.assertEqual(list(search_hit['_source']), ['itemId'])
+
+    def test_only_query_texts_are_embedded(self):
+        bedrock_runtime = RecordingBedrockRuntime()
+        query, pending_vectors = search_query()
+        response = rescore_search_response(bedrock_runtime, search_response(), query, pending_vectors, 3, cache=EmbeddingCache())
+        self.assertEqual(bedrock_runtime.requests, [['Heat']])
+        self.assertEqual([search_hit['_id'] for search_hit in response['hits']['hits']], ['b', 'c', 'a'])
+
+    def test_hits_without_stored_vectors_keep_their_order(self):
+        query, pending_vectors = search_query()
+        response = {'hits': {'hits': [hit('a', 1.8), hit('b', 1.5), hit('c', 1.4)]}}
+        rescore_search_response(RecordingBedrockRuntime(), response, query, pending_vectors, 2, cache=cached_query_vectors())
+        self.assertEqual([(search_hit['_id'], round(search_hit['_score'], 6)) for search_hit in response['hits']['hits']], [('a', 2.1), ('b', 1.8)])
+
+if __name__ == '__main__':
+    unittest.main()
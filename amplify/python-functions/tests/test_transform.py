@@ -0,0 +1,94 @@
+"""
+Parity of build_documents, which converts a chunk of rows one column at a time, with the row by row conversion
+ingestItems did before: people columns deduplicated from str(value), values that int() accepts converted with
+int(), and everything else converted with str().
+
+Run from amplify/python-functions with: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ingestItems'))
+
+from transform import build_documents, plan_columns, remove_duplicate_names, to_camel_case
+
+def is_numeric_value(value):
+    try:
+        int(value)
+        return True
+    except (ValueError, TypeError, OverflowError):
+        # infinity failed the whole row before, it is now kept as a string
+        return False
+
+def build_document(frame, position):
+    """The row by row conversion of ingestItems before build_documents"""
+    document = {}
+    for column in frame.columns:
+        raw_value = frame[column].iloc[position]
+        if column.lower() in ['producers', 'directors', 'writers', 'actors']:
+            field_value = remove_duplicate_names(str(raw_value))
+        elif is_numeric_value(raw_value):
+            field_value = int(raw_value)
+        else:
+            field_value = str(raw_value)
+        document[to_camel_case(column)] = field_value
+    return document
+
+# columns as the readers return them: '' for empty cells, values typed by the file format
+FRAME = pd.DataFrame({
+    'movie_title': ['Heat', '', ' 42', '1_000', '3.5', 'nan', '-7', '+8', 'x1'],
+    'release year': [1995, 2001, -3, 0, 2 ** 40, 7, 8, 9, 10],
+    'rating': [7.9, float('nan'), -0.5, 1e15, float('inf'), 2.0, -2.7, 0.0, 3.3],
+    'mixed': [1, '2', 3.7, '', None, True, np.int64(5), float('nan'), 'four'],
+    'in_stock': [True, False, True, True, False, False, True, False, True],
+    'Actors': ['Al Pacino, Robert De Niro, Al Pacino', '', ' ,Val Kilmer,, Val Kilmer', 'Ashley Judd',
+               'Al Pacino, Robert De Niro, Al Pacino', '', 'A,B,A,B', 'A', 'B, A'],
+    'directors': ['Michael Mann'] * 9,
+})
+
+def assert_same_documents(test, documents, expected):
+    test.assertEqual(len(documents), len(expected))
+    for position, (document, expected_document) in enumerate(zip(documents, expected)):
+        test.assertEqual(list(document), list(expected_document), msg=f"row {position}")
+        for field, value in expected_document.items():
+            test.assertEqual(type(document[field]), type(value), msg=f"row {position} {field}")
+            test.assertEqual(document[field], value, msg=f"row {position} {field}")
+
+class BuildDocumentsTest(unittest.TestCase):
+
+    def test_parity_with_row_conversion(self):
+        documents = build_documents(FRAME, plan_columns(list(FRAME.columns)))
+        expected = [build_document(FRAME, position) for position in range(len(FRAME))]
+        assert_same_documents(self, documents, expected)
+
+    def test_chunk_with_offset_index(self):
+        # chunks after the first are indexed by row number
+        chunk = FRAME.iloc[4:].copy()
+        chunk.index = range(104, 104 + len(chunk))
+        documents = build_documents(chunk, plan_columns(list(chunk.columns)))
+        expected = [build_document(chunk, position) for position in range(len(chunk))]
+        assert_same_documents(self, documents, expected)
+
+    def test_examples(self):
+        documents = build_documents(FRAME, plan_columns(list(FRAME.columns)))
+        self.assertEqual(documents[0]['movieTitle'], 'Heat')
+        self.assertEqual(documents[2]['movieTitle'], 42)
+        self.assertEqual(documents[3]['movieTitle'], 1000)
+        self.assertEqual(documents[4]['movieTitle'], '3.5')
+        self.assertEqual(documents[1]['rating'], 'nan')
+        self.assertEqual(documents[4]['rating'], 'inf')
+        self.assertEqual(documents[6]['rating'], -2)
+        self.assertEqual(documents[0]['actors'], 'Al Pacino, Robert De Niro')
+        self.assertEqual(documents[3]['rating'], 10 ** 15)
+        self.assertEqual(documents[4]['mixed'], 'None')
+
+    def test_later_columns_win_for_the_same_field(self):
+        frame = pd.DataFrame([['a', 'b']], columns=['movie_title', 'Movie Title'])
+        self.assertEqual(build_documents(frame, plan_columns(list(frame.columns))), [{'movieTitle': 'b'}])
+
+if __name__ == '__main__':
+    unittest.main()
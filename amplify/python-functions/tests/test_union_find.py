@@ -0,0 +1,66 @@
+"""
+Groups of DisjointSet: the items linked by a chain of matches share one group id, the smallest item id of the
+group, whatever the order the matches were merged in.
+
+Run from amplify/python-functions with: python -m unittest discover tests
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'groupItems'))
+
+from union_find import DisjointSet
+
+# pairs of matching items: {a, b, c, d} through a chain, {e, f} and {g, h, i} through a star
+MATCHES = [('b', 'c'), ('c', 'a'), ('d', 'c'), ('f', 'e'), ('i', 'h'), ('i', 'g')]
+
+GROUPS = {'a': 'a', 'b': 'a', 'c': 'a', 'd': 'a', 'e': 'e', 'f': 'e', 'g': 'g', 'h': 'g', 'i': 'g'}
+
+class DisjointSetTest(unittest.TestCase):
+
+    def test_group_ids(self):
+        disjoint_set = DisjointSet()
+        for first, second in MATCHES:
+            disjoint_set.union(first, second)
+        self.assertEqual(disjoint_set.group_ids(), GROUPS)
+
+    def test_group_ids_do_not_depend_on_merge_order(self):
+        rng = random.Random(0)
+        for _ in range(20):
+            matches = [pair if rng.random() < 0.5 else pair[::-1] for pair in MATCHES]
+            rng.shuffle(matches)
+            disjoint_set = DisjointSet()
+            for first, second in matches:
+                disjoint_set.union(first, second)
+            with self.subTest(matches=matches):
+                self.assertEqual(disjoint_set.group_ids(), GROUPS)
+
+    def test_repeated_and_self_matches(self):
+        disjoint_set = DisjointSet()
+        disjoint_set.union('a', 'a')
+        disjoint_set.union('a', 'b')
+        root = disjoint_set.union('b', 'a')
+        self.assertEqual(disjoint_set.find('a'), root)
+        self.assertEqual(disjoint_set.size[root], 2)
+        self.assertEqual(disjoint_set.group_ids(), {'a': 'a', 'b': 'a'})
+
+    def test_items_without_matches_are_not_stored(self):
+        disjoint_set = DisjointSet()
+        self.assertEqual(disjoint_set.group_ids(), {})
+        disjoint_set.union('x', 'y')
+        self.assertNotIn('z', disjoint_set.group_ids())
+
+    def test_long_chain(self):
+        # union by size and path halving keep a chain of 10,000 matches shallow
+        disjoint_set = DisjointSet()
+        items = [f"item{position:05d}" for position in range(10000)]
+        for first, second in zip(items, items[1:]):
+            disjoint_set.union(second, first)
+        root = disjoint_set.find(items[-1])
+        self.assertEqual(disjoint_set.size[root], len(items))
+        self.assertEqual(set(disjoint_set.group_ids().values()), {'item00000'})
+
+if __name__ == '__main__':
+    unittest.main()
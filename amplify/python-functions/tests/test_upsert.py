@@ -0,0 +1,109 @@
+"""
+Upsert planning: content hashes and deterministic item ids of rows, and what plan_upsert writes for a row
+compared with the documents indexed for its item id (nothing when unchanged, a partial update embedding only
+the changed vector fields, or a new document).
+
+Run from amplify/python-functions with: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+FUNCTIONS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIRECTORY)
+sys.path.insert(0, os.path.join(FUNCTIONS_DIRECTORY, 'ingestItems'))
+
+from upsert import CONTENT_HASH_FIELD, content_hash, plan_upsert, restored_item_id, upsert_item_id
+
+INDEX_NAME = 'films'
+
+VECTOR_FIELDS = ['title', 'plot']
+
+def row(**fields):
+    """A row document of an index keyed by sku, as upsert_chunk builds it, with its content hash and item id"""
+    document = {'sku': 'SKU1', 'title': 'Heat', 'plot': 'A heist', 'year': 1995, **fields}
+    document[CONTENT_HASH_FIELD] = content_hash(document)
+    document['itemId'] = upsert_item_id(INDEX_NAME, document, 'sku')
+    return document
+
+def indexed(document, document_id='doc1'):
+    """The document indexed for a row, as find_indexed_documents returns it (without embeddings)"""
+    return [(document_id, dict(document))]
+
+class ItemIdTest(unittest.TestCase):
+
+    def test_content_hash_ignores_field_order(self):
+        self.assertEqual(content_hash({'a': 1, 'b': 'x'}), content_hash({'b': 'x', 'a': 1}))
+        self.assertNotEqual(content_hash({'a': 1, 'b': 'x'}), content_hash({'a': 2, 'b': 'x'}))
+        self.assertNotEqual(content_hash({'a': 1}), content_hash({'a': '1'}))
+
+    def test_key_item_ids(self):
+        # a corrected row keeps the item id of its key
+        self.assertEqual(upsert_item_id(INDEX_NAME, row(), 'sku'), upsert_item_id(INDEX_NAME, row(title='Heat 2'), 'sku'))
+        self.assertNotEqual(upsert_item_id(INDEX_NAME, row(), 'sku'), upsert_item_id(INDEX_NAME, row(sku='SKU2'), 'sku'))
+        self.assertNotEqual(upsert_item_id(INDEX_NAME, row(), 'sku'), upsert_item_id('other', row(), 'sku'))
+
+    def test_empty_keys_have_no_item_id(self):
+        for value in ['', '  ', 'nan', 'None', None]:
+            with self.subTest(value=value):
+                self.assertIsNone(upsert_item_id(INDEX_NAME, row(sku=value), 'sku'))
+
+    def test_content_item_ids(self):
+        self.assertEqual(upsert_item_id(INDEX_NAME, row()), upsert_item_id(INDEX_NAME, row()))
+        self.assertNotEqual(upsert_item_id(INDEX_NAME, row()), upsert_item_id(INDEX_NAME, row(year=1996)))
+
+    def test_restored_item_id(self):
+        document = row()
+        restored = {
+            **{field: value for field, value in document.items() if field not in [CONTENT_HASH_FIELD, 'itemId']},
+            'itemId': 'exported-id', 'titleEmbedding': [0.1, 0.2], 'titleRescoreVector': 'AAA='
+        }
+        embedding_fields = {'titleEmbedding', 'titleRescoreVector'}
+        # the id uploading the same row gives, from the key or from the content hash of the row fields
+        for key_field in ['sku', None]:
+            with self.subTest(key_field=key_field):
+                self.assertEqual(
+                    restored_item_id(INDEX_NAME, dict(restored), embedding_fields, key_field),
+                    upsert_item_id(INDEX_NAME, document, key_field)
+                )
+        # a document exported from an index in upsert mode keeps its hash
+        restored[CONTENT_HASH_FIELD] = 'exported-hash'
+        restored_item_id(INDEX_NAME, restored, embedding_fields)
+        self.assertEqual(restored[CONTENT_HASH_FIELD], 'exported-hash')
+
+class PlanUpsertTest(unittest.TestCase):
+
+    def test_new_row(self):
+        self.assertEqual(plan_upsert(row(), [], VECTOR_FIELDS), (None, VECTOR_FIELDS, []))
+
+    def test_unchanged_row(self):
+        self.assertIsNone(plan_upsert(row(), indexed(row()), VECTOR_FIELDS))
+
+    def test_changed_field_without_vector(self):
+        self.assertEqual(plan_upsert(row(year=1996), indexed(row()), VECTOR_FIELDS), ('doc1', [], []))
+
+    def test_changed_vector_field(self):
+        document = row(plot='A heist in Los Angeles')
+        self.assertEqual(plan_upsert(document, indexed(row()), VECTOR_FIELDS), ('doc1', ['plot'], []))
+        self.assertNotIn('plotEmbedding', document)
+
+    def test_emptied_vector_field_loses_its_vectors(self):
+        document = row(plot='')
+        self.assertEqual(plan_upsert(document, indexed(row()), VECTOR_FIELDS), ('doc1', ['plot'], []))
+        self.assertIsNone(document['plotEmbedding'])
+        self.assertIsNone(document['plotRescoreVector'])
+
+    def test_removed_fields_are_set_to_null(self):
+        document = row()
+        del document['year']
+        document[CONTENT_HASH_FIELD] = content_hash({'sku': 'SKU1', 'title': 'Heat', 'plot': 'A heist'})
+        self.assertEqual(plan_upsert(document, indexed(row()), VECTOR_FIELDS), ('doc1', [], []))
+        self.assertIn('year', document)
+        self.assertIsNone(document['year'])
+
+    def test_duplicates_are_deleted(self):
+        duplicated = indexed(row()) + indexed(row(), 'doc2') + indexed(row(), 'doc3')
+        self.assertEqual(plan_upsert(row(), duplicated, VECTOR_FIELDS), ('doc1', [], ['doc2', 'doc3']))
+
+if __name__ == '__main__':
+    unittest.main()
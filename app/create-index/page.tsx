@@ -1,13 +1,20 @@
 'use client';
 
 import React, { useState } from 'react';
-import { Container, Typography, Paper, Button, Box, ToggleButtonGroup, ToggleButton, Snackbar, Alert, Table, TableBody, TableCell, TableContainer, TableHead, TableRow } from '@mui/material';
+import { Container, Typography, Paper, Button, Box, ToggleButtonGroup, ToggleButton, Snackbar, Alert, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, Select, MenuItem, FormControlLabel, Checkbox } from '@mui/material';
 import { CloudUpload } from '@mui/icons-material';
 import * as XLSX from 'xlsx';
 import { IndexService } from '../../services/index';
 import { getCurrentUser } from 'aws-amplify/auth';
 
-type FieldType = 'VECTOR' | 'EXACT' | 'IGNORE';
+type FieldType = 'VECTOR' | 'EXACT' | 'IDENTIFIER' | 'IGNORE';
+
+type IndexProfile = 'fast-build' | 'balanced' | 'high-recall';
+type Quantization = 'none' | 'fp16' | 'byte';
+type SpaceType = 'l2' | 'cosinesimil' | 'innerproduct';
+type EmbeddingType = 'float' | 'int8' | 'binary';
+type SearchBackend = 'opensearch' | 'local';
+type IngestMode = 'append' | 'upsert';
 
 interface FieldConfig {
   [key: string]: FieldType;
@@ -18,6 +25,16 @@ export default function CreateIndexPage() {
   const [columns, setColumns] = useState<string[]>([]);
   const [previewData, setPreviewData] = useState<any[][]>([]);
   const [fieldConfig, setFieldConfig] = useState<FieldConfig>({});
+  const [indexProfile, setIndexProfile] = useState<IndexProfile>('balanced');
+  // undefined keeps the setting of the profile
+  const [quantization, setQuantization] = useState<Quantization | undefined>(undefined);
+  const [spaceType, setSpaceType] = useState<SpaceType | undefined>(undefined);
+  const [embeddingType, setEmbeddingType] = useState<EmbeddingType>('float');
+  const [searchBackend, setSearchBackend] = useState<SearchBackend>('opensearch');
+  const [ingestMode, setIngestMode] = useState<IngestMode>('append');
+  // an empty key identifies rows by their content
+  const [upsertKey, setUpsertKey] = useState<string>('');
+  const [deleteMissing, setDeleteMissing] = useState<boolean>(false);
   const [notification, setNotification] = useState<{
     open: boolean;
     message: string;
@@ -85,7 +102,15 @@ export default function CreateIndexPage() {
       const indexData = {
         fileName: selectedFile?.name,
         fieldConfiguration: fieldConfig,
-        columns: columns
+        columns: columns,
+        indexProfile: indexProfile,
+        quantization: quantization,
+        spaceType: spaceType,
+        embeddingType: embeddingType,
+        searchBackend: searchBackend,
+        ingestMode: ingestMode,
+        upsertKey: ingestMode === 'upsert' ? upsertKey || undefined : undefined,
+        deleteMissing: ingestMode === 'upsert' && deleteMissing
       };
       
       await indexService.createIndex(indexData, user.userId);
@@ -169,7 +194,7 @@ export default function CreateIndexPage() {
               Field Configuration
             </Typography>
             <Typography variant="body2" sx={{ mb: 2, fontStyle: 'italic' }}>
-              Configure each field's type: VECTOR (similarity search), EXACT (keyword matching), or IGNORE (exclude from index).
+              Configure each field's type: VECTOR (similarity search), EXACT (keyword matching), IDENTIFIER (keyword matching on an ID such as EIDR or IMDb, where a match is enough to relate two items), or IGNORE (exclude from index).
             </Typography>
             
             <Box sx={{ display: 'grid', gridTemplateColumns: '1fr 2px 1fr', gap: 3, alignItems: 'start' }}>
@@ -191,6 +216,9 @@ export default function CreateIndexPage() {
                       <ToggleButton value="EXACT" color="secondary">
                         EXACT
                       </ToggleButton>
+                      <ToggleButton value="IDENTIFIER" color="success">
+                        IDENTIFIER
+                      </ToggleButton>
                       <ToggleButton value="IGNORE">
                         IGNORE
                       </ToggleButton>
@@ -217,6 +245,9 @@ export default function CreateIndexPage() {
                       <ToggleButton value="EXACT" color="secondary">
                         EXACT
                       </ToggleButton>
+                      <ToggleButton value="IDENTIFIER" color="success">
+                        IDENTIFIER
+                      </ToggleButton>
                       <ToggleButton value="IGNORE">
                         IGNORE
                       </ToggleButton>
@@ -228,6 +259,118 @@ export default function CreateIndexPage() {
           </Box>
         )}
 
+        {columns.length > 0 && (
+          <Box sx={{ mb: 3 }}>
+            <Typography variant="h6" gutterBottom>
+              Index Profile
+            </Typography>
+            <Typography variant="body2" sx={{ mb: 2, fontStyle: 'italic' }}>
+              Trade search recall for build time and memory: FAST BUILD builds quickly with compact fp16 vectors, BALANCED suits most datasets, and HIGH RECALL keeps full precision vectors and a denser graph. Quantization and the similarity space default to the profile's settings. INT8 and BINARY embeddings store compact vectors (4x and 32x smaller) with their own similarity space, and search results are reordered with full precision vectors. IN-PROCESS search answers lookups of small indexes (up to 30,000 items) from a snapshot taken after each upload, without OpenSearch round trips.
+            </Typography>
+            <Box sx={{ display: 'flex', gap: 3, flexWrap: 'wrap', alignItems: 'center' }}>
+              <ToggleButtonGroup
+                value={indexProfile}
+                exclusive
+                onChange={(_, value) => value && setIndexProfile(value)}
+                size="small"
+              >
+                <ToggleButton value="fast-build">FAST BUILD</ToggleButton>
+                <ToggleButton value="balanced">BALANCED</ToggleButton>
+                <ToggleButton value="high-recall">HIGH RECALL</ToggleButton>
+              </ToggleButtonGroup>
+              <ToggleButtonGroup
+                value={embeddingType}
+                exclusive
+                onChange={(_, value) => {
+                  if (value) {
+                    setEmbeddingType(value);
+                    // compact embeddings fix the quantization and similarity space
+                    if (value !== 'float') {
+                      setQuantization(undefined);
+                      setSpaceType(undefined);
+                    }
+                  }
+                }}
+                size="small"
+              >
+                <ToggleButton value="float">FLOAT</ToggleButton>
+                <ToggleButton value="int8">INT8</ToggleButton>
+                <ToggleButton value="binary">BINARY</ToggleButton>
+              </ToggleButtonGroup>
+              <ToggleButtonGroup
+                value={quantization}
+                exclusive
+                onChange={(_, value) => setQuantization(value ?? undefined)}
+                size="small"
+                disabled={embeddingType !== 'float'}
+              >
+                <ToggleButton value="none">FP32</ToggleButton>
+                <ToggleButton value="fp16">FP16</ToggleButton>
+                <ToggleButton value="byte">BYTE</ToggleButton>
+              </ToggleButtonGroup>
+              <ToggleButtonGroup
+                value={spaceType}
+                exclusive
+                onChange={(_, value) => setSpaceType(value ?? undefined)}
+                size="small"
+                disabled={embeddingType !== 'float'}
+              >
+                <ToggleButton value="l2">L2</ToggleButton>
+                <ToggleButton value="cosinesimil">COSINE</ToggleButton>
+                <ToggleButton value="innerproduct">INNER PRODUCT</ToggleButton>
+              </ToggleButtonGroup>
+              <ToggleButtonGroup
+                value={searchBackend}
+                exclusive
+                onChange={(_, value) => value && setSearchBackend(value)}
+                size="small"
+              >
+                <ToggleButton value="opensearch">OPENSEARCH</ToggleButton>
+                <ToggleButton value="local">IN-PROCESS</ToggleButton>
+              </ToggleButtonGroup>
+            </Box>
+          </Box>
+        )}
+
+        {columns.length > 0 && (
+          <Box sx={{ mb: 3 }}>
+            <Typography variant="h6" gutterBottom>
+              Uploads
+            </Typography>
+            <Typography variant="body2" sx={{ mb: 2, fontStyle: 'italic' }}>
+              APPEND adds every row of each uploaded file as a new item. UPSERT identifies rows by a key column (or by their content without one): uploading a corrected file again only updates the rows that changed and only embeds their changed fields, and can delete the items the new file no longer has.
+            </Typography>
+            <Box sx={{ display: 'flex', gap: 3, flexWrap: 'wrap', alignItems: 'center' }}>
+              <ToggleButtonGroup
+                value={ingestMode}
+                exclusive
+                onChange={(_, value) => value && setIngestMode(value)}
+                size="small"
+              >
+                <ToggleButton value="append">APPEND</ToggleButton>
+                <ToggleButton value="upsert">UPSERT</ToggleButton>
+              </ToggleButtonGroup>
+              <Select
+                value={upsertKey}
+                onChange={(event) => setUpsertKey(event.target.value)}
+                size="small"
+                displayEmpty
+                disabled={ingestMode !== 'upsert'}
+              >
+                <MenuItem value="">ROW CONTENT</MenuItem>
+                {columns.map((column) => (
+                  <MenuItem key={column} value={column}>{column}</MenuItem>
+                ))}
+              </Select>
+              <FormControlLabel
+                control={<Checkbox checked={deleteMissing} onChange={(event) => setDeleteMissing(event.target.checked)} />}
+                label="Delete items missing from a new upload"
+                disabled={ingestMode !== 'upsert'}
+              />
+            </Box>
+          </Box>
+        )}
+
         <Box sx={{ display: 'flex', justifyContent: 'flex-end' }}>
           <Button
             variant="contained"
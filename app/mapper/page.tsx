@@ -59,6 +59,16 @@ export default function MapperPage() {
     );
   };
 
+  // one line per matched clause, e.g. "title: 0.93"
+  const formatScoreBreakdown = (breakdown?: Record<string, number | null>) => {
+    if (!breakdown || Object.keys(breakdown).length === 0) {
+      return '';
+    }
+    return Object.entries(breakdown)
+      .map(([field, score]) => score === null ? field : `${field}: ${score.toFixed(2)}`)
+      .join(', ');
+  };
+
   const fetchItems = async () => {
     if (!selectedIndex) {
       setNotification({ open: true, message: 'Please select an index first', severity: 'error' });
@@ -231,6 +241,11 @@ export default function MapperPage() {
                     <Typography variant="body1">
                       <strong>Showing Top {relatedItemsResponse.items.length} Results</strong>
                     </Typography>
+                    {relatedItemsResponse.identifierMatch && (
+                      <Typography variant="body1" sx={{ color: '#2e7d32', fontWeight: 'bold' }}>
+                        Exact identifier match
+                      </Typography>
+                    )}
                   </Box>
                 <TableContainer component={Paper} sx={{ maxHeight: '400px', overflowY: 'auto', overflowX: 'auto' }}>
                   <Table stickyHeader>
@@ -248,7 +263,9 @@ export default function MapperPage() {
                       {relatedItemsResponse.items.map((relatedItem, index) => (
                         <TableRow key={index} sx={{ height: '30px' }}>
                           <TableCell sx={{ fontWeight: 'normal', fontSize: '1.4rem', minWidth: 200 }}>
-                            {relatedItem._score.toFixed(2)}
+                            <Tooltip title={formatScoreBreakdown(relatedItem._scoreBreakdown)} arrow>
+                              <span>{relatedItem._score.toFixed(2)}</span>
+                            </Tooltip>
                           </TableCell>
                           {columns.map((column) => (
                             <TruncatedCell 
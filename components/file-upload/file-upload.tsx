@@ -5,6 +5,12 @@ import { IUserStateReducer } from "../../store/auth";
 import { Box, Button, Typography, List, ListItem, ListItemText } from '@mui/material';
 import { CloudUpload } from '@mui/icons-material';
 
+// formats ingestItems streams in chunks of rows (.xls and .ods workbooks have to be saved as .xlsx first)
+const SUPPORTED_EXTENSIONS = ['.xlsx', '.xlsm', '.csv', '.parquet'];
+
+const isSupportedFile = (file: File) =>
+  SUPPORTED_EXTENSIONS.some(extension => file.name.toLowerCase().endsWith(extension));
+
 interface FileUploadProps {
   onUploadResult: (message: string, severity: 'success' | 'error') => void;
   onFilesSelected?: (files: File[]) => void;
@@ -42,10 +48,7 @@ export default function FileUpload({
 
   const handleFileChange = (event: React.ChangeEvent<HTMLInputElement>) => {
     const selectedFiles = Array.from(event.target.files || []);
-    const excelFiles = selectedFiles.filter(file => 
-      file.type === 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' ||
-      file.type === 'application/vnd.ms-excel'
-    );
+    const excelFiles = selectedFiles.filter(isSupportedFile);
     setFiles(excelFiles);
     if (onFilesSelected) {
       onFilesSelected(excelFiles);
@@ -84,10 +87,7 @@ export default function FileUpload({
   const handleDrop = (event: React.DragEvent<HTMLDivElement>) => {
     event.preventDefault();
     const droppedFiles = Array.from(event.dataTransfer.files);
-    const excelFiles = droppedFiles.filter(file => 
-      file.type === 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' ||
-      file.type === 'application/vnd.ms-excel'
-    );
+    const excelFiles = droppedFiles.filter(isSupportedFile);
     setFiles(excelFiles);
     if (onFilesSelected) {
       onFilesSelected(excelFiles);
@@ -119,10 +119,10 @@ export default function FileUpload({
         >
           <CloudUpload sx={{ fontSize: 48, color: 'rgba(138, 43, 226, 0.6)', mb: 2 }} />
           <Typography variant="h6" gutterBottom sx={{ color: 'rgba(255, 255, 255, 0.9)' }}>
-            Drop Excel files here or click to select
+            Drop spreadsheet files (.xlsx, .csv, .parquet) here or click to select
           </Typography>
           <input
-            accept=".xlsx,.xls"
+            accept={SUPPORTED_EXTENSIONS.join(',')}
             style={{ display: 'none' }}
             id="excel-file-upload"
             multiple
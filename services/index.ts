@@ -15,6 +15,14 @@ export class IndexService {
                     body: {
                         fieldConfiguration: indexData.fieldConfiguration,
                         fileName: indexData.fileName,
+                        indexProfile: indexData.indexProfile,
+                        quantization: indexData.quantization,
+                        spaceType: indexData.spaceType,
+                        embeddingType: indexData.embeddingType,
+                        searchBackend: indexData.searchBackend,
+                        ingestMode: indexData.ingestMode,
+                        upsertKey: indexData.upsertKey,
+                        deleteMissing: indexData.deleteMissing,
                         userId: identityId
                     }
                 }
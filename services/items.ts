@@ -2,7 +2,7 @@ import { vars } from '../amplify/global-variables';
 import { post } from 'aws-amplify/api';
 import outputs from "../amplify_outputs.json";
 import { CommonUtils } from '@/amplify/utils';
-import { IFindRelatedItemsRequest, IFindRelatedItemsResponse } from '@/types/items';
+import { IFindRelatedItemsBatchRequest, IFindRelatedItemsBatchResult, IFindRelatedItemsRequest, IFindRelatedItemsResponse, IGroupItemsProgress, IGroupItemsRequest } from '@/types/items';
 import { generateClient } from 'aws-amplify/data';
 import type { Schema } from '../amplify/data/resource';
 import { IItem } from "../types/items";
@@ -56,7 +56,9 @@ export class ItemsService {
         //@ts-ignore
         totalResults: response._totalResults,
         //@ts-ignore
-        maxScore: response._maxScore
+        maxScore: response._maxScore,
+        //@ts-ignore
+        identifierMatch: response._identifierMatch
       };
 
       console.log(response);
@@ -74,4 +76,67 @@ export class ItemsService {
       }
     }
   }
+
+  // Resolves the related items of several source items of the same index in one request,
+  // returning one result per source item, in order. Meant for scripts and bulk jobs: batch results
+  // carry no per-clause scores and are not rescored or reranked, so the mapper page resolves clicked
+  // rows with findRelatedItems
+  static async findRelatedItemsBatch(request: IFindRelatedItemsBatchRequest): Promise<IFindRelatedItemsBatchResult[]> {
+    try {
+      const {body} = await post({
+        apiName: outputs.custom.apiName,
+        path: vars.API_PATHS.FIND_RELATED_ITEMS_BATCH,
+        options: {
+          //@ts-ignore
+          body: request
+        }
+      }).response;
+
+      const response = await body.json();
+      //@ts-ignore
+      return response._results.map((result: any) => result.error ? { error: result.error } : {
+        items: result._items,
+        totalResults: result._totalResults,
+        maxScore: result._maxScore,
+        identifierMatch: result._identifierMatch
+      });
+    } catch (error) {
+      //@ts-ignore
+      const message = CommonUtils.tryGetErrorFromBackend(error);
+      if(message) {
+        console.error(message);
+        throw new Error(message);
+      } else {
+        console.log(error);
+        throw new Error('Response failed: ' + error);
+      }
+    }
+  }
+
+  // Starts (or resumes) grouping the related items of a whole index, and reports the progress of the job.
+  // Call again with the same index name to poll the progress.
+  static async groupItems(request: IGroupItemsRequest): Promise<IGroupItemsProgress> {
+    try {
+      const {body} = await post({
+        apiName: outputs.custom.apiName,
+        path: vars.API_PATHS.GROUP_ITEMS,
+        options: {
+          //@ts-ignore
+          body: request
+        }
+      }).response;
+
+      return await body.json() as unknown as IGroupItemsProgress;
+    } catch (error) {
+      //@ts-ignore
+      const message = CommonUtils.tryGetErrorFromBackend(error);
+      if(message) {
+        console.error(message);
+        throw new Error(message);
+      } else {
+        console.log(error);
+        throw new Error('Response failed: ' + error);
+      }
+    }
+  }
 }
\ No newline at end of file
@@ -5,15 +5,61 @@ export interface IItem {
 
 export interface IRelatedItem {
     _score: number;
-    _source: IItem
+    _source: IItem;
+    // score of each matched clause by field, null when only the clause names are known (batch results)
+    _scoreBreakdown?: Record<string, number | null>;
 }
 
 export interface IFindRelatedItemsRequest extends IItem {
     opensearchQuery: any;
+    // return OpenSearch explain trees, overriding the explain setting of the search config
+    explain?: boolean;
+    // rerank a wider candidate pool locally with the search config weights and thresholds, see shared/reranking.py
+    rerank?: boolean;
+    // nearest neighbours fetched per vector field when reranking
+    rerankCandidates?: number;
 }
 
 export interface IFindRelatedItemsResponse {
     totalResults: number;
     maxScore: number;
-    items: IRelatedItem[]
+    items: IRelatedItem[];
+    // results come from the exact identifier lookup, without the hybrid search
+    identifierMatch?: boolean;
+}
+
+export interface IFindRelatedItemsBatchRequest {
+    indexName: string;
+    opensearchQuery: any;
+    items: IItem[];
+}
+
+export interface IFindRelatedItemsBatchResult extends Partial<IFindRelatedItemsResponse> {
+    error?: string;
+}
+
+export interface IGroupItemsRequest {
+    indexName: string;
+    minScore?: number;
+    restart?: boolean;
+    writeToOpenSearch?: boolean;
+}
+
+export interface IGroupItemsProgress {
+    indexName: string;
+    jobId: string;
+    status: 'MATCHING' | 'ASSIGNING' | 'COMPLETED';
+    running: boolean;
+    minScore: number;
+    totalItems: number | null;
+    processedItems: number;
+    failedItems: number;
+    matchedPairs: number;
+    assignedItems: number;
+    groups: number;
+    groupedItems: number;
+    opensearchFailedItems: number;
+    percentComplete: number;
+    createdAt: string;
+    updatedAt: string;
 }
\ No newline at end of file